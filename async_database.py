@@ -0,0 +1,113 @@
+"""
+Asynchroniczna fasada bazy danych dla obsługi zdarzeń async def w Flet
+
+AsyncDatabase udostępnia każdą publiczną metodę Database jako korutynę
+wykonywaną na własnej puli wątków - pętla zdarzeń interfejsu nie czeka
+na zapytania:
+
+    adb = AsyncDatabase(db)
+    products = await adb.search_products('śruba')
+
+Anulowanie zadania (task.cancel()) przerywa trwające zapytanie odczytu
+(sqlite3 interrupt). Zapisy przechodzą przez kolejkę Database.write -
+anulowanie przerywa tylko oczekiwanie, zapis kończy się atomowo.
+"""
+import asyncio
+import itertools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+# Metody Database wywoływane bezpośrednio (konfiguracja, bez zapytań do bazy)
+SYNC_METHODS = frozenset({
+    'get_connection', 'track_connections', 'enable_sql_trace', 'disable_sql_trace',
+    'write', 'close', 'product_content_hash', 'reprice_filter',
+    'add_listener', 'remove_listener', 'notify',
+})
+
+
+class AsyncDatabase:
+    """Fasada Database zwracająca korutyny; zapytania na dedykowanej puli wątków"""
+
+    def __init__(self, db, workers: int = 2):
+        """
+        Args:
+            db: Obiekt Database
+            workers: Wątki puli - drugi pozwala szukać w trakcie długiego importu
+        """
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ofertomat-db-async')
+        self._calls: Dict[int, List[sqlite3.Connection]] = {}
+        self._call_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._latest: Dict[str, asyncio.Future] = {}
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.db, name)
+        if name.startswith('_') or name in SYNC_METHODS or not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Wykonuje func(*args, **kwargs) na puli bazy; anulowanie przerywa zapytanie"""
+        call_id = next(self._call_ids)
+        future = self._executor.submit(self._invoke, call_id, func, args, kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Nie rozpoczęte - usunięte z kolejki; trwające - przerwij zapytanie
+            if not future.cancel():
+                self.interrupt(call_id)
+            raise
+
+    def _invoke(self, call_id: int, func: Callable, args, kwargs):
+        connections = []
+        with self._lock:
+            self._calls[call_id] = connections
+        try:
+            with self.db.track_connections(connections):
+                return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                del self._calls[call_id]
+
+    def interrupt(self, call_id: int) -> bool:
+        """Przerywa zapytania trwającego wywołania; False jeśli już się zakończyło"""
+        with self._lock:
+            connections = self._calls.get(call_id)
+            if connections is None:
+                return False
+            for conn in connections:
+                try:
+                    conn.interrupt()
+                except sqlite3.ProgrammingError:
+                    pass  # Połączenie już zamknięte
+        return True
+
+    async def latest(self, key: str, name: str, *args, **kwargs):
+        """
+        Wywołuje metodę name, anulując poprzednie niezakończone wywołanie z tym kluczem
+
+        Do wyszukiwania przy każdym naciśnięciu klawisza - wynik starszego
+        zapytania nie nadpisze nowszego. Zastąpione wywołanie zgłasza CancelledError.
+        """
+        previous = self._latest.get(key)
+        if previous is not None and not previous.done():
+            previous.cancel()
+        task = asyncio.ensure_future(getattr(self, name)(*args, **kwargs))
+        self._latest[key] = task
+        try:
+            return await task
+        finally:
+            if self._latest.get(key) is task:
+                del self._latest[key]
+
+    def close(self):
+        """Zamyka pulę (oczekujące, nierozpoczęte wywołania są anulowane)"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1 @@
+"""Benchmarki wydajnościowe Ofertomatu (uruchamiane poza testami funkcjonalnymi)"""
@@ -0,0 +1,179 @@
+"""
+Test obciążeniowy równoległego dostępu do bazy z wielu procesów
+
+Kilka procesów (każdy z kilkoma wątkami) na przemian dodaje produkty
+i czyta katalog kategorii, a osobny proces w tym czasie wykonuje pełne
+importy cennika. Mierzy przepustowość oraz opóźnienia p50/p99 odczytów,
+zapisów i importów i sprawdza, czy żaden zapis nie został utracony.
+
+Użycie:
+    python benchmarks/contention.py
+    python benchmarks/contention.py --processes 8 --threads 4 --ops 500
+
+Kończy się kodem 1, jeśli któraś operacja zakończyła się błędem.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks import datagen
+
+KINDS = ('read', 'write', 'import')
+
+
+def client_worker(db_path: str, process_no: int, threads: int, ops: int,
+                  write_ratio: float, category_ids: List[int]) -> Tuple[float, float, List]:
+    """Proces klienta: wątki wykonują ops operacji (odczyt kategorii lub dodanie produktu)"""
+    from database import Database
+    db = Database(db_path)
+
+    def run_thread(thread_no):
+        rng = random.Random(process_no * 1000 + thread_no)
+        samples = []
+        for i in range(ops):
+            if rng.random() < write_ratio:
+                kind = 'write'
+                call = lambda: db.add_product(f"C{process_no}_{thread_no}_{i}", f"Produkt testowy {i}",
+                                              'szt.', round(rng.uniform(1, 100), 2), 23.0,
+                                              rng.choice(category_ids))
+            else:
+                kind = 'read'
+                call = lambda: db.get_products(rng.choice(category_ids))
+            start = time.perf_counter()
+            try:
+                ok = call() is not False
+            except sqlite3.Error:
+                ok = False
+            samples.append((kind, time.perf_counter() - start, ok))
+        return samples
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        samples = [s for result in executor.map(run_thread, range(threads)) for s in result]
+    finished = time.time()
+    db.close()
+    return started, finished, samples
+
+
+def import_worker(db_path: str, rounds: int, size: int, category_ids: List[int]) -> Tuple[float, float, List]:
+    """Proces importu: pełne importy cennika ze zmienionymi cenami"""
+    from database import Database
+    db = Database(db_path)
+    samples = []
+    started = time.time()
+    for round_no in range(rounds):
+        products = datagen.make_products(size, category_ids, seed=100 + round_no)
+        start = time.perf_counter()
+        try:
+            db.import_products_batch(products)
+            ok = True
+        except sqlite3.Error:
+            ok = False
+        samples.append(('import', time.perf_counter() - start, ok))
+    finished = time.time()
+    db.close()
+    return started, finished, samples
+
+
+def summarize(samples: List[Tuple[str, float, bool]], wall_seconds: float) -> Dict:
+    """Liczba operacji, błędy i percentyle opóźnień (ms) per rodzaj operacji"""
+    from offer_server import LatencyMetrics
+    result = {'wall_s': round(wall_seconds, 3), 'kinds': {}}
+    for kind in KINDS:
+        latencies = [seconds for k, seconds, _ in samples if k == kind]
+        if not latencies:
+            continue
+        result['kinds'][kind] = {
+            'count': len(latencies),
+            'errors': sum(1 for k, _, ok in samples if k == kind and not ok),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2),
+            'p99_ms': round(LatencyMetrics.percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2),
+        }
+    client_ops = sum(1 for k, _, _ in samples if k != 'import')
+    result['throughput_ops_s'] = round(client_ops / wall_seconds, 1) if wall_seconds else 0.0
+    result['errors'] = sum(stats['errors'] for stats in result['kinds'].values())
+    return result
+
+
+def run_contention(db_path: str, processes: int = 4, threads: int = 4, ops: int = 100,
+                   write_ratio: float = 0.5, products: int = 2000,
+                   import_rounds: int = 2, import_size: int = 2000) -> Dict:
+    """
+    Uruchamia test obciążeniowy na nowej bazie db_path
+
+    Returns:
+        Podsumowanie (summarize) z dodatkowym polem lost_writes - liczbą udanych
+        zapisów, których nie ma w bazie
+    """
+    from database import Database
+    db = Database(db_path)
+    category_ids = datagen.populate_database(db, products)
+    db.close()
+
+    # spawn - procesy potomne nie dziedziczą wątków ani połączeń rodzica
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes + (1 if import_rounds else 0)) as pool:
+        jobs = [pool.apply_async(client_worker, (db_path, n, threads, ops, write_ratio, category_ids))
+                for n in range(processes)]
+        if import_rounds:
+            jobs.append(pool.apply_async(import_worker, (db_path, import_rounds, import_size, category_ids)))
+        results = [job.get() for job in jobs]
+
+    samples = [s for _, _, worker_samples in results for s in worker_samples]
+    wall = max(r[1] for r in results) - min(r[0] for r in results)
+    summary = summarize(samples, wall)
+
+    written = sum(1 for kind, _, ok in samples if kind == 'write' and ok)
+    conn = sqlite3.connect(db_path)
+    stored = conn.execute("SELECT COUNT(*) FROM Products WHERE code LIKE 'C%'").fetchone()[0]
+    conn.close()
+    summary['lost_writes'] = written - stored
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test równoległego dostępu do bazy Ofertomatu")
+    parser.add_argument('--processes', type=int, default=4, help="liczba procesów klientów")
+    parser.add_argument('--threads', type=int, default=4, help="wątki w każdym procesie")
+    parser.add_argument('--ops', type=int, default=100, help="operacje na wątek")
+    parser.add_argument('--write-ratio', type=float, default=0.5, help="udział zapisów (0-1)")
+    parser.add_argument('--products', type=int, default=2000, help="produkty w bazie na starcie")
+    parser.add_argument('--import-rounds', type=int, default=2, help="liczba importów w tle (0 - bez)")
+    parser.add_argument('--import-size', type=int, default=2000, help="wiersze jednego importu")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ofertomat_contention_')
+    try:
+        summary = run_contention(os.path.join(workdir, 'contention.db'), args.processes, args.threads,
+                                 args.ops, args.write_ratio, args.products,
+                                 args.import_rounds, args.import_size)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Procesy: {args.processes} x {args.threads} wątki, czas {summary['wall_s']} s, "
+          f"przepustowość {summary['throughput_ops_s']} op/s")
+    for kind, stats in summary['kinds'].items():
+        print(f"  {kind:<7} {stats['count']:>6} op  p50 {stats['p50_ms']:>8.2f} ms  "
+              f"p99 {stats['p99_ms']:>8.2f} ms  max {stats['max_ms']:>8.2f} ms  błędy {stats['errors']}")
+    print(f"Utracone zapisy: {summary['lost_writes']}")
+    if summary['errors'] or summary['lost_writes']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Generatory syntetycznych danych do benchmarków
+
+Wszystkie generatory są deterministyczne (stałe ziarno), żeby wyniki
+kolejnych uruchomień były porównywalne.
+"""
+import csv
+import random
+from typing import List, Dict
+
+UNITS = ['szt.', 'kg', 'mb', 'm2', 'opak.', 'l']
+VAT_RATES = [23.0, 8.0, 5.0, 0.0]
+WORDS = [
+    'śruba', 'nakrętka', 'podkładka', 'kołek', 'wkręt', 'zawias', 'uchwyt',
+    'profil', 'rura', 'kabel', 'przewód', 'taśma', 'klej', 'farba', 'pędzel',
+    'płyta', 'listwa', 'narożnik', 'kątownik', 'złączka', 'zawór', 'filtr',
+    'ocynkowana', 'nierdzewna', 'mosiężna', 'stalowa', 'biała', 'czarna',
+]
+
+CSV_HEADER = ['Nr', 'Opis', 'Podst. jednostka miary', 'Ostatni koszt bezpośredni',
+              'Tow. grupa księgowa VAT']
+
+
+def product_name(rng: random.Random, i: int) -> str:
+    """Losowa, ale powtarzalna nazwa produktu"""
+    return f"{' '.join(rng.choice(WORDS) for _ in range(3)).capitalize()} {i % 97}x{i % 13}"
+
+
+def make_products(n: int, category_ids: List[int] = None, seed: int = 42) -> List[Dict]:
+    """Lista produktów w formacie DataImporter.import_from_file"""
+    rng = random.Random(seed)
+    category_ids = category_ids or [None]
+    return [
+        {
+            'code': f"P{i:08d}",
+            'name': product_name(rng, i),
+            'unit': rng.choice(UNITS),
+            'purchase_price_net': round(rng.uniform(0.1, 2000.0), 2),
+            'vat_rate': rng.choice(VAT_RATES),
+            'category_id': category_ids[i % len(category_ids)],
+        }
+        for i in range(n)
+    ]
+
+
+def write_csv(path: str, n: int, seed: int = 42) -> str:
+    """Zapisuje plik CSV w formacie eksportu ERP (średnik)"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(CSV_HEADER)
+        for p in make_products(n, seed=seed):
+            writer.writerow([p['code'], p['name'], p['unit'],
+                             f"{p['purchase_price_net']:.2f}", f"{p['vat_rate']:.0f}%"])
+    return path
+
+
+def write_xlsx(path: str, n: int, seed: int = 42) -> str:
+    """Zapisuje plik XLSX (openpyxl write-only)"""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Cennik')
+    ws.append(CSV_HEADER)
+    for p in make_products(n, seed=seed):
+        ws.append([p['code'], p['name'], p['unit'], p['purchase_price_net'], f"{p['vat_rate']:.0f}%"])
+    wb.save(path)
+    return path
+
+
+def populate_database(db, n: int, n_categories: int = 20, seed: int = 42) -> List[int]:
+    """Wypełnia bazę kategoriami i produktami; zwraca ID kategorii"""
+    rng = random.Random(seed)
+    for i in range(n_categories):
+        db.add_category(f"Kategoria {i:03d}", round(rng.uniform(10, 60), 1))
+    category_ids = [c['id'] for c in db.get_categories()]
+    db.import_products_batch(make_products(n, category_ids, seed))
+    return category_ids
+
+
+def populate_category_tree(db, n: int, roots: int = 20, fanout: int = 10, seed: int = 42) -> List[int]:
+    """
+    Wypełnia bazę trzypoziomowym drzewem kategorii i n produktami w liściach
+
+    Co druga podkategoria dziedziczy marżę. Zwraca ID kategorii głównych.
+    """
+    rng = random.Random(seed)
+    level = [(None, "Grupa")]
+    for depth in range(3):
+        names = []
+        for parent_id, prefix in level:
+            for i in range(roots if depth == 0 else fanout):
+                name = f"{prefix} {i:02d}" if depth == 0 else f"{prefix}.{i:02d}"
+                margin = None if depth and i % 2 else round(rng.uniform(10, 60), 1)
+                db.add_category(name, margin, parent_id)
+                names.append(name)
+        ids = {c['name']: c['id'] for c in db.get_categories()}
+        level = [(ids[name], name) for name in names]
+        if depth == 0:
+            root_ids = [category_id for category_id, _ in level]
+    db.import_products_batch(make_products(n, [category_id for category_id, _ in level], seed))
+    return root_ids
+
+
+def populate_customers(db, n: int, category_overrides: int = 20, product_overrides: int = 500,
+                       seed: int = 42) -> List[int]:
+    """Dodaje n klientów z losowymi marżami kategorii i produktów; zwraca ID klientów"""
+    rng = random.Random(seed)
+    category_ids = [c['id'] for c in db.get_categories()]
+    conn = db.get_connection()
+    product_ids = [row[0] for row in conn.execute('SELECT id FROM Products')]
+    conn.close()
+    for i in range(n):
+        db.add_customer(f"Klient {i:03d}")
+    customer_ids = [c['id'] for c in db.get_customers()]
+    for customer_id in customer_ids:
+        for category_id in rng.sample(category_ids, min(category_overrides, len(category_ids))):
+            db.set_customer_category_margin(customer_id, category_id, round(rng.uniform(5, 50), 1))
+        db.set_customer_product_margins(customer_id, {
+            product_id: round(rng.uniform(5, 50), 1)
+            for product_id in rng.sample(product_ids, min(product_overrides, len(product_ids)))})
+    return customer_ids
+
+
+def make_offer_items(n: int, n_categories: int = 10, seed: int = 42) -> List[Dict]:
+    """Pozycje oferty w formacie offer_data['items']"""
+    rng = random.Random(seed)
+    return [
+        {
+            'product_id': i + 1,
+            'name': product_name(rng, i),
+            'unit': rng.choice(UNITS),
+            'quantity': 1.0,
+            'purchase_price_net': round(rng.uniform(0.1, 2000.0), 2),
+            'vat_rate': rng.choice(VAT_RATES),
+            'margin': round(rng.uniform(10, 60), 1),
+            'category_name': f"Kategoria {i % n_categories:03d}",
+        }
+        for i in range(n)
+    ]
+
+
+def make_offer_data(n: int, n_categories: int = 10, seed: int = 42) -> Dict:
+    """Kompletne offer_data dla generatorów PDF/DOCX"""
+    return {
+        'title': 'Oferta handlowa - benchmark',
+        'date': '01.01.2025',
+        'items': make_offer_items(n, n_categories, seed),
+        'business_card': {
+            'company': 'Firma Testowa Sp. z o.o.',
+            'full_name': 'Jan Kowalski',
+            'phone': '+48 600 000 000',
+            'email': 'jan@example.com',
+        },
+    }
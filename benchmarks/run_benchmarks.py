@@ -0,0 +1,456 @@
+"""
+Benchmarki wydajnościowe Ofertomatu (bez interfejsu graficznego)
+
+Mierzy import plików, zapis do bazy, zapytania katalogowe, kalkulację cen
+oraz generatory PDF/DOCX/XLSX/CSV dla kilku rozmiarów danych. Wyniki są zapisywane
+jako JSON i porównywane z zapisaną linią bazową.
+
+Użycie:
+    python benchmarks/run_benchmarks.py                 # pełny zestaw
+    python benchmarks/run_benchmarks.py --quick         # najmniejsze rozmiary
+    python benchmarks/run_benchmarks.py -k search       # tylko pasujące nazwy
+    python benchmarks/run_benchmarks.py --save-baseline # zapisz linię bazową
+
+Kończy się kodem 1, jeśli któryś pomiar jest wolniejszy od linii bazowej
+o więcej niż --tolerance (domyślnie 25%).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks import datagen
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# Zarejestrowane benchmarki: nazwa, funkcja, rozmiary, rozmiary w trybie --quick, powtórzenia
+BENCHMARKS: List[Dict] = []
+
+
+def benchmark(name: str, sizes: List[int], quick_sizes: Optional[List[int]] = None, repeat: int = 5):
+    """
+    Rejestruje benchmark
+
+    Udekorowana funkcja dostaje (size, workdir), przygotowuje dane (czas
+    przygotowania nie jest mierzony) i zwraca funkcję bez argumentów,
+    której wywołanie jest mierzone.
+    """
+    def decorator(func: Callable):
+        BENCHMARKS.append({
+            'name': name,
+            'func': func,
+            'sizes': sizes,
+            'quick_sizes': quick_sizes or sizes[:1],
+            'repeat': repeat,
+        })
+        return func
+    return decorator
+
+
+def measure(run: Callable[[], object], repeat: int) -> Dict:
+    """Wywołuje run() repeat razy (po jednym wywołaniu rozgrzewającym) i zwraca statystyki w ms"""
+    run()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return {
+        'min_ms': min(timings),
+        'median_ms': statistics.median(timings),
+        'mean_ms': statistics.fmean(timings),
+        'repeat': repeat,
+    }
+
+
+# === IMPORT ===
+
+@benchmark('import_from_file.csv', sizes=[1000, 20000], repeat=3)
+def bench_import_csv(size, workdir):
+    from importer import DataImporter
+    path = datagen.write_csv(os.path.join(workdir, f'import_{size}.csv'), size)
+    return lambda: DataImporter.import_from_file(path)
+
+
+@benchmark('import_from_file.xlsx', sizes=[1000, 10000], repeat=3)
+def bench_import_xlsx(size, workdir):
+    from importer import DataImporter
+    path = datagen.write_xlsx(os.path.join(workdir, f'import_{size}.xlsx'), size)
+    return lambda: DataImporter.import_from_file(path)
+
+
+@benchmark('import_products_batch.insert', sizes=[1000, 20000], repeat=3)
+def bench_batch_insert(size, workdir):
+    from database import Database
+    products = datagen.make_products(size)
+    counter = iter(range(10 ** 6))
+
+    def run():
+        # Każde powtórzenie do nowej bazy - mierzymy wstawianie, nie aktualizację
+        db = Database(os.path.join(workdir, f'insert_{size}_{next(counter)}.db'))
+        db.import_products_batch(products)
+    return run
+
+
+@benchmark('import_products_batch.unchanged', sizes=[1000, 20000], repeat=3)
+def bench_batch_unchanged(size, workdir):
+    from database import Database
+    products = datagen.make_products(size)
+    db = Database(os.path.join(workdir, f'unchanged_{size}.db'))
+    db.import_products_batch(products)
+    return lambda: db.import_products_batch(products)
+
+
+# === ZAPYTANIA ===
+
+_populated: Dict[int, object] = {}
+
+
+def populated_database(size, workdir):
+    """Baza z size produktami, współdzielona przez benchmarki zapytań"""
+    if size not in _populated:
+        from database import Database
+        db = Database(os.path.join(workdir, f'catalogue_{size}.db'))
+        category_ids = datagen.populate_database(db, size)
+        _populated[size] = (db, category_ids)
+    return _populated[size]
+
+
+@benchmark('get_products.all', sizes=[10000, 100000])
+def bench_get_products(size, workdir):
+    db, _ = populated_database(size, workdir)
+    return lambda: db.get_products()
+
+
+@benchmark('get_products.category', sizes=[10000, 100000])
+def bench_get_products_category(size, workdir):
+    db, category_ids = populated_database(size, workdir)
+    return lambda: db.get_products(category_ids[len(category_ids) // 2])
+
+
+_category_trees: Dict[int, object] = {}
+
+
+def category_tree_database(size, workdir):
+    """Baza z drzewem 2220 kategorii, size produktami i 100 klientami z własnymi marżami"""
+    if size not in _category_trees:
+        from database import Database
+        db = Database(os.path.join(workdir, f'category_tree_{size}.db'))
+        root_ids = datagen.populate_category_tree(db, size)
+        customer_ids = datagen.populate_customers(db, 100)
+        _category_trees[size] = (db, root_ids, customer_ids)
+    return _category_trees[size]
+
+
+@benchmark('get_products_in_subtrees', sizes=[10000, 100000])
+def bench_get_products_subtree(size, workdir):
+    db, root_ids, _ = category_tree_database(size, workdir)
+    # Jedna gałąź: 110 kategorii na trzech poziomach, marże częściowo dziedziczone
+    return lambda: db.get_products_in_subtrees([root_ids[len(root_ids) // 2]])
+
+
+@benchmark('get_products_in_subtrees.customer', sizes=[10000, 100000])
+def bench_get_products_subtree_customer(size, workdir):
+    db, root_ids, customer_ids = category_tree_database(size, workdir)
+    return lambda: db.get_products_in_subtrees([root_ids[len(root_ids) // 2]], customer_ids[50])
+
+
+@benchmark('resolve_customer_margins', sizes=[10000, 100000])
+def bench_resolve_customer_margins(size, workdir):
+    db, _, customer_ids = category_tree_database(size, workdir)
+    # Marże całego katalogu dla jednego ze 100 klientów (20 kategorii i 500 produktów nadpisanych)
+    return lambda: db.resolve_customer_margins(customer_ids[50])
+
+
+@benchmark('search_products', sizes=[10000, 100000])
+def bench_search_products(size, workdir):
+    db, _ = populated_database(size, workdir)
+    return lambda: db.search_products('śruba')
+
+
+@benchmark('product_index.search', sizes=[100000, 1000000], quick_sizes=[100000])
+def bench_product_index_search(size, workdir):
+    from product_index import ProductIndex
+    index = ProductIndex()
+    index.load((i, product['code'], product['name']) for i, product in enumerate(datagen.make_products(size)))
+    queries = ['śruba', 'P0000123', 'kabel biał']
+
+    def run():
+        # Podpowiedzi dla kodu, słowa i kilku słów - jak przy wpisywaniu w edytorze oferty
+        for query in queries:
+            index.search(query)
+    return run
+
+
+@benchmark('reprice_products.dry_run', sizes=[10000, 100000])
+def bench_reprice_dry_run(size, workdir):
+    db, _ = populated_database(size, workdir)
+    return lambda: db.reprice_products(5.0, dry_run=True)
+
+
+@benchmark('reprice_products', sizes=[10000, 100000], repeat=3)
+def bench_reprice(size, workdir):
+    from database import Database
+    db = Database(os.path.join(workdir, f'reprice_{size}.db'))
+    datagen.populate_database(db, size)
+    counter = iter(range(10 ** 6))
+
+    def run():
+        # Na przemian podwyżka i obniżka - ceny nie uciekają między powtórzeniami
+        assert db.reprice_products(2.0 if next(counter) % 2 else -2.0)['applied']
+    return run
+
+
+# === CENY I GENERATORY ===
+
+@benchmark('calculate_price', sizes=[10000, 100000])
+def bench_calculate_price(size, workdir):
+    from pdf_generator import PDFGenerator
+    gen = PDFGenerator()
+    items = datagen.make_offer_items(size)
+
+    def run():
+        for item in items:
+            gen.calculate_price(item['purchase_price_net'], item['margin'], item['vat_rate'], item['quantity'])
+    return run
+
+
+@benchmark('generate_offer_pdf', sizes=[50, 500], repeat=3)
+def bench_generate_pdf(size, workdir):
+    from pdf_generator import PDFGenerator
+    gen = PDFGenerator()
+    offer_data = datagen.make_offer_data(size)
+    path = os.path.join(workdir, f'offer_{size}.pdf')
+
+    def run():
+        assert gen.generate_offer_pdf(offer_data, path)
+    return run
+
+
+@benchmark('generate_offer_docx', sizes=[50, 500], repeat=3)
+def bench_generate_docx(size, workdir):
+    from docx_generator import DOCXGenerator
+    gen = DOCXGenerator()
+    offer_data = datagen.make_offer_data(size)
+    path = os.path.join(workdir, f'offer_{size}.docx')
+
+    def run():
+        assert gen.generate_offer_docx(offer_data, path)
+    return run
+
+
+@benchmark('render_offer_xlsx', sizes=[500, 10000], repeat=3)
+def bench_render_xlsx(size, workdir):
+    from spreadsheet_generator import SpreadsheetGenerator
+    gen = SpreadsheetGenerator()
+    offer_data = datagen.make_offer_data(size)
+    path = os.path.join(workdir, f'offer_{size}.xlsx')
+    return lambda: gen.render_offer_xlsx(offer_data, path)
+
+
+@benchmark('render_offer_csv', sizes=[500, 10000], repeat=3)
+def bench_render_csv(size, workdir):
+    from spreadsheet_generator import SpreadsheetGenerator
+    gen = SpreadsheetGenerator()
+    offer_data = datagen.make_offer_data(size)
+    path = os.path.join(workdir, f'offer_{size}.csv')
+    return lambda: gen.render_offer_csv(offer_data, path)
+
+
+def one_price_edit(gen_method, offer_data, path):
+    """Każde powtórzenie zmienia marżę jednej pozycji - reszta sekcji z pamięci fragmentów"""
+    item = offer_data['items'][0]
+    counter = iter(range(10 ** 6))
+
+    def run():
+        item['margin'] = 20.0 + next(counter) % 50
+        assert gen_method(offer_data, path)
+    return run
+
+
+@benchmark('generate_offer_pdf.one_edit', sizes=[500, 2000], repeat=3)
+def bench_generate_pdf_one_edit(size, workdir):
+    from pdf_generator import PDFGenerator
+    offer_data = datagen.make_offer_data(size, n_categories=40)
+    return one_price_edit(PDFGenerator().generate_offer_pdf, offer_data,
+                          os.path.join(workdir, f'offer_edit_{size}.pdf'))
+
+
+@benchmark('generate_offer_docx.one_edit', sizes=[500, 2000], repeat=3)
+def bench_generate_docx_one_edit(size, workdir):
+    from docx_generator import DOCXGenerator
+    offer_data = datagen.make_offer_data(size, n_categories=40)
+    return one_price_edit(DOCXGenerator().generate_offer_docx, offer_data,
+                          os.path.join(workdir, f'offer_edit_{size}.docx'))
+
+
+# === INTERFEJS ===
+
+@benchmark('offer_editor.open', sizes=[500, 5000], repeat=5)
+def bench_offer_editor_open(size, workdir):
+    from offer_editor import OfferEditor
+    items = datagen.make_offer_items(size)
+    handlers = dict.fromkeys(('name', 'unit', 'margin', 'net', 'gross'), lambda index, value: None)
+
+    def run():
+        # Otwarcie edytora: kontrolki i polecenia wysyłane do klienta Flet przy pierwszym odświeżeniu
+        editor = OfferEditor(items, handlers, on_remove=lambda index: None, request_update=lambda *c: None)
+        assert editor.control._build_add_commands(index={}, added_controls=[])
+    return run
+
+
+@benchmark('offer_bulk.change_prices', sizes=[300, 10000])
+def bench_offer_bulk(size, workdir):
+    import offer_bulk
+    items = datagen.make_offer_items(size)
+    indices = range(size)
+    return lambda: offer_bulk.change_prices(items, indices, 5.0)
+
+
+# === URUCHAMIANIE ===
+
+def run_benchmarks(quick: bool = False, keyword: Optional[str] = None,
+                   include_startup: bool = True, verbose: bool = True) -> Dict:
+    """
+    Uruchamia zarejestrowane benchmarki
+
+    Returns:
+        Słownik {'meta': {...}, 'results': {'nazwa[rozmiar]': statystyki}}
+    """
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='ofertomat_bench_')
+    try:
+        for bench in BENCHMARKS:
+            if keyword and keyword not in bench['name']:
+                continue
+            for size in (bench['quick_sizes'] if quick else bench['sizes']):
+                key = f"{bench['name']}[{size}]"
+                run = bench['func'](size, workdir)
+                results[key] = measure(run, bench['repeat'])
+                if verbose:
+                    print(f"  {key:<45} {results[key]['min_ms']:>10.2f} ms (min)")
+    finally:
+        _populated.clear()
+        _category_trees.clear()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if include_startup and (not keyword or keyword in 'startup.import_main'):
+        from benchmarks.startup_importtime import measure_startup
+        startup = measure_startup('main', runs=3)
+        results['startup.import_main[1]'] = {
+            'min_ms': startup['cumulative_ms'],
+            'median_ms': startup['cumulative_ms'],
+            'mean_ms': startup['cumulative_ms'],
+            'repeat': 3,
+        }
+        if verbose:
+            print(f"  {'startup.import_main[1]':<45} {startup['cumulative_ms']:>10.2f} ms (min)")
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def compare_results(current: Dict, baseline: Dict, tolerance: float = 0.25,
+                    min_delta_ms: float = 1.0) -> List[Dict]:
+    """
+    Porównuje najlepsze czasy (min) z linią bazową - minimum jest najmniej
+    wrażliwe na obciążenie maszyny
+
+    Pomiar jest regresją, jeśli jest wolniejszy o więcej niż tolerance
+    (względnie) i o więcej niż min_delta_ms (bezwzględnie - szum pomiaru).
+
+    Returns:
+        Lista porównań: name, baseline_ms, current_ms, ratio, regression
+    """
+    comparisons = []
+    for key, stats in current['results'].items():
+        base = baseline.get('results', {}).get(key)
+        if not base:
+            continue
+        ratio = stats['min_ms'] / base['min_ms'] if base['min_ms'] > 0 else 1.0
+        comparisons.append({
+            'name': key,
+            'baseline_ms': base['min_ms'],
+            'current_ms': stats['min_ms'],
+            'ratio': ratio,
+            'regression': ratio > 1 + tolerance and stats['min_ms'] - base['min_ms'] > min_delta_ms,
+        })
+    return comparisons
+
+
+def save_json(data: Dict, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarki wydajnościowe Ofertomatu")
+    parser.add_argument('--quick', action='store_true', help="tylko najmniejsze rozmiary")
+    parser.add_argument('-k', dest='keyword', help="uruchom benchmarki zawierające tekst")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="plik linii bazowej")
+    parser.add_argument('--save-baseline', action='store_true', help="zapisz wynik jako linię bazową")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="dopuszczalne spowolnienie (0.25 = 25%%)")
+    parser.add_argument('--output', help="plik wyników (domyślnie benchmarks/results/<data>.json)")
+    args = parser.parse_args()
+
+    # Generatory szukają logo względem katalogu roboczego
+    os.chdir(ROOT_DIR)
+
+    print("Benchmarki Ofertomatu")
+    current = run_benchmarks(quick=args.quick, keyword=args.keyword)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    save_json(current, output)
+    save_json(current, os.path.join(RESULTS_DIR, 'latest.json'))
+    print(f"\nWyniki zapisane: {output}")
+
+    if args.save_baseline:
+        save_json(current, args.baseline)
+        print(f"Linia bazowa zapisana: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("Brak linii bazowej - uruchom z --save-baseline, aby ją zapisać")
+        return
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    comparisons = compare_results(current, baseline, args.tolerance)
+    print(f"\nPorównanie z linią bazową ({baseline['meta']['timestamp']}):")
+    for c in comparisons:
+        mark = '✗' if c['regression'] else '✓'
+        print(f"  {mark} {c['name']:<45} {c['baseline_ms']:>10.2f} -> {c['current_ms']:>10.2f} ms "
+              f"({(c['ratio'] - 1) * 100:+.0f}%)")
+
+    regressions = [c for c in comparisons if c['regression']]
+    if regressions:
+        print(f"\n✗ Regresje wydajności: {len(regressions)}")
+        sys.exit(1)
+    print("\n✓ Brak regresji")
+
+
+if __name__ == '__main__':
+    main()
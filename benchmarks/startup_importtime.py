@@ -0,0 +1,121 @@
+"""
+Benchmark zimnego startu aplikacji oparty o `python -X importtime`
+
+Uruchamia `import main` w świeżym interpreterze i sprawdza, czy:
+- skumulowany czas importu modułu main mieści się w budżecie,
+- żaden ciężki moduł (pandas, reportlab, python-docx, openpyxl) nie jest
+  ładowany przed pierwszym wyrenderowaniem widoku.
+
+Użycie:
+    python benchmarks/startup_importtime.py [--budget-ms 1000] [--runs 3]
+
+Kończy się kodem 1, jeśli start uległ regresji.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Moduły, które mają być ładowane leniwie (pierwsze użycie lub wątek w tle)
+HEAVY_MODULES = ('pandas', 'numpy', 'reportlab', 'docx', 'openpyxl')
+
+# Budżet skumulowanego czasu importu `main` (większość to sam flet)
+DEFAULT_BUDGET_MS = float(os.environ.get('OFERTOMAT_STARTUP_BUDGET_MS', 1000))
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """
+    Parsuje wyjście `-X importtime`
+
+    Returns:
+        Słownik {nazwa modułu: skumulowany czas w mikrosekundach}
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative = int(parts[1].strip())
+        except ValueError:
+            continue  # Wiersz nagłówka
+        modules[parts[2].strip()] = cumulative
+    return modules
+
+
+def measure_startup(module: str = 'main', runs: int = 3) -> Dict:
+    """
+    Mierzy import modułu w świeżych interpreterach
+
+    Returns:
+        Słownik z kluczami:
+        - cumulative_ms: float (najlepszy z pomiarów)
+        - heavy_modules: List[str] (ciężkie moduły załadowane przy starcie)
+    """
+    best_us = None
+    heavy = set()
+    for _ in range(max(1, runs)):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='replace'
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"Import modułu {module} nie powiódł się:\n{result.stderr[-2000:]}")
+
+        modules = parse_importtime(result.stderr)
+        if module not in modules:
+            raise RuntimeError(f"Brak pomiaru dla modułu {module}")
+
+        if best_us is None or modules[module] < best_us:
+            best_us = modules[module]
+        heavy.update(name for name in modules if name.split('.')[0] in HEAVY_MODULES)
+
+    return {
+        'cumulative_ms': best_us / 1000.0,
+        'heavy_modules': sorted(heavy)
+    }
+
+
+def check_startup(result: Dict, budget_ms: float = DEFAULT_BUDGET_MS) -> List[str]:
+    """Zwraca listę wykrytych regresji startu (pusta = OK) dla wyniku measure_startup"""
+    problems = []
+
+    top_level = sorted({name.split('.')[0] for name in result['heavy_modules']})
+    if top_level:
+        problems.append(f"Ciężkie moduły ładowane przy starcie: {', '.join(top_level)}")
+
+    if result['cumulative_ms'] > budget_ms:
+        problems.append(
+            f"Import main trwa {result['cumulative_ms']:.0f} ms (budżet {budget_ms:.0f} ms)"
+        )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark zimnego startu Ofertomatu")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    result = measure_startup('main', args.runs)
+    print(f"Import main: {result['cumulative_ms']:.1f} ms (budżet {args.budget_ms:.0f} ms)")
+
+    problems = check_startup(result, args.budget_ms)
+    for problem in problems:
+        print(f"✗ {problem}")
+    if problems:
+        sys.exit(1)
+    print("✓ Start aplikacji bez regresji")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Wybór kategorii do oferty w postaci drzewa
+
+Kategorie przychodzą w kolejności Database.get_category_tree() (rodzic przed
+podkategoriami), więc poddrzewo kategorii to ciągły zakres listy. Kontrolki
+powstają tylko dla wierszy rozwiniętych gałęzi - przy tysiącach kategorii
+na starcie widać same kategorie główne.
+
+Zaznaczenie kategorii zaznacza całe poddrzewo, odznaczenie odznacza też
+przodków. Zaznaczona kategoria oznacza więc zawsze całą gałąź, a do bazy
+trafiają tylko najwyżej położone zaznaczone kategorie (selected_ids).
+"""
+from typing import Callable, Dict, List, Optional, Set
+
+import flet as ft
+
+INDENT = 24
+
+
+class CategoryTreeSelector:
+    """Drzewo kategorii z polami wyboru i zwijaniem gałęzi"""
+
+    def __init__(self, categories: List[Dict], request_update: Callable, indent: int = INDENT):
+        """
+        Args:
+            categories: Kategorie z Database.get_category_tree() (pola id, name, depth)
+            request_update: Odświeżenie kontrolek (UpdateScheduler.request)
+            indent: Wcięcie podkategorii w pikselach na poziom
+        """
+        self.categories = categories
+        self.request_update = request_update
+        self.indent = indent
+        # Indeksy kategorii na liście categories
+        self.checked: Set[int] = set()
+        self.expanded: Set[int] = set()
+        self._ends, self._parents = self._tree_ranges(categories)
+        self._rows: Dict[int, ft.Control] = {}
+        self._checkboxes: Dict[int, ft.Checkbox] = {}
+        self._expand_buttons: Dict[int, ft.IconButton] = {}
+        self.control = ft.Column(spacing=0)
+        self.control.controls = [self._row(index) for index in self.visible()]
+
+    @staticmethod
+    def _tree_ranges(categories: List[Dict]):
+        """Koniec poddrzewa (indeks za ostatnim potomkiem) i rodzic każdej kategorii"""
+        ends = [len(categories)] * len(categories)
+        parents: List[Optional[int]] = [None] * len(categories)
+        stack: List[int] = []
+        for index, category in enumerate(categories):
+            while stack and categories[stack[-1]]['depth'] >= category['depth']:
+                ends[stack.pop()] = index
+            parents[index] = stack[-1] if stack else None
+            stack.append(index)
+        return ends, parents
+
+    def children(self, index: Optional[int]) -> List[int]:
+        """Indeksy bezpośrednich podkategorii (None - kategorie główne)"""
+        child, end = (0, len(self.categories)) if index is None else (index + 1, self._ends[index])
+        result = []
+        while child < end:
+            result.append(child)
+            child = self._ends[child]
+        return result
+
+    def visible(self) -> List[int]:
+        """Indeksy wierszy widocznych przy bieżącym rozwinięciu gałęzi"""
+        result = []
+        stack = list(reversed(self.children(None)))
+        while stack:
+            index = stack.pop()
+            result.append(index)
+            if index in self.expanded:
+                stack.extend(reversed(self.children(index)))
+        return result
+
+    def selected_ids(self) -> List[int]:
+        """ID najwyżej położonych zaznaczonych kategorii (każda oznacza całą gałąź)"""
+        result = []
+        index = 0
+        while index < len(self.categories):
+            if index in self.checked:
+                result.append(self.categories[index]['id'])
+                index = self._ends[index]
+            else:
+                index += 1
+        return result
+
+    def toggle_expanded(self, index: int):
+        """Rozwija lub zwija gałąź"""
+        self.expanded ^= {index}
+        if index in self._expand_buttons:
+            self._expand_buttons[index].icon = "expand_more" if index in self.expanded else "chevron_right"
+        self.control.controls = [self._row(i) for i in self.visible()]
+        self.request_update(self.control)
+
+    def set_checked(self, index: int, value: bool):
+        """Zaznacza lub odznacza gałąź (odznaczenie zdejmuje też zaznaczenie przodków)"""
+        changed = set(range(index, self._ends[index]))
+        if value:
+            self.checked |= changed
+        else:
+            parent = self._parents[index]
+            while parent is not None:
+                changed.add(parent)
+                parent = self._parents[parent]
+            self.checked -= changed
+        for i in changed:
+            if i in self._checkboxes:
+                self._checkboxes[i].value = i in self.checked
+        self.request_update(self.control)
+
+    def _row(self, index: int) -> ft.Control:
+        if index not in self._rows:
+            category = self.categories[index]
+            checkbox = ft.Checkbox(
+                label=category['name'],
+                value=index in self.checked,
+                data=index,
+                on_change=lambda e: self.set_checked(e.control.data, e.control.value),
+            )
+            self._checkboxes[index] = checkbox
+            if self._ends[index] > index + 1:
+                toggle = ft.IconButton(
+                    icon="expand_more" if index in self.expanded else "chevron_right",
+                    tooltip="Podkategorie",
+                    data=index,
+                    on_click=lambda e: self.toggle_expanded(e.control.data),
+                )
+                self._expand_buttons[index] = toggle
+            else:
+                toggle = ft.Container(width=40)
+            self._rows[index] = ft.Container(
+                content=ft.Row([toggle, checkbox], spacing=0),
+                padding=ft.padding.only(left=self.indent * category['depth']),
+            )
+        return self._rows[index]
@@ -1,30 +1,167 @@
+import hashlib
+import json
+import os
 import sqlite3
-import time
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
+from instrumentation import instrumented, result_count
+from db_writer import BusyPolicy, WriteQueue
+from sql_trace import SQLTracer, TracedConnection
+
+# Reguły zaokrąglania nowych cen w reprice_products ({price} - wyrażenie SQL z ceną)
+ROUNDING_RULES = {
+    'none': '{price}',
+    'cents': 'ROUND({price}, 2)',
+    'whole': 'ROUND({price}, 0)',
+    # Najmniejsza cena z końcówką ,99 nie niższa od ceny zaokrąglonej do groszy
+    'ending_99': 'ROUND(CAST({price} + 0.005 AS INTEGER) + 0.99, 2)',
+}
+
+# Marża produktu p dla klienta :customer_id (NULL - bez klienta) w kolejności: nadpisanie
+# produktu, nadpisanie najbliższej kategorii w gałęzi, marża kategorii (CategoryMargins)
+CUSTOMER_MARGIN_JOINS = '''
+    LEFT JOIN CategoryMargins m ON m.category_id = p.category_id
+    LEFT JOIN CustomerProductMargins pm ON pm.customer_id = :customer_id AND pm.product_id = p.id
+    LEFT JOIN (
+        SELECT t.descendant_id AS category_id, o.margin, MIN(t.depth) AS depth
+        FROM CustomerCategoryMargins o
+        JOIN CategoryTree t ON t.ancestor_id = o.category_id
+        WHERE o.customer_id = :customer_id
+        GROUP BY t.descendant_id
+    ) cm ON cm.category_id = p.category_id
+'''
+CUSTOMER_MARGIN_COLUMNS = '''
+    COALESCE(pm.margin, cm.margin, m.margin) AS default_margin,
+    CASE WHEN pm.margin IS NOT NULL THEN 'product' WHEN cm.margin IS NOT NULL THEN 'customer_category'
+         ELSE 'category' END AS margin_source
+'''
+
+# Domyślny parent_id w update_category - kategoria zostaje pod dotychczasowym rodzicem
+_KEEP_PARENT = object()
+
 
 class Database:
-    def __init__(self, db_path: str = "ofertomat.db"):
+    def __init__(self, db_path: str = "ofertomat.db", trace_sql: Optional[bool] = None,
+                 slow_query_ms: float = 100.0, busy_policy: Optional[BusyPolicy] = None):
+        """
+        Args:
+            db_path: Ścieżka do pliku bazy
+            trace_sql: Śledzenie zapytań SQL (domyślnie wg OFERTOMAT_SQL_TRACE=1)
+            slow_query_ms: Próg logowania wolnych zapytań z planem wykonania
+            busy_policy: Obsługa zajętej bazy przez zapisy (domyślnie BusyPolicy())
+        """
         self.db_path = db_path
+        self.sql_tracer: Optional[SQLTracer] = None
+        # Wszystkie zapisy przechodzą przez jeden wątek (db_writer.WriteQueue)
+        self.writer = WriteQueue(self.get_connection, busy_policy=busy_policy)
+        # Połączenia otwierane w wątku są dopisywane do listy (track_connections)
+        self._local = threading.local()
+        # Obserwatorzy zmian katalogu (add_listener)
+        self._listeners: List[Callable[[str, Dict], None]] = []
+        if trace_sql is None:
+            trace_sql = os.environ.get('OFERTOMAT_SQL_TRACE', '') == '1'
+        if trace_sql:
+            self.enable_sql_trace(slow_query_ms)
         self.init_database()
     
+    def enable_sql_trace(self, slow_query_ms: float = 100.0) -> SQLTracer:
+        """Włącza śledzenie zapytań dla kolejnych połączeń"""
+        if self.sql_tracer is None:
+            self.sql_tracer = SQLTracer(slow_query_ms)
+        else:
+            self.sql_tracer.slow_query_ms = slow_query_ms
+        return self.sql_tracer
+    
+    def disable_sql_trace(self):
+        """Wyłącza śledzenie zapytań (zebrane statystyki przepadają)"""
+        self.sql_tracer = None
+    
+    def write(self, op):
+        """
+        Wykonuje operację zapisu op(cursor) w wątku zapisującym i zwraca jej wynik
+        
+        Operacja nie wywołuje commit - jest zatwierdzana razem z innymi
+        oczekującymi zapisami. Wyjątek operacji (np. IntegrityError) cofa
+        tylko ją i jest zgłaszany tutaj.
+        """
+        return self.writer.execute(op)
+    
+    def close(self):
+        """Kończy wątek zapisujący (po wykonaniu oczekujących zapisów)"""
+        self.writer.close()
+    
+    def add_listener(self, listener: Callable[[str, Dict], None]):
+        """
+        Rejestruje obserwatora zmian katalogu wywoływanego po zatwierdzeniu zapisu
+        
+        listener(zdarzenie, dane), zdarzenia:
+            products_saved - dodane/zmienione produkty: {'codes': [...]} lub {'ids': [...]}
+            products_deleted - {'ids': [...]}
+            prices_changed - zbiorcza zmiana cen zakupu: {}
+            categories_changed - {}
+            customers_changed - klienci i ich marże: {'ids': [...]}
+        
+        Widoczne są tylko zapisy wykonane przez ten obiekt Database.
+        """
+        self._listeners.append(listener)
+    
+    def remove_listener(self, listener: Callable[[str, Dict], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+    
+    def notify(self, event: str, **data):
+        """Powiadamia obserwatorów o zmianie (błąd obserwatora nie przerywa zapisu)"""
+        for listener in list(self._listeners):
+            try:
+                listener(event, data)
+            except Exception as e:
+                print(f"Błąd obsługi zmiany bazy ({event}): {e}")
+    
     def get_connection(self):
         """Tworzy połączenie z bazą danych"""
-        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        tracer = self.sql_tracer
+        if tracer is None:
+            conn = sqlite3.connect(self.db_path, timeout=10.0)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=10.0, factory=TracedConnection)
+            tracer.attach(conn)
         conn.row_factory = sqlite3.Row
+        tracked = getattr(self._local, 'connections', None)
+        if tracked is not None:
+            tracked.append(conn)
         return conn
     
+    @contextmanager
+    def track_connections(self, connections: list):
+        """
+        Dopisuje do connections połączenia otwarte w bieżącym wątku w trakcie bloku
+        
+        Pozwala przerwać trwające zapytanie z innego wątku (conn.interrupt()).
+        """
+        previous = getattr(self._local, 'connections', None)
+        self._local.connections = connections
+        try:
+            yield connections
+        finally:
+            self._local.connections = previous
+    
     def init_database(self):
         """Inicjalizuje bazę danych z tabelami"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL - odczyty nie czekają na zapis (ustawienie zapamiętywane w pliku bazy)
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Tabela Categories
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS Categories (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL UNIQUE,
-                default_margin REAL DEFAULT 0.0
+                default_margin REAL DEFAULT 0.0,
+                parent_id INTEGER REFERENCES Categories(id)
             )
         ''')
         
@@ -60,72 +197,285 @@ class Database:
             cursor.execute("ALTER TABLE BusinessCard ADD COLUMN company TEXT")
             print("Dodano kolumnę 'company' do tabeli BusinessCard")
         
+        # Migracja: dodaj kolumnę content_hash (wykrywanie zmian przy imporcie)
+        cursor.execute("PRAGMA table_info(Products)")
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'content_hash' not in columns:
+            cursor.execute("ALTER TABLE Products ADD COLUMN content_hash TEXT")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_category ON Products(category_id)')
+        
+        # Migracja: kategoria nadrzędna (drzewo kategorii; NULL - kategoria główna)
+        cursor.execute("PRAGMA table_info(Categories)")
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'parent_id' not in columns:
+            cursor.execute("ALTER TABLE Categories ADD COLUMN parent_id INTEGER REFERENCES Categories(id)")
+        
+        # Tabela CategoryTree - domknięcie drzewa: każda para (przodek, potomek) z odległością,
+        # także kategoria sama dla siebie (depth 0). Poddrzewo to wyszukanie po ancestor_id.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS CategoryTree (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_category_tree_descendant ON CategoryTree(descendant_id, depth)
+        ''')
+        
+        # Widok CategoryMargins - marża po dziedziczeniu: własna, a gdy NULL - najbliższego
+        # przodka z ustawioną marżą (MIN(depth) wybiera wiersz, z którego pochodzi margin)
+        cursor.execute('''
+            CREATE VIEW IF NOT EXISTS CategoryMargins AS
+            SELECT t.descendant_id AS category_id, a.default_margin AS margin, MIN(t.depth) AS depth
+            FROM CategoryTree t
+            JOIN Categories a ON a.id = t.ancestor_id
+            WHERE a.default_margin IS NOT NULL
+            GROUP BY t.descendant_id
+        ''')
+        
+        # Tabela ImportedFiles - skróty zaimportowanych plików
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ImportedFiles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_digest TEXT NOT NULL,
+                category_id INTEGER,
+                file_name TEXT,
+                rows INTEGER,
+                imported_at TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_imported_files_digest ON ImportedFiles(file_digest)
+        ''')
+        
+        # Tabela PriceHistory - poprzednie ceny zakupu po zbiorczych zmianach cen
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS PriceHistory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL,
+                old_price REAL,
+                new_price REAL,
+                changed_at TEXT,
+                reason TEXT,
+                FOREIGN KEY (product_id) REFERENCES Products(id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_price_history_product ON PriceHistory(product_id)
+        ''')
+        
         # Dodaj domyślną kategorię jeśli baza jest pusta
         cursor.execute('SELECT COUNT(*) as count FROM Categories')
         if cursor.fetchone()['count'] == 0:
             cursor.execute('INSERT INTO Categories (name, default_margin) VALUES (?, ?)', 
                          ('Bez kategorii', 30.0))
         
+        # Klienci i ich marże (nadpisują marże kategorii w ofercie dla klienta)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS Customers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS CustomerCategoryMargins (
+                customer_id INTEGER NOT NULL REFERENCES Customers(id),
+                category_id INTEGER NOT NULL REFERENCES Categories(id),
+                margin REAL NOT NULL,
+                PRIMARY KEY (customer_id, category_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS CustomerProductMargins (
+                customer_id INTEGER NOT NULL REFERENCES Customers(id),
+                product_id INTEGER NOT NULL REFERENCES Products(id),
+                margin REAL NOT NULL,
+                PRIMARY KEY (customer_id, product_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Kategorie bez wpisów w CategoryTree (baza sprzed drzewa kategorii)
+        cursor.execute('SELECT COUNT(*) FROM Categories')
+        categories = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM CategoryTree WHERE depth = 0')
+        if cursor.fetchone()[0] != categories:
+            self._rebuild_category_tree(cursor)
+        
         conn.commit()
         conn.close()
     
     # === KATEGORIE ===
     
-    def add_category(self, name: str, default_margin: float) -> bool:
-        """Dodaje nową kategorię"""
-        conn = None
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO Categories (name, default_margin) VALUES (?, ?)', 
-                         (name, default_margin))
-            conn.commit()
+    @instrumented()
+    def add_category(self, name: str, default_margin: Optional[float], parent_id: Optional[int] = None) -> bool:
+        """
+        Dodaje nową kategorię
+        
+        default_margin None - marża dziedziczona po kategorii nadrzędnej
+        (kategoria główna musi mieć własną marżę).
+        """
+        if default_margin is None and parent_id is None:
+            raise ValueError("Kategoria główna musi mieć marżę")
+        
+        def op(cursor):
+            cursor.execute('INSERT INTO Categories (name, default_margin, parent_id) VALUES (?, ?, ?)', 
+                         (name, default_margin, parent_id))
+            category_id = cursor.lastrowid
+            cursor.execute('INSERT INTO CategoryTree (ancestor_id, descendant_id, depth) VALUES (?, ?, 0)',
+                         (category_id, category_id))
+            if parent_id is not None:
+                self._attach_subtree(cursor, category_id, parent_id)
             return True
+        
+        try:
+            self.write(op)
         except sqlite3.IntegrityError:
             return False
-        finally:
-            if conn:
-                conn.close()
+        self.notify('categories_changed')
+        return True
     
+    @instrumented(rows=result_count)
     def get_categories(self) -> List[Dict]:
-        """Pobiera wszystkie kategorie"""
-        with self.get_connection() as conn:
+        """Pobiera wszystkie kategorie (effective_margin - marża po dziedziczeniu)"""
+        conn = self.get_connection()
+        try:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM Categories ORDER BY name')
-            categories = [dict(row) for row in cursor.fetchall()]
-        return categories
+            cursor.execute('''
+                SELECT c.*, m.margin AS effective_margin
+                FROM Categories c
+                LEFT JOIN CategoryMargins m ON m.category_id = c.id
+                ORDER BY c.name
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
     
-    def update_category(self, category_id: int, name: str, default_margin: float) -> bool:
-        """Aktualizuje kategorię"""
-        conn = None
-        retries = 3
-        for attempt in range(retries):
-            try:
-                conn = self.get_connection()
-                cursor = conn.cursor()
-                cursor.execute('UPDATE Categories SET name = ?, default_margin = ? WHERE id = ?',
-                             (name, default_margin, category_id))
-                conn.commit()
-                return True
-            except sqlite3.IntegrityError:
+    def get_category_tree(self) -> List[Dict]:
+        """
+        Kategorie w kolejności drzewa: rodzic przed podkategoriami, rodzeństwo wg nazwy
+        
+        Dodatkowe pola: depth (0 - kategoria główna), children (liczba podkategorii).
+        """
+        categories = self.get_categories()
+        children: Dict[Optional[int], List[Dict]] = {}
+        for category in categories:
+            children.setdefault(category['parent_id'], []).append(category)
+        
+        tree = []
+        stack = [(category, 0) for category in reversed(children.get(None, []))]
+        while stack:
+            category, depth = stack.pop()
+            subcategories = children.get(category['id'], [])
+            category['depth'] = depth
+            category['children'] = len(subcategories)
+            tree.append(category)
+            stack.extend((child, depth + 1) for child in reversed(subcategories))
+        return tree
+    
+    @instrumented()
+    def update_category(self, category_id: int, name: str, default_margin: Optional[float],
+                        parent_id: Optional[int] = _KEEP_PARENT) -> bool:
+        """
+        Aktualizuje kategorię (default_margin None - marża dziedziczona)
+        
+        Podany parent_id przenosi też kategorię (jak move_category) - przeniesienie
+        i zmiana nazwy są zapisywane razem albo wcale. Zwraca False, gdy nazwa jest
+        zajęta lub parent_id leży w przenoszonym poddrzewie.
+        """
+        def op(cursor):
+            if parent_id is not _KEEP_PARENT:
+                cursor.execute('SELECT parent_id FROM Categories WHERE id = ?', (category_id,))
+                row = cursor.fetchone()
+                if row is not None and row['parent_id'] != parent_id \
+                        and not self._move_subtree(cursor, category_id, parent_id):
+                    return False
+            if default_margin is None:
+                cursor.execute('SELECT parent_id FROM Categories WHERE id = ?', (category_id,))
+                row = cursor.fetchone()
+                if row is not None and row['parent_id'] is None:
+                    raise ValueError("Kategoria główna musi mieć marżę")
+            cursor.execute('UPDATE Categories SET name = ?, default_margin = ? WHERE id = ?',
+                         (name, default_margin, category_id))
+            return True
+        
+        try:
+            if not self.write(op):
                 return False
-            except sqlite3.OperationalError as e:
-                if "locked" in str(e) and attempt < retries - 1:
-                    time.sleep(0.1)
-                    continue
-                raise
-            finally:
-                if conn:
-                    conn.close()
-        return False
+        except sqlite3.IntegrityError:
+            return False
+        self.notify('categories_changed')
+        return True
+    
+    @instrumented()
+    def move_category(self, category_id: int, parent_id: Optional[int]) -> bool:
+        """
+        Przenosi kategorię (z podkategoriami) pod parent_id (None - kategoria główna)
+        
+        Zwraca False, gdy parent_id leży w przenoszonym poddrzewie. Kategoria
+        z dziedziczoną marżą przeniesiona do głównych zachowuje bieżącą marżę.
+        """
+        moved = self.write(lambda cursor: self._move_subtree(cursor, category_id, parent_id))
+        if moved:
+            self.notify('categories_changed')
+        return moved
+    
+    @classmethod
+    def _move_subtree(cls, cursor, category_id: int, parent_id: Optional[int]) -> bool:
+        """Przeniesienie w operacji zapisu (False - parent_id w poddrzewie kategorii)"""
+        if parent_id is not None:
+            cursor.execute('SELECT 1 FROM CategoryTree WHERE ancestor_id = ? AND descendant_id = ?',
+                         (category_id, parent_id))
+            if cursor.fetchone():
+                return False
+        else:
+            cursor.execute('''
+                UPDATE Categories SET default_margin = (
+                    SELECT margin FROM CategoryMargins WHERE category_id = :id
+                ) WHERE id = :id AND default_margin IS NULL
+            ''', {'id': category_id})
+        
+        # Odłącz poddrzewo od dotychczasowych przodków i podłącz pod nowego rodzica
+        cursor.execute('''
+            DELETE FROM CategoryTree
+            WHERE descendant_id IN (SELECT descendant_id FROM CategoryTree WHERE ancestor_id = :id)
+              AND ancestor_id NOT IN (SELECT descendant_id FROM CategoryTree WHERE ancestor_id = :id)
+        ''', {'id': category_id})
+        if parent_id is not None:
+            cls._attach_subtree(cursor, category_id, parent_id)
+        cursor.execute('UPDATE Categories SET parent_id = ? WHERE id = ?', (parent_id, category_id))
+        return True
     
+    @staticmethod
+    def _attach_subtree(cursor, category_id: int, parent_id: int):
+        """Wpisy CategoryTree: każdy przodek rodzica (i sam rodzic) z każdym potomkiem kategorii"""
+        cursor.execute('''
+            INSERT INTO CategoryTree (ancestor_id, descendant_id, depth)
+            SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+            FROM CategoryTree a, CategoryTree d
+            WHERE a.descendant_id = ? AND d.ancestor_id = ?
+        ''', (parent_id, category_id))
+    
+    @staticmethod
+    def _rebuild_category_tree(cursor):
+        """Buduje CategoryTree od nowa z parent_id"""
+        cursor.execute('DELETE FROM CategoryTree')
+        cursor.execute('''
+            INSERT INTO CategoryTree (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+                SELECT id, id, 0 FROM Categories
+                UNION ALL
+                SELECT tree.ancestor_id, c.id, tree.depth + 1
+                FROM tree JOIN Categories c ON c.parent_id = tree.descendant_id
+            )
+            SELECT ancestor_id, descendant_id, depth FROM tree
+        ''')
+    
+    @instrumented()
     def delete_category(self, category_id: int) -> bool:
-        """Usuwa kategorię - tylko jeśli nie ma przypisanych produktów"""
-        conn = None
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
+        """Usuwa kategorię - tylko jeśli nie ma przypisanych produktów ani podkategorii"""
+        def op(cursor):
             # Sprawdź czy kategoria ma produkty
             cursor.execute('SELECT COUNT(*) as count FROM Products WHERE category_id = ?', (category_id,))
             count = cursor.fetchone()['count']
@@ -133,44 +483,48 @@ class Database:
             if count > 0:
                 return False  # Nie można usunąć kategorii z produktami
             
+            cursor.execute('SELECT COUNT(*) as count FROM Categories WHERE parent_id = ?', (category_id,))
+            if cursor.fetchone()['count'] > 0:
+                return False  # Najpierw podkategorie
+            
             # Usuń kategorię
             cursor.execute('DELETE FROM Categories WHERE id = ?', (category_id,))
-            conn.commit()
+            cursor.execute('DELETE FROM CategoryTree WHERE descendant_id = ?', (category_id,))
+            cursor.execute('DELETE FROM CustomerCategoryMargins WHERE category_id = ?', (category_id,))
             return True
-        finally:
-            if conn:
-                conn.close()
+        
+        deleted = self.write(op)
+        if deleted:
+            self.notify('categories_changed')
+        return deleted
     
     # === PRODUKTY ===
     
+    @instrumented()
     def add_product(self, code: str, name: str, unit: str, purchase_price_net: float, 
                    vat_rate: float, category_id: Optional[int] = None) -> bool:
         """Dodaje nowy produkt"""
-        conn = None
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+        def op(cursor):
             now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            content_hash = self.product_content_hash(name, unit, purchase_price_net, vat_rate, category_id)
             cursor.execute('''
-                INSERT INTO Products (code, name, unit, purchase_price_net, price_update_date, vat_rate, category_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (code, name, unit, purchase_price_net, now, vat_rate, category_id))
-            conn.commit()
+                INSERT INTO Products (code, name, unit, purchase_price_net, price_update_date, vat_rate, category_id, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (code, name, unit, purchase_price_net, now, vat_rate, category_id, content_hash))
             return True
+        
+        try:
+            self.write(op)
         except sqlite3.IntegrityError:
             return False
-        finally:
-            if conn:
-                conn.close()
+        self.notify('products_saved', codes=[code])
+        return True
     
+    @instrumented()
     def update_product(self, product_id: int, code: str, name: str, unit: str, 
                       purchase_price_net: float, vat_rate: float, category_id: Optional[int]) -> bool:
         """Aktualizuje produkt"""
-        conn = None
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
+        def op(cursor):
             # Sprawdź czy kod nie jest używany przez inny produkt
             cursor.execute('SELECT id FROM Products WHERE code = ? AND id != ?', (code, product_id))
             if cursor.fetchone():
@@ -183,41 +537,44 @@ class Database:
                 return False  # Produkt nie istnieje
             
             old_price = old_price_row['purchase_price_net']
+            content_hash = self.product_content_hash(name, unit, purchase_price_net, vat_rate, category_id)
             
             # Jeśli cena się zmieniła, zaktualizuj datę
             if abs(old_price - purchase_price_net) > 0.001:
                 now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 cursor.execute('''
                     UPDATE Products SET code = ?, name = ?, unit = ?, purchase_price_net = ?,
-                    price_update_date = ?, vat_rate = ?, category_id = ? WHERE id = ?
-                ''', (code, name, unit, purchase_price_net, now, vat_rate, category_id, product_id))
+                    price_update_date = ?, vat_rate = ?, category_id = ?, content_hash = ? WHERE id = ?
+                ''', (code, name, unit, purchase_price_net, now, vat_rate, category_id, content_hash, product_id))
             else:
                 cursor.execute('''
                     UPDATE Products SET code = ?, name = ?, unit = ?, purchase_price_net = ?,
-                    vat_rate = ?, category_id = ? WHERE id = ?
-                ''', (code, name, unit, purchase_price_net, vat_rate, category_id, product_id))
-            
-            conn.commit()
+                    vat_rate = ?, category_id = ?, content_hash = ? WHERE id = ?
+                ''', (code, name, unit, purchase_price_net, vat_rate, category_id, content_hash, product_id))
             return True
+        
+        try:
+            saved = self.write(op)
         except sqlite3.IntegrityError:
             return False
-        finally:
-            if conn:
-                conn.close()
+        if saved:
+            self.notify('products_saved', ids=[product_id])
+        return saved
     
+    @instrumented()
     def delete_product(self, product_id: int) -> bool:
         """Usuwa produkt"""
-        conn = None
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+        def op(cursor):
             cursor.execute('DELETE FROM Products WHERE id = ?', (product_id,))
-            conn.commit()
+            cursor.execute('DELETE FROM PriceHistory WHERE product_id = ?', (product_id,))
+            cursor.execute('DELETE FROM CustomerProductMargins WHERE product_id = ?', (product_id,))
             return True
-        finally:
-            if conn:
-                conn.close()
+        
+        self.write(op)
+        self.notify('products_deleted', ids=[product_id])
+        return True
     
+    @instrumented(rows=result_count)
     def get_products(self, category_id: Optional[int] = None) -> List[Dict]:
         """Pobiera produkty (opcjonalnie filtrowane po kategorii)"""
         conn = self.get_connection()
@@ -225,17 +582,19 @@ class Database:
         
         if category_id is not None:
             cursor.execute('''
-                SELECT p.*, c.name as category_name, c.default_margin
+                SELECT p.*, c.name as category_name, m.margin AS default_margin
                 FROM Products p
                 LEFT JOIN Categories c ON p.category_id = c.id
+                LEFT JOIN CategoryMargins m ON m.category_id = p.category_id
                 WHERE p.category_id = ?
                 ORDER BY p.name
             ''', (category_id,))
         else:
             cursor.execute('''
-                SELECT p.*, c.name as category_name, c.default_margin
+                SELECT p.*, c.name as category_name, m.margin AS default_margin
                 FROM Products p
                 LEFT JOIN Categories c ON p.category_id = c.id
+                LEFT JOIN CategoryMargins m ON m.category_id = p.category_id
                 ORDER BY p.name
             ''')
         
@@ -243,29 +602,59 @@ class Database:
         conn.close()
         return products
     
-    def get_product_by_id(self, product_id: int) -> Optional[Dict]:
-        """Pobiera produkt po ID"""
+    @instrumented(rows=result_count)
+    def get_products_in_subtrees(self, category_ids: List[int], customer_id: Optional[int] = None) -> List[Dict]:
+        """
+        Produkty z kategorii category_ids i wszystkich ich podkategorii - jednym zapytaniem
+        
+        default_margin to marża po dziedziczeniu (widok CategoryMargins), a dla
+        klienta - z jego nadpisaniami (margin_source: product, customer_category, category).
+        """
+        if not category_ids:
+            return []
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT p.*, c.name as category_name, {CUSTOMER_MARGIN_COLUMNS}
+                FROM (SELECT DISTINCT descendant_id FROM CategoryTree
+                      WHERE ancestor_id IN (SELECT value FROM json_each(:category_ids))) s
+                JOIN Products p ON p.category_id = s.descendant_id
+                JOIN Categories c ON c.id = p.category_id
+                {CUSTOMER_MARGIN_JOINS}
+                ORDER BY c.name, p.name
+            ''', {'category_ids': json.dumps(list(category_ids)), 'customer_id': customer_id})
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    @instrumented()
+    def get_product_by_id(self, product_id: int, customer_id: Optional[int] = None) -> Optional[Dict]:
+        """Pobiera produkt po ID (default_margin - dla klienta, jeśli podany)"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.*, c.name as category_name, c.default_margin
+        cursor.execute(f'''
+            SELECT p.*, c.name as category_name, {CUSTOMER_MARGIN_COLUMNS}
             FROM Products p
             LEFT JOIN Categories c ON p.category_id = c.id
-            WHERE p.id = ?
-        ''', (product_id,))
+            {CUSTOMER_MARGIN_JOINS}
+            WHERE p.id = :product_id
+        ''', {'product_id': product_id, 'customer_id': customer_id})
         row = cursor.fetchone()
         conn.close()
         return dict(row) if row else None
     
+    @instrumented(rows=result_count)
     def search_products(self, query: str) -> List[Dict]:
         """Wyszukuje produkty po nazwie lub kodzie"""
         conn = self.get_connection()
         cursor = conn.cursor()
         search_pattern = f'%{query}%'
         cursor.execute('''
-            SELECT p.*, c.name as category_name, c.default_margin
+            SELECT p.*, c.name as category_name, m.margin AS default_margin
             FROM Products p
             LEFT JOIN Categories c ON p.category_id = c.id
+            LEFT JOIN CategoryMargins m ON m.category_id = p.category_id
             WHERE p.name LIKE ? OR p.code LIKE ?
             ORDER BY p.name
         ''', (search_pattern, search_pattern))
@@ -273,74 +662,427 @@ class Database:
         conn.close()
         return products
     
-    def import_products_batch(self, products: List[Dict]) -> Tuple[int, int]:
+    @staticmethod
+    def product_content_hash(name: str, unit: str, purchase_price_net: float,
+                             vat_rate: float, category_id: Optional[int]) -> str:
+        """Skrót treści produktu (bez kodu) - pozwala pominąć niezmienione wiersze importu"""
+        content = "\x1f".join([
+            name or '',
+            unit or '',
+            f"{float(purchase_price_net or 0.0):.4f}",
+            f"{float(vat_rate or 0.0):.2f}",
+            str(category_id) if category_id is not None else ''
+        ])
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+    
+    @instrumented(rows=lambda result, args, kwargs: sum(result))
+    def import_products_batch(self, products: List[Dict]) -> Tuple[int, int, int]:
         """
         Importuje wiele produktów naraz
-        Zwraca (liczba dodanych, liczba zaktualizowanych)
+        
+        Wiersze, których treść (nazwa, j.m., cena, VAT, kategoria) się nie
+        zmieniła, są pomijane - bez zapisu do bazy.
+        
+        Zwraca (liczba dodanych, liczba zaktualizowanych, liczba niezmienionych)
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        added = 0
-        updated = 0
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        for product in products:
-            # Sprawdź czy produkt już istnieje
-            cursor.execute('SELECT id, purchase_price_net FROM Products WHERE code = ?', 
-                         (product['code'],))
-            existing = cursor.fetchone()
+        changed_codes = []
+        
+        def op(cursor):
+            added = 0
+            updated = 0
+            unchanged = 0
+            changed_codes.clear()
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
-            if existing:
-                # Aktualizuj istniejący
-                old_price = existing['purchase_price_net']
-                if abs(old_price - product['purchase_price_net']) > 0.001:
-                    cursor.execute('''
-                        UPDATE Products SET name = ?, unit = ?, purchase_price_net = ?,
-                        price_update_date = ?, vat_rate = ?, category_id = ?
-                        WHERE code = ?
-                    ''', (product['name'], product['unit'], product['purchase_price_net'],
-                         now, product['vat_rate'], product.get('category_id'), product['code']))
+            for product in products:
+                content_hash = self.product_content_hash(
+                    product['name'], product['unit'], product['purchase_price_net'],
+                    product['vat_rate'], product.get('category_id'))
+                
+                # Sprawdź czy produkt już istnieje
+                cursor.execute('''
+                    SELECT id, name, unit, purchase_price_net, vat_rate, category_id, content_hash
+                    FROM Products WHERE code = ?
+                ''', (product['code'],))
+                existing = cursor.fetchone()
+                
+                if existing:
+                    # Brak zapisanego skrótu (np. po zbiorczej zmianie cen) - policz z bieżących danych
+                    old_hash = existing['content_hash'] or self.product_content_hash(
+                        existing['name'], existing['unit'], existing['purchase_price_net'],
+                        existing['vat_rate'], existing['category_id'])
+                    if old_hash == content_hash:
+                        unchanged += 1
+                        continue
+                    
+                    # Aktualizuj istniejący
+                    old_price = existing['purchase_price_net']
+                    if abs(old_price - product['purchase_price_net']) > 0.001:
+                        cursor.execute('''
+                            UPDATE Products SET name = ?, unit = ?, purchase_price_net = ?,
+                            price_update_date = ?, vat_rate = ?, category_id = ?, content_hash = ?
+                            WHERE code = ?
+                        ''', (product['name'], product['unit'], product['purchase_price_net'],
+                             now, product['vat_rate'], product.get('category_id'), content_hash,
+                             product['code']))
+                    else:
+                        cursor.execute('''
+                            UPDATE Products SET name = ?, unit = ?, vat_rate = ?, category_id = ?,
+                            content_hash = ?
+                            WHERE code = ?
+                        ''', (product['name'], product['unit'], product['vat_rate'], 
+                             product.get('category_id'), content_hash, product['code']))
+                    updated += 1
+                    changed_codes.append(product['code'])
                 else:
+                    # Dodaj nowy
                     cursor.execute('''
-                        UPDATE Products SET name = ?, unit = ?, vat_rate = ?, category_id = ?
-                        WHERE code = ?
-                    ''', (product['name'], product['unit'], product['vat_rate'], 
-                         product.get('category_id'), product['code']))
-                updated += 1
+                        INSERT INTO Products (code, name, unit, purchase_price_net, price_update_date, vat_rate,
+                                              category_id, content_hash)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (product['code'], product['name'], product['unit'], 
+                         product['purchase_price_net'], now, product['vat_rate'], 
+                         product.get('category_id'), content_hash))
+                    added += 1
+                    changed_codes.append(product['code'])
+            
+            return added, updated, unchanged
+
+        # Cały import to jedna operacja zapisu - jedna transakcja
+        result = self.write(op)
+        if changed_codes:
+            self.notify('products_saved', codes=changed_codes)
+        return result
+    
+    @instrumented()
+    def is_file_imported(self, file_digest: str, category_id: Optional[int] = None) -> bool:
+        """Sprawdza czy plik o tym skrócie był już zaimportowany do tej samej kategorii"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 1 FROM ImportedFiles WHERE file_digest = ? AND category_id IS ? LIMIT 1
+            ''', (file_digest, category_id))
+            found = cursor.fetchone() is not None
+        conn.close()
+        return found
+    
+    @instrumented()
+    def record_imported_file(self, file_digest: str, category_id: Optional[int],
+                             file_name: str, rows: int) -> None:
+        """Zapisuje skrót zaimportowanego pliku"""
+        def op(cursor):
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute('''
+                INSERT INTO ImportedFiles (file_digest, category_id, file_name, rows, imported_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (file_digest, category_id, file_name, rows, now))
+        
+        self.write(op)
+    
+    # === ZBIORCZE ZMIANY CEN ===
+    
+    @staticmethod
+    def reprice_filter(category_ids: Optional[List[int]] = None, code_prefix: Optional[str] = None,
+                       name_query: Optional[str] = None, min_price: Optional[float] = None,
+                       max_price: Optional[float] = None) -> Tuple[str, Dict]:
+        """Warunek WHERE (dla tabeli Products p) i parametry nazwane filtrów zmiany cen"""
+        conditions = ['p.purchase_price_net IS NOT NULL']
+        params = {}
+        if category_ids is not None:
+            placeholders = []
+            for i, category_id in enumerate(category_ids):
+                placeholders.append(f':category_{i}')
+                params[f'category_{i}'] = category_id
+            # Wybrane kategorie razem z podkategoriami
+            conditions.append(f"p.category_id IN (SELECT descendant_id FROM CategoryTree "
+                              f"WHERE ancestor_id IN ({', '.join(placeholders) or 'NULL'}))")
+        if code_prefix:
+            # Prefiks kodu (np. kody dostawcy) - znaki wieloznaczne LIKE traktowane dosłownie
+            escaped = code_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("p.code LIKE :code_prefix ESCAPE '\\'")
+            params['code_prefix'] = escaped + '%'
+        if name_query:
+            conditions.append('p.name LIKE :name_query')
+            params['name_query'] = f'%{name_query}%'
+        if min_price is not None:
+            conditions.append('p.purchase_price_net >= :min_price')
+            params['min_price'] = min_price
+        if max_price is not None:
+            conditions.append('p.purchase_price_net <= :max_price')
+            params['max_price'] = max_price
+        return ' AND '.join(conditions), params
+    
+    @instrumented(rows=lambda result, args, kwargs: result['products'])
+    def reprice_products(self, percent: float, category_ids: Optional[List[int]] = None,
+                         code_prefix: Optional[str] = None, name_query: Optional[str] = None,
+                         min_price: Optional[float] = None, max_price: Optional[float] = None,
+                         rounding: str = 'cents', dry_run: bool = False,
+                         reason: Optional[str] = None) -> Dict:
+        """
+        Zmienia ceny zakupu netto o procent - jednym UPDATE w bazie
+        
+        Stare ceny trafiają do PriceHistory, a content_hash zmienionych produktów
+        jest zerowany (import liczy go wtedy z bieżących danych). Produkty, których
+        cena po zaokrągleniu się nie zmienia, są pomijane.
+        
+        Args:
+            percent: Zmiana w procentach (np. 5 = +5%, -10 = -10%)
+            category_ids: Tylko produkty z tych kategorii
+            code_prefix: Tylko produkty o kodzie zaczynającym się od prefiksu
+            name_query: Tylko produkty z tekstem w nazwie
+            min_price, max_price: Zakres obecnej ceny zakupu
+            rounding: Reguła zaokrąglania z ROUNDING_RULES
+            dry_run: Tylko podgląd - bez zmian w bazie
+            reason: Opis zmiany zapisywany w historii cen
+        
+        Returns:
+            Podsumowanie liczone w SQL (bez pobierania wierszy): products, old_total,
+            new_total, min_change, max_change, categories (te same pola per kategoria)
+            oraz applied - czy zmiany zapisano
+        """
+        if percent <= -100:
+            raise ValueError("Zmiana ceny musi być większa niż -100%")
+        if rounding not in ROUNDING_RULES:
+            raise ValueError(f"Nieznana reguła zaokrąglania: {rounding}")
+        
+        where, params = self.reprice_filter(category_ids, code_prefix, name_query, min_price, max_price)
+        params['factor'] = 1 + percent / 100
+        new_price = ROUNDING_RULES[rounding].format(price='(p.purchase_price_net * :factor)')
+        changed = f"{where} AND {new_price} != p.purchase_price_net"
+        
+        def summarize(cursor) -> Dict:
+            cursor.execute(f'''
+                SELECT p.category_id, c.name AS category_name, COUNT(*) AS products,
+                       ROUND(SUM(p.purchase_price_net), 2) AS old_total,
+                       ROUND(SUM({new_price}), 2) AS new_total,
+                       ROUND(MIN({new_price} - p.purchase_price_net), 2) AS min_change,
+                       ROUND(MAX({new_price} - p.purchase_price_net), 2) AS max_change
+                FROM Products p
+                LEFT JOIN Categories c ON p.category_id = c.id
+                WHERE {changed}
+                GROUP BY p.category_id
+                ORDER BY c.name
+            ''', params)
+            categories = [dict(row) for row in cursor.fetchall()]
+            return {
+                'products': sum(c['products'] for c in categories),
+                'old_total': round(sum((c['old_total'] for c in categories), 0.0), 2),
+                'new_total': round(sum((c['new_total'] for c in categories), 0.0), 2),
+                'min_change': min((c['min_change'] for c in categories), default=0.0),
+                'max_change': max((c['max_change'] for c in categories), default=0.0),
+                'categories': categories,
+                'applied': False,
+            }
+        
+        if dry_run:
+            # Podgląd to sam odczyt - bez kolejki zapisów
+            conn = self.get_connection()
+            try:
+                return summarize(conn.cursor())
+            finally:
+                conn.close()
+        
+        def op(cursor):
+            # Podgląd i zmiana w tej samej transakcji - widzą te same dane
+            summary = summarize(cursor)
+            if not summary['products']:
+                return summary
+            
+            params['now'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            params['reason'] = reason or f"Zmiana cen o {percent:+g}%"
+            cursor.execute(f'''
+                INSERT INTO PriceHistory (product_id, old_price, new_price, changed_at, reason)
+                SELECT p.id, p.purchase_price_net, {new_price}, :now, :reason
+                FROM Products p
+                WHERE {changed}
+            ''', params)
+            cursor.execute(f'''
+                UPDATE Products AS p
+                SET purchase_price_net = {new_price}, price_update_date = :now, content_hash = NULL
+                WHERE {changed}
+            ''', params)
+            summary['applied'] = True
+            return summary
+        
+        summary = self.write(op)
+        if summary['applied']:
+            self.notify('prices_changed')
+        return summary
+    
+    @instrumented(rows=result_count)
+    def get_price_history(self, product_id: int) -> List[Dict]:
+        """Historia zmian ceny zakupu produktu (od najnowszej)"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT old_price, new_price, changed_at, reason FROM PriceHistory
+                WHERE product_id = ? ORDER BY id DESC
+            ''', (product_id,))
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    # === KLIENCI ===
+    
+    @instrumented()
+    def add_customer(self, name: str) -> bool:
+        """Dodaje klienta (False - klient o tej nazwie już istnieje)"""
+        def op(cursor):
+            cursor.execute('INSERT INTO Customers (name) VALUES (?)', (name,))
+            return cursor.lastrowid
+        
+        try:
+            customer_id = self.write(op)
+        except sqlite3.IntegrityError:
+            return False
+        self.notify('customers_changed', ids=[customer_id])
+        return True
+    
+    @instrumented(rows=result_count)
+    def get_customers(self) -> List[Dict]:
+        """Pobiera klientów z liczbą nadpisanych marż kategorii i produktów"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.*,
+                       (SELECT COUNT(*) FROM CustomerCategoryMargins WHERE customer_id = c.id) AS category_margins,
+                       (SELECT COUNT(*) FROM CustomerProductMargins WHERE customer_id = c.id) AS product_margins
+                FROM Customers c
+                ORDER BY c.name
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    @instrumented()
+    def delete_customer(self, customer_id: int) -> bool:
+        """Usuwa klienta razem z jego marżami"""
+        def op(cursor):
+            cursor.execute('DELETE FROM CustomerCategoryMargins WHERE customer_id = ?', (customer_id,))
+            cursor.execute('DELETE FROM CustomerProductMargins WHERE customer_id = ?', (customer_id,))
+            cursor.execute('DELETE FROM Customers WHERE id = ?', (customer_id,))
+            return cursor.rowcount > 0
+        
+        deleted = self.write(op)
+        if deleted:
+            self.notify('customers_changed', ids=[customer_id])
+        return deleted
+    
+    @instrumented()
+    def set_customer_category_margin(self, customer_id: int, category_id: int, margin: Optional[float]):
+        """Marża klienta dla kategorii i jej podkategorii (None - usuwa nadpisanie)"""
+        def op(cursor):
+            if margin is None:
+                cursor.execute('DELETE FROM CustomerCategoryMargins WHERE customer_id = ? AND category_id = ?',
+                             (customer_id, category_id))
             else:
-                # Dodaj nowy
                 cursor.execute('''
-                    INSERT INTO Products (code, name, unit, purchase_price_net, price_update_date, vat_rate, category_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (product['code'], product['name'], product['unit'], 
-                     product['purchase_price_net'], now, product['vat_rate'], 
-                     product.get('category_id')))
-                added += 1
+                    INSERT OR REPLACE INTO CustomerCategoryMargins (customer_id, category_id, margin)
+                    VALUES (?, ?, ?)
+                ''', (customer_id, category_id, margin))
         
-        conn.commit()
-        conn.close()
-        return added, updated
+        self.write(op)
+        self.notify('customers_changed', ids=[customer_id])
+    
+    @instrumented()
+    def set_customer_product_margins(self, customer_id: int, margins: Dict[int, Optional[float]]) -> int:
+        """
+        Marże klienta dla produktów {product_id: marża} (None - usuwa nadpisanie)
+        
+        Zwraca liczbę zapisanych marż.
+        """
+        removed = [(customer_id, product_id) for product_id, margin in margins.items() if margin is None]
+        saved = [(customer_id, product_id, margin) for product_id, margin in margins.items() if margin is not None]
+        
+        def op(cursor):
+            cursor.executemany('DELETE FROM CustomerProductMargins WHERE customer_id = ? AND product_id = ?',
+                               removed)
+            cursor.executemany('''
+                INSERT OR REPLACE INTO CustomerProductMargins (customer_id, product_id, margin)
+                VALUES (?, ?, ?)
+            ''', saved)
+        
+        self.write(op)
+        self.notify('customers_changed', ids=[customer_id])
+        return len(saved)
+    
+    @instrumented()
+    def get_customer_margins(self, customer_id: int) -> Dict[str, List[Dict]]:
+        """Nadpisane marże klienta: {'categories': [...], 'products': [...]}"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT o.category_id, c.name AS category_name, o.margin
+                FROM CustomerCategoryMargins o
+                JOIN Categories c ON c.id = o.category_id
+                WHERE o.customer_id = ?
+                ORDER BY c.name
+            ''', (customer_id,))
+            categories = [dict(row) for row in cursor.fetchall()]
+            cursor.execute('''
+                SELECT o.product_id, p.code, p.name, o.margin
+                FROM CustomerProductMargins o
+                JOIN Products p ON p.id = o.product_id
+                WHERE o.customer_id = ?
+                ORDER BY p.name
+            ''', (customer_id,))
+            return {'categories': categories, 'products': [dict(row) for row in cursor.fetchall()]}
+        finally:
+            conn.close()
+    
+    @instrumented(rows=result_count)
+    def resolve_customer_margins(self, customer_id: Optional[int],
+                                 product_ids: Optional[List[int]] = None) -> Dict[int, float]:
+        """
+        Marże produktów dla klienta jednym zapytaniem: {product_id: marża}
+        
+        Kolejność: marża klienta dla produktu, marża klienta dla najbliższej
+        kategorii w gałęzi produktu, marża kategorii (po dziedziczeniu).
+        product_ids None - cały katalog.
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            where = '' if product_ids is None else 'WHERE p.id IN (SELECT value FROM json_each(:product_ids))'
+            cursor.execute(f'''
+                SELECT p.id, COALESCE(pm.margin, cm.margin, m.margin) AS margin
+                FROM Products p
+                {CUSTOMER_MARGIN_JOINS}
+                {where}
+            ''', {'customer_id': customer_id,
+                  'product_ids': None if product_ids is None else json.dumps(list(product_ids))})
+            return {row[0]: row[1] for row in cursor.fetchall()}
+        finally:
+            conn.close()
     
     # === WIZYTÓWKA ===
     
+    @instrumented()
     def get_business_card(self) -> Optional[Dict]:
         """Pobiera wizytówkę użytkownika"""
-        with self.get_connection() as conn:
+        conn = self.get_connection()
+        try:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM BusinessCard WHERE id = 1')
             row = cursor.fetchone()
             return dict(row) if row else None
+        finally:
+            conn.close()
     
+    @instrumented()
     def save_business_card(self, company: str, full_name: str, phone: str, email: str) -> bool:
         """Zapisuje lub aktualizuje wizytówkę użytkownika"""
+        def op(cursor):
+            cursor.execute('''
+                INSERT OR REPLACE INTO BusinessCard (id, company, full_name, phone, email)
+                VALUES (1, ?, ?, ?, ?)
+            ''', (company, full_name, phone, email))
+        
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO BusinessCard (id, company, full_name, phone, email)
-                    VALUES (1, ?, ?, ?, ?)
-                ''', (company, full_name, phone, email))
-                conn.commit()
+            self.write(op)
             return True
         except Exception as e:
             print(f"Błąd zapisywania wizytówki: {e}")
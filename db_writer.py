@@ -0,0 +1,204 @@
+"""
+Kolejka zapisów do bazy SQLite obsługiwana przez jeden wątek
+
+Wszystkie operacje zapisu Database trafiają do kolejki. Wątek zapisujący
+zbiera oczekujące operacje w paczki i wykonuje każdą paczkę w jednej
+transakcji (BEGIN IMMEDIATE ... COMMIT) - każda operacja we własnym
+SAVEPOINT, więc błąd jednej (np. duplikat nazwy) cofa tylko ją.
+
+Odczyty nie przechodzą przez kolejkę - w trybie WAL działają równolegle
+z zapisem. Blokady od innych procesów obsługuje wspólna BusyPolicy.
+"""
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+_STOP = object()
+
+
+def is_busy_error(error: Exception) -> bool:
+    """Czy błąd oznacza zajętą bazę (SQLITE_BUSY / SQLITE_LOCKED)"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class BusyPolicy:
+    """
+    Obsługa zajętej bazy: krótki busy_timeout SQLite, potem ponowienia
+    z wykładniczym opóźnieniem i losowym rozrzutem (procesy nie budzą się razem)
+    """
+
+    def __init__(self, attempts: int = 6, busy_timeout: float = 1.0,
+                 base_delay: float = 0.02, max_delay: float = 0.5):
+        self.attempts = attempts
+        self.busy_timeout = busy_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def call(self, func: Callable, on_retry: Optional[Callable[[], None]] = None):
+        """Wywołuje func(), ponawiając przy zajętej bazie; ostatni błąd jest zgłaszany"""
+        for attempt in range(self.attempts):
+            try:
+                return func()
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == self.attempts - 1:
+                    raise
+                if on_retry:
+                    on_retry()
+                time.sleep(self.delay(attempt))
+
+
+class WriteQueue:
+    """
+    Jeden wątek zapisujący z kolejką operacji
+
+    Operacja to funkcja op(cursor) -> wynik. Nie wywołuje commit - transakcją
+    zarządza kolejka. Wątek startuje przy pierwszym zapisie.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_batch: int = 64,
+                 batch_window: float = 0.002, busy_policy: Optional[BusyPolicy] = None):
+        """
+        Args:
+            connect: Funkcja tworząca połączenie (Database.get_connection)
+            max_batch: Najwięcej operacji w jednej transakcji
+            batch_window: Jak długo (s) czekać na kolejne operacje do paczki
+            busy_policy: Obsługa zajętej bazy (domyślnie BusyPolicy())
+        """
+        self.connect = connect
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.busy_policy = busy_policy or BusyPolicy()
+        self.stats = {'requests': 0, 'batches': 0, 'failed': 0, 'busy_retries': 0}
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._cursor = None
+        self._lock = threading.Lock()
+
+    def submit(self, op: Callable) -> Future:
+        """Dodaje operację do kolejki; wynik lub wyjątek w zwróconym Future"""
+        future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ofertomat-db-writer', daemon=True)
+                self._thread.start()
+            self._queue.put((op, future))
+        return future
+
+    def execute(self, op: Callable):
+        """Wykonuje operację i czeka na zatwierdzenie transakcji"""
+        if threading.current_thread() is self._thread:
+            # Operacja wywołana z innej operacji - ta sama transakcja
+            return op(self._cursor)
+        return self.submit(op).result()
+
+    def close(self, timeout: Optional[float] = None):
+        """Kończy wątek po wykonaniu operacji już dodanych do kolejki"""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+            self._thread = None
+        thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._process(batch)
+            if stop:
+                return
+
+    def _begin(self) -> sqlite3.Connection:
+        conn = self.connect()
+        try:
+            conn.isolation_level = None
+            conn.execute(f'PRAGMA busy_timeout = {int(self.busy_policy.busy_timeout * 1000)}')
+            conn.execute('BEGIN IMMEDIATE')
+            return conn
+        except Exception:
+            conn.close()
+            raise
+
+    def _process(self, batch: List[Tuple[Callable, Future]]):
+        batch = [(op, future) for op, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        self.stats['requests'] += len(batch)
+        self.stats['batches'] += 1
+
+        def on_retry():
+            self.stats['busy_retries'] += 1
+
+        try:
+            conn = self.busy_policy.call(self._begin, on_retry)
+        except Exception as e:
+            self.stats['failed'] += len(batch)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        results = []
+        try:
+            cursor = self._cursor = conn.cursor()
+            for op, future in batch:
+                cursor.execute('SAVEPOINT write_request')
+                try:
+                    result = op(cursor)
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO write_request')
+                    cursor.execute('RELEASE write_request')
+                    results.append((future, None, e))
+                    continue
+                cursor.execute('RELEASE write_request')
+                results.append((future, result, None))
+            self.busy_policy.call(conn.commit, on_retry)
+        except Exception as e:
+            # Błąd całej transakcji - żadna operacja z paczki nie została zapisana
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            results = [(future, None, e) for _, future in batch]
+        finally:
+            self._cursor = None
+            conn.close()
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                self.stats['failed'] += 1
+                future.set_exception(error)
+
+    def snapshot(self) -> Dict:
+        stats = dict(self.stats)
+        stats['pending'] = self._queue.qsize()
+        stats['mean_batch'] = round(stats['requests'] / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
@@ -4,9 +4,14 @@ from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
 from docx.enum.section import WD_SECTION
-from datetime import datetime
-from typing import List, Dict
+from copy import deepcopy
+from typing import List, Dict, Optional
 import os
+from instrumentation import instrumented, offer_item_count, rendered_bytes
+from offer_layout import (TABLE_HEADERS, VALIDITY_TEXT, SUMMARY_TITLE, VAT_SUMMARY_HEADERS,
+                          build_layout, calculate_price, vat_summary_rows)
+from offer_rendering import OfferOutput
+from render_cache import FragmentCache
 
 class DOCXGenerator:
     """Klasa do generowania raportów DOCX z ofert"""
@@ -14,32 +19,18 @@ class DOCXGenerator:
     def __init__(self):
         self.primary_color = RGBColor(200, 16, 46)   # #C8102E - czerwony z logo
         self.header_color = RGBColor(139, 139, 139)  # #8B8B8B - szary z logo
+        
+        # Gotowe sekcje kategorii (XML) - po drobnej zmianie oferty przebudowywane są tylko zmienione
+        self.section_cache = FragmentCache()
     
     def calculate_price(self, purchase_price: float, margin: float, vat_rate: float, quantity: float = 1):
         """
-        Kalkuluje ceny
+        Kalkuluje ceny (zob. offer_layout.calculate_price)
         
         Returns:
             dict z kluczami: net_unit, gross_unit, net_total, vat_amount, gross_total
         """
-        # Cena jednostkowa netto sprzedaży
-        net_unit = purchase_price * (1 + margin / 100)
-        
-        # Cena jednostkowa brutto
-        gross_unit = net_unit * (1 + vat_rate / 100)
-        
-        # Wartości dla ilości
-        net_total = net_unit * quantity
-        vat_amount = net_total * (vat_rate / 100)
-        gross_total = net_total + vat_amount
-        
-        return {
-            'net_unit': round(net_unit, 2),
-            'gross_unit': round(gross_unit, 2),
-            'net_total': round(net_total, 2),
-            'vat_amount': round(vat_amount, 2),
-            'gross_total': round(gross_total, 2)
-        }
+        return calculate_price(purchase_price, margin, vat_rate, quantity)
     
     def set_cell_background(self, cell, color):
         """Ustawia kolor tła komórki tabeli"""
@@ -49,9 +40,108 @@ class DOCXGenerator:
         shading_elm.set(qn('w:fill'), hex_color)
         cell._element.get_or_add_tcPr().append(shading_elm)
     
-    def generate_offer_docx(self, offer_data: Dict, output_path: str) -> bool:
+    def build_category_section(self, doc, category_name: str, rows: List[tuple]) -> list:
+        """
+        Dodaje do dokumentu sekcję kategorii: nagłówek i tabelę produktów
+        
+        Args:
+            doc: Dokument docx
+            category_name: Nazwa kategorii
+            rows: Sformatowane wiersze (nazwa, cena netto, J.M., VAT, cena brutto)
+        
+        Returns:
+            Dodane elementy XML (w:p, w:tbl, w:p)
+        """
+        # Nagłówek kategorii
+        category_para = doc.add_paragraph(category_name)
+        category_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        category_run = category_para.runs[0]
+        category_run.font.size = Pt(14)
+        category_run.font.bold = True
+        category_run.font.color.rgb = self.primary_color
+        
+        # Tabela produktów (5 kolumn: Nazwa, Cena netto, J.M., VAT, Cena brutto)
+        table = doc.add_table(rows=1, cols=5)
+        table.style = 'Light Grid Accent 1'
+        
+        # Nagłówki kolumn
+        header_cells = table.rows[0].cells
+        for i, header_text in enumerate(TABLE_HEADERS):
+            cell = header_cells[i]
+            cell.text = header_text
+            # Stylizacja nagłówka
+            for paragraph in cell.paragraphs:
+                paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                for run in paragraph.runs:
+                    run.font.bold = True
+                    run.font.size = Pt(9)
+                    run.font.color.rgb = RGBColor(255, 255, 255)
+            self.set_cell_background(cell, self.primary_color)
+        
+        # Wiersze z danymi (nazwa do lewej, pozostałe kolumny do prawej)
+        for row in rows:
+            row_cells = table.add_row().cells
+            for i, value in enumerate(row):
+                row_cells[i].text = value
+                if i > 0:
+                    row_cells[i].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
+                row_cells[i].paragraphs[0].runs[0].font.size = Pt(8)
+        
+        # Ustaw szerokości kolumn
+        table.columns[0].width = Cm(9)
+        table.columns[1].width = Cm(2.5)
+        table.columns[2].width = Cm(2)
+        table.columns[3].width = Cm(1.5)
+        table.columns[4].width = Cm(2.5)
+        
+        spacer = doc.add_paragraph()  # Spacer między kategoriami
+        return [category_para._p, table._tbl, spacer._p]
+    
+    def add_summary(self, doc, totals: Dict):
+        """Dodaje podsumowanie oferty: wartości per stawka VAT i razem"""
+        title_para = doc.add_paragraph(SUMMARY_TITLE)
+        title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        title_para.runs[0].font.size = Pt(14)
+        title_para.runs[0].font.bold = True
+        title_para.runs[0].font.color.rgb = self.primary_color
+        
+        table = doc.add_table(rows=1, cols=len(VAT_SUMMARY_HEADERS))
+        table.style = 'Light Grid Accent 1'
+        for cell, header_text in zip(table.rows[0].cells, VAT_SUMMARY_HEADERS):
+            cell.text = header_text
+            run = cell.paragraphs[0].runs[0]
+            run.font.bold = True
+            run.font.size = Pt(9)
+            run.font.color.rgb = RGBColor(255, 255, 255)
+            cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+            self.set_cell_background(cell, self.primary_color)
+        
+        rows = vat_summary_rows(totals)
+        for row_no, row in enumerate(rows):
+            row_cells = table.add_row().cells
+            for i, value in enumerate(row):
+                row_cells[i].text = value
+                if i > 0:
+                    row_cells[i].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
+                run = row_cells[i].paragraphs[0].runs[0]
+                run.font.size = Pt(8)
+                run.font.bold = row_no == len(rows) - 1
+    
+    @staticmethod
+    def append_elements(doc, elements: list):
+        """Wstawia kopie zapamiętanych elementów na koniec treści (przed w:sectPr)"""
+        body = doc.element.body
+        sect_pr = body.find(qn('w:sectPr'))
+        for element in elements:
+            if sect_pr is not None:
+                sect_pr.addprevious(deepcopy(element))
+            else:
+                body.append(deepcopy(element))
+    
+    @instrumented('DOCXGenerator.generate_offer_docx', rows=offer_item_count, bytes_written=rendered_bytes)
+    def render_offer_docx(self, offer_data: Dict, output, layout: Optional[Dict] = None) -> Dict:
         """
-        Generuje DOCX z ofertą
+        Generuje DOCX z ofertą do pliku lub strumienia
         
         Args:
             offer_data: Słownik z danymi oferty:
@@ -64,204 +154,146 @@ class DOCXGenerator:
                     - vat_rate: float
                     - margin: float (z kategorii)
                     - category_name: str
-            output_path: Ścieżka do pliku wyjściowego DOCX
+            output: Ścieżka pliku DOCX albo zapisywalny strumień binarny (BytesIO, gniazdo, potok)
+            layout: Gotowy model układu (offer_layout.build_layout), opcjonalnie
         
         Returns:
-            bool - True jeśli sukces
+            Metadane: format, bytes, seconds, items (oraz path dla ścieżki)
+        
+        Raises:
+            Exception: Błąd generowania (generate_offer_docx zamienia go na False)
         """
-        try:
-            # Stwórz katalog jeśli nie istnieje
-            os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
-            
-            # Utwórz dokument
-            doc = Document()
-            
-            # Ustaw marginesy
-            sections = doc.sections
-            for section in sections:
-                section.top_margin = Cm(2)
-                section.bottom_margin = Cm(2)
-                section.left_margin = Cm(2)
-                section.right_margin = Cm(2)
-            
-            # Dodaj znak wodny w nagłówku
-            logo_path = 'logo_piwowar.png'
-            if os.path.exists(logo_path):
-                try:
-                    # Dodaj logo jako znak wodny w nagłówku (będzie na każdej stronie)
-                    section = doc.sections[0]
-                    header = section.header
-                    
-                    # Dodaj obrazek do nagłówka jako znak wodny
-                    header_para = header.paragraphs[0]
-                    header_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    run = header_para.add_run()
-                    
-                    # Dodaj obrazek z przezroczystością (symulacja znaku wodnego)
-                    picture = run.add_picture(logo_path, width=Cm(12))
-                    
-                    # Dodaj efekt przezroczystości przez XML
-                    drawing = picture._inline.graphic.graphicData.pic
-                    blip = drawing.blipFill.blip
-                    alpha = OxmlElement('a:alphaModFix')
-                    alpha.set('amt', '30000')  # 30% nieprzezroczystości
-                    blip.append(alpha)
-                    
-                except Exception as e:
-                    print(f"Błąd dodawania znaku wodnego: {e}")
-            
-            # 1. Logo w nagłówku dokumentu (jeśli istnieje)
-            if os.path.exists(logo_path):
-                try:
-                    logo_para = doc.add_paragraph()
-                    logo_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    logo_run = logo_para.add_run()
-                    logo_run.add_picture(logo_path, width=Cm(8))
-                    doc.add_paragraph()  # Spacer
-                except Exception as e:
-                    print(f"Nie można załadować logo: {e}")
-            
-            # 2. Wizytówka - Firma (pogrubiona, wyśrodkowana)
-            business_card = offer_data.get('business_card')
-            if business_card and business_card.get('company'):
-                company_para = doc.add_paragraph()
-                company_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                company_run = company_para.add_run(business_card['company'])
-                company_run.font.size = Pt(14)
-                company_run.font.bold = True
-            
-            # 3. Wizytówka - reszta danych (pogrubiona, wyśrodkowana)
-            if business_card:
-                contact_parts = []
-                if business_card.get('full_name'):
-                    contact_parts.append(business_card['full_name'])
-                if business_card.get('phone'):
-                    contact_parts.append(f"Tel: {business_card['phone']}")
-                if business_card.get('email'):
-                    contact_parts.append(f"E-mail: {business_card['email']}")
-                
-                if contact_parts:
-                    contact_para = doc.add_paragraph(" | ".join(contact_parts))
-                    contact_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    contact_run = contact_para.runs[0]
-                    contact_run.font.size = Pt(10)
-                    contact_run.font.bold = True
-            
-            # 4. Data (kursywa, wyśrodkowana)
-            date_str = offer_data.get('date', datetime.now().strftime('%d.%m.%Y'))
-            date_para = doc.add_paragraph(f"Data: {date_str}")
-            date_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            date_para.runs[0].font.size = Pt(10)
-            date_para.runs[0].font.italic = True
-            
-            doc.add_paragraph()  # Spacer
-            
-            # 5. Tytuł (np. "Oferta handlowa")
-            title = offer_data.get('title', 'Oferta handlowa')
-            title_para = doc.add_paragraph()
-            title_run = title_para.add_run(title)
-            title_run.font.size = Pt(24)
-            title_run.font.bold = True
-            title_run.font.color.rgb = self.header_color
-            title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
-            doc.add_paragraph()  # Spacer
-            
-            # Pogrupuj produkty po kategoriach
-            items_by_category = {}
-            for item in offer_data.get('items', []):
-                category = item.get('category_name', 'Bez kategorii')
-                if category not in items_by_category:
-                    items_by_category[category] = []
-                items_by_category[category].append(item)
-            
-            # Dla każdej kategorii
-            for category_name, items in sorted(items_by_category.items()):
-                # Nagłówek kategorii
-                category_para = doc.add_paragraph(category_name)
-                category_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                category_run = category_para.runs[0]
-                category_run.font.size = Pt(14)
-                category_run.font.bold = True
-                category_run.font.color.rgb = self.primary_color
-                
-                # Tabela produktów (5 kolumn: Nazwa, Cena netto, J.M., VAT, Cena brutto)
-                table = doc.add_table(rows=1, cols=5)
-                table.style = 'Light Grid Accent 1'
-                
-                # Nagłówki kolumn
-                header_cells = table.rows[0].cells
-                headers = ['Nazwa', 'Cena netto', 'J.M.', 'VAT', 'Cena brutto']
+        target = OfferOutput(output, 'docx')
+        layout = layout or build_layout(offer_data)
+        
+        # Utwórz dokument
+        doc = Document()
+        
+        # Ustaw marginesy
+        sections = doc.sections
+        for section in sections:
+            section.top_margin = Cm(2)
+            section.bottom_margin = Cm(2)
+            section.left_margin = Cm(2)
+            section.right_margin = Cm(2)
+        
+        # Dodaj znak wodny w nagłówku
+        logo_path = 'logo_piwowar.png'
+        if os.path.exists(logo_path):
+            try:
+                # Dodaj logo jako znak wodny w nagłówku (będzie na każdej stronie)
+                section = doc.sections[0]
+                header = section.header
                 
-                for i, header_text in enumerate(headers):
-                    cell = header_cells[i]
-                    cell.text = header_text
-                    # Stylizacja nagłówka
-                    for paragraph in cell.paragraphs:
-                        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        for run in paragraph.runs:
-                            run.font.bold = True
-                            run.font.size = Pt(9)
-                            run.font.color.rgb = RGBColor(255, 255, 255)
-                    self.set_cell_background(cell, self.primary_color)
+                # Dodaj obrazek do nagłówka jako znak wodny
+                header_para = header.paragraphs[0]
+                header_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                run = header_para.add_run()
                 
-                # Wiersze z danymi
-                for item in items:
-                    prices = self.calculate_price(
-                        item['purchase_price_net'],
-                        item['margin'],
-                        item['vat_rate'],
-                        item['quantity']
-                    )
-                    
-                    row_cells = table.add_row().cells
-                    
-                    # Nazwa
-                    row_cells[0].text = item['name']
-                    row_cells[0].paragraphs[0].runs[0].font.size = Pt(8)
-                    
-                    # Cena netto
-                    row_cells[1].text = f"{prices['net_unit']:.2f}"
-                    row_cells[1].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                    row_cells[1].paragraphs[0].runs[0].font.size = Pt(8)
-                    
-                    # J.M.
-                    row_cells[2].text = f"zł/{item.get('unit', 'szt.')}"
-                    row_cells[2].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                    row_cells[2].paragraphs[0].runs[0].font.size = Pt(8)
-                    
-                    # VAT
-                    row_cells[3].text = f"{item['vat_rate']:.0f}%"
-                    row_cells[3].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                    row_cells[3].paragraphs[0].runs[0].font.size = Pt(8)
-                    
-                    # Cena brutto
-                    row_cells[4].text = f"{prices['gross_unit']:.2f} zł"
-                    row_cells[4].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                    row_cells[4].paragraphs[0].runs[0].font.size = Pt(8)
+                # Dodaj obrazek z przezroczystością (symulacja znaku wodnego)
+                picture = run.add_picture(logo_path, width=Cm(12))
                 
-                # Ustaw szerokości kolumn
-                table.columns[0].width = Cm(9)
-                table.columns[1].width = Cm(2.5)
-                table.columns[2].width = Cm(2)
-                table.columns[3].width = Cm(1.5)
-                table.columns[4].width = Cm(2.5)
+                # Dodaj efekt przezroczystości przez XML
+                drawing = picture._inline.graphic.graphicData.pic
+                blip = drawing.blipFill.blip
+                alpha = OxmlElement('a:alphaModFix')
+                alpha.set('amt', '30000')  # 30% nieprzezroczystości
+                blip.append(alpha)
                 
-                doc.add_paragraph()  # Spacer między kategoriami
-            
-            # Informacja o ważności oferty
-            doc.add_paragraph()
-            validity_para = doc.add_paragraph()
-            validity_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            validity_run = validity_para.add_run('Oferta ważna w dniu przedstawienia do momentu zmiany cen rynkowych.')
-            validity_run.font.size = Pt(8)
-            validity_run.font.italic = True
-            validity_run.font.color.rgb = RGBColor(128, 128, 128)
+            except Exception as e:
+                print(f"Błąd dodawania znaku wodnego: {e}")
+        
+        # 1. Logo w nagłówku dokumentu (jeśli istnieje)
+        if os.path.exists(logo_path):
+            try:
+                logo_para = doc.add_paragraph()
+                logo_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                logo_run = logo_para.add_run()
+                logo_run.add_picture(logo_path, width=Cm(8))
+                doc.add_paragraph()  # Spacer
+            except Exception as e:
+                print(f"Nie można załadować logo: {e}")
+        
+        # 2. Wizytówka - Firma (pogrubiona, wyśrodkowana)
+        business_card = layout['business_card']
+        if business_card and business_card.get('company'):
+            company_para = doc.add_paragraph()
+            company_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            company_run = company_para.add_run(business_card['company'])
+            company_run.font.size = Pt(14)
+            company_run.font.bold = True
+        
+        # 3. Wizytówka - reszta danych (pogrubiona, wyśrodkowana)
+        if business_card:
+            contact_parts = []
+            if business_card.get('full_name'):
+                contact_parts.append(business_card['full_name'])
+            if business_card.get('phone'):
+                contact_parts.append(f"Tel: {business_card['phone']}")
+            if business_card.get('email'):
+                contact_parts.append(f"E-mail: {business_card['email']}")
             
-            # Zapisz dokument
-            doc.save(output_path)
+            if contact_parts:
+                contact_para = doc.add_paragraph(" | ".join(contact_parts))
+                contact_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                contact_run = contact_para.runs[0]
+                contact_run.font.size = Pt(10)
+                contact_run.font.bold = True
+        
+        # 4. Data (kursywa, wyśrodkowana)
+        date_para = doc.add_paragraph(f"Data: {layout['date']}")
+        date_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        date_para.runs[0].font.size = Pt(10)
+        date_para.runs[0].font.italic = True
+        
+        doc.add_paragraph()  # Spacer
+        
+        # 5. Tytuł (np. "Oferta handlowa")
+        title_para = doc.add_paragraph()
+        title_run = title_para.add_run(layout['title'])
+        title_run.font.size = Pt(24)
+        title_run.font.bold = True
+        title_run.font.color.rgb = self.header_color
+        title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        
+        doc.add_paragraph()  # Spacer
+        
+        # Dla każdej kategorii - niezmienione sekcje kopiowane z pamięci fragmentów
+        for section_layout in layout['sections']:
+            section = self.section_cache.get(section_layout['key'])
+            if section is None:
+                elements = self.build_category_section(doc, section_layout['category'], section_layout['rows'])
+                self.section_cache.put(section_layout['key'], [deepcopy(el) for el in elements])
+            else:
+                self.append_elements(doc, section)
+        
+        # Podsumowanie (sumy z offer_data['totals'] lub policzone przy budowie układu)
+        self.add_summary(doc, layout['totals'])
+        
+        # Informacja o ważności oferty
+        doc.add_paragraph()
+        validity_para = doc.add_paragraph()
+        validity_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        validity_run = validity_para.add_run(VALIDITY_TEXT)
+        validity_run.font.size = Pt(8)
+        validity_run.font.italic = True
+        validity_run.font.color.rgb = RGBColor(128, 128, 128)
+        
+        # Zapisz dokument
+        with target as stream:
+            doc.save(stream)
+        return target.metadata(layout['totals']['items'])
+    
+    def generate_offer_docx(self, offer_data: Dict, output_path: str) -> bool:
+        """
+        Generuje DOCX z ofertą do pliku (format danych - zob. render_offer_docx)
+        
+        Returns:
+            bool - True jeśli sukces
+        """
+        try:
+            self.render_offer_docx(offer_data, output_path)
             return True
-            
         except Exception as e:
             print(f"Błąd generowania DOCX: {e}")
             return False
@@ -1,10 +1,50 @@
 import pandas as pd
-from typing import List, Dict, Optional
+from instrumentation import instrumented, result_count
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Iterator
+import csv
+import hashlib
+import io
+import os
 import re
+import time
 
 class DataImporter:
     """Klasa do importu danych z plików CSV/Excel"""
     
+    # Mapowanie nazw kolumn (elastyczne dopasowanie)
+    COLUMN_MAPPING = {
+        'Nr': 'code',
+        'nr': 'code',
+        'Indeks': 'code',
+        'Kod': 'code',
+        'Opis': 'name',
+        'opis': 'name',
+        'Nazwa': 'name',
+        'nazwa': 'name',
+        'Podst. jednostka miary': 'unit',
+        'Jednostka': 'unit',
+        'jednostka': 'unit',
+        'JM': 'unit',
+        'Ostatni koszt bezpośredni': 'purchase_price_net',
+        'Cena zakupu': 'purchase_price_net',
+        'Cena zakupu netto': 'purchase_price_net',
+        'cena zakupu': 'purchase_price_net',
+        'cena zakupu netto': 'purchase_price_net',
+        'Koszt': 'purchase_price_net',
+        'Tow. grupa księgowa VAT': 'vat_rate',
+        'VAT': 'vat_rate',
+        'Vat': 'vat_rate',
+        'vat': 'vat_rate',
+        'Stawka VAT': 'vat_rate',
+        'stawka vat': 'vat_rate'
+    }
+    
+    # Rozmiar bloku przy liczeniu wierszy pliku CSV
+    COUNT_CHUNK_SIZE = 1024 * 1024
+    # Liczba znaków z początku pliku CSV do wykrycia separatora
+    SNIFF_CHARS = 64 * 1024
+    
     @staticmethod
     def parse_vat_rate(vat_string: str) -> float:
         """
@@ -31,6 +71,260 @@ class DataImporter:
             return 23.0  # Domyślna stawka VAT
     
     @staticmethod
+    def detect_csv_separator(file_path: str) -> str:
+        """
+        Wykrywa separator pliku CSV (średnik lub przecinek) z początku pliku
+        
+        csv.Sniffer rozpoznaje też separator w polach w cudzysłowach, przy
+        remisie preferuje średnik (eksporty z ERP). Gdy nie rozpozna - średnik,
+        jeśli dzieli nagłówek na kolumny i żaden wiersz nie ma ich więcej,
+        w przeciwnym razie przecinek.
+        """
+        with open(file_path, 'r', encoding='utf-8-sig', errors='replace', newline='') as f:
+            head = f.read(DataImporter.SNIFF_CHARS)
+        if len(head) == DataImporter.SNIFF_CHARS and '\n' in head:
+            head = head[:head.rindex('\n')]  # Bez uciętego ostatniego wiersza
+        sniffer = csv.Sniffer()
+        sniffer.preferred = [';', ',']
+        try:
+            return sniffer.sniff(head, delimiters=';,').delimiter
+        except csv.Error:
+            pass
+        try:
+            rows = list(csv.reader(io.StringIO(head), delimiter=';'))
+        except csv.Error:
+            return ','
+        if rows and len(rows[0]) > 1 and all(len(row) <= len(rows[0]) for row in rows[1:]):
+            return ';'
+        return ','
+    
+    @staticmethod
+    def file_digest(file_path: str) -> str:
+        """Skrót SHA-256 zawartości pliku - pozwala pominąć ponowny import tego samego pliku"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(DataImporter.COUNT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def count_data_rows(file_path: str) -> int:
+        """
+        Szybko liczy wiersze danych (bez nagłówka) bez parsowania pliku
+        
+        CSV: zliczanie znaków nowej linii blokami - pola wielowierszowe
+        w cudzysłowach są liczone jako kilka wierszy (wynik przybliżony).
+        XLSX: wymiar arkusza z trybu read-only openpyxl.
+        """
+        if file_path.endswith('.csv'):
+            lines = 0
+            last_byte = b'\n'
+            with open(file_path, 'rb') as f:
+                while True:
+                    chunk = f.read(DataImporter.COUNT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    lines += chunk.count(b'\n')
+                    last_byte = chunk[-1:]
+            # Ostatni wiersz bez znaku nowej linii
+            if last_byte != b'\n':
+                lines += 1
+            return max(lines - 1, 0)
+        
+        if file_path.endswith('.xlsx'):
+            from openpyxl import load_workbook
+            wb = load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                ws = wb.active
+                max_row = ws.max_row
+                if max_row is None:
+                    # Brak wymiaru w pliku - policz wiersze strumieniowo
+                    max_row = sum(1 for _ in ws.iter_rows(values_only=True))
+                return max(max_row - 1, 0)
+            finally:
+                wb.close()
+        
+        # .xls - stary format, brak taniego sposobu
+        return len(pd.read_excel(file_path))
+    
+    @staticmethod
+    def read_preview(file_path: str, preview_rows: int = 5) -> Dict[str, any]:
+        """
+        Czyta tylko nagłówek i pierwsze wiersze pliku
+        
+        Returns:
+            Słownik z kluczami columns: List[str], preview: List[Dict]
+        """
+        if file_path.endswith('.csv'):
+            sep = DataImporter.detect_csv_separator(file_path)
+            df = pd.read_csv(file_path, encoding='utf-8-sig', sep=sep, nrows=preview_rows)
+            return {'columns': list(df.columns), 'preview': df.to_dict('records')}
+        
+        if file_path.endswith('.xlsx'):
+            from openpyxl import load_workbook
+            wb = load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                rows = wb.active.iter_rows(max_row=preview_rows + 1, values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    return {'columns': [], 'preview': []}
+                columns = [str(col) if col is not None else '' for col in header]
+                preview = [dict(zip(columns, row)) for row in rows]
+                return {'columns': columns, 'preview': preview}
+            finally:
+                wb.close()
+        
+        df = pd.read_excel(file_path, nrows=preview_rows)
+        return {'columns': list(df.columns), 'preview': df.to_dict('records')}
+    
+    @staticmethod
+    def parse_price(value) -> float:
+        """
+        Parsuje cenę zakupu - liczby oraz teksty z przecinkiem dziesiętnym
+        Przykłady: 100.5, "100.50", "100,50", "1 200,00"
+        """
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            return 0.0
+        if isinstance(value, str):
+            value = value.strip().replace(' ', '').replace('\xa0', '').replace(',', '.')
+            if value == '':
+                return 0.0
+        return float(value)
+    
+    @staticmethod
+    def map_columns(columns) -> Dict:
+        """
+        Dopasowuje nagłówki pliku do pól produktu według COLUMN_MAPPING
+        
+        Returns:
+            Słownik {oryginalna kolumna: pole produktu}; przy powtórzonym
+            polu obowiązuje pierwsza kolumna
+        """
+        mapped = {}
+        used_fields = set()
+        for col in columns:
+            if col is None:
+                continue
+            field = DataImporter.COLUMN_MAPPING.get(str(col).strip())
+            if field and field not in used_fields:
+                mapped[col] = field
+                used_fields.add(field)
+        
+        # Sprawdź czy mamy wymagane kolumny
+        required_columns = ['code', 'name']
+        missing_columns = [col for col in required_columns if col not in used_fields]
+        
+        if missing_columns:
+            raise ValueError(f"Brak wymaganych kolumn: {', '.join(missing_columns)}")
+        
+        return mapped
+    
+    @staticmethod
+    def row_to_product(record: Dict, category_id: Optional[int] = None) -> Optional[Dict]:
+        """
+        Zamienia wiersz ze zmapowanymi polami na słownik produktu
+        Zwraca None dla wierszy bez kodu (puste wiersze)
+        """
+        def is_missing(value):
+            return value is None or (not isinstance(value, str) and pd.isna(value))
+        
+        code = record.get('code')
+        if is_missing(code) or str(code).strip() == '':
+            return None
+        
+        name = record.get('name')
+        unit = record.get('unit')
+        vat_rate = record.get('vat_rate')
+        
+        return {
+            'code': str(code).strip(),
+            'name': str(name).strip() if not is_missing(name) else '',
+            'unit': str(unit).strip() if not is_missing(unit) and str(unit).strip() else 'szt.',
+            'purchase_price_net': DataImporter.parse_price(record.get('purchase_price_net')),
+            'vat_rate': DataImporter.parse_vat_rate(vat_rate) if not is_missing(vat_rate) else 23.0,
+            'category_id': category_id
+        }
+    
+    @staticmethod
+    def iter_product_batches(file_path: str, category_id: Optional[int] = None,
+                             batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """
+        Czyta produkty z pliku partiami, bez wczytywania całego pliku do pamięci
+        
+        - XLSX: openpyxl w trybie read-only (wiersz po wierszu, aktywny arkusz)
+        - CSV: pandas z chunksize
+        - XLS: stary format, wczytywany w całości
+        
+        Args:
+            file_path: Ścieżka do pliku
+            category_id: ID kategorii do przypisania (opcjonalne)
+            batch_size: Maksymalna liczba produktów w partii
+        
+        Yields:
+            Listy słowników z danymi produktów
+        """
+        if file_path.endswith('.xlsx'):
+            rows = DataImporter._iter_xlsx_records(file_path)
+        elif file_path.endswith('.csv'):
+            rows = DataImporter._iter_csv_records(file_path, batch_size)
+        elif file_path.endswith('.xls'):
+            df = pd.read_excel(file_path)
+            rows = DataImporter._iter_dataframe_records(df)
+        else:
+            raise ValueError("Nieobsługiwany format pliku. Użyj CSV, XLS lub XLSX.")
+        
+        batch = []
+        for record in rows:
+            product = DataImporter.row_to_product(record, category_id)
+            if product is None:
+                continue
+            batch.append(product)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    @staticmethod
+    def _iter_xlsx_records(file_path: str) -> Iterator[Dict]:
+        """Strumieniowo czyta wiersze aktywnego arkusza XLSX jako słowniki pól produktu"""
+        from openpyxl import load_workbook
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                raise ValueError("Plik jest pusty")
+            
+            mapping = DataImporter.map_columns(header)
+            positions = [(i, mapping[col]) for i, col in enumerate(header) if col in mapping]
+            
+            for row in rows:
+                yield {field: row[i] if i < len(row) else None for i, field in positions}
+        finally:
+            wb.close()
+    
+    @staticmethod
+    def _iter_csv_records(file_path: str, chunk_size: int) -> Iterator[Dict]:
+        """Czyta plik CSV kawałkami; wszystkie kolumny jako tekst (kody z zerami wiodącymi)"""
+        sep = DataImporter.detect_csv_separator(file_path)
+        for chunk in pd.read_csv(file_path, encoding='utf-8-sig', sep=sep, dtype=str,
+                                 chunksize=chunk_size):
+            yield from DataImporter._iter_dataframe_records(chunk)
+    
+    @staticmethod
+    def _iter_dataframe_records(df) -> Iterator[Dict]:
+        """Zwraca wiersze DataFrame jako słowniki pól produktu"""
+        mapping = DataImporter.map_columns(df.columns)
+        df = df[list(mapping)].rename(columns=mapping)
+        for record in df.to_dict('records'):
+            yield record
+    
+    @staticmethod
+    @instrumented(rows=result_count)
     def import_from_file(file_path: str, category_id: Optional[int] = None) -> List[Dict]:
         """
         Importuje produkty z pliku CSV lub Excel
@@ -42,6 +336,9 @@ class DataImporter:
         - Ostatni koszt bezpośredni -> purchase_price_net
         - Tow. grupa księgowa VAT -> vat_rate
         
+        Dla dużych plików lepiej użyć iter_product_batches, które nie
+        trzyma całego pliku w pamięci.
+        
         Args:
             file_path: Ścieżka do pliku
             category_id: ID kategorii do przypisania (opcjonalne)
@@ -49,120 +346,106 @@ class DataImporter:
         Returns:
             Lista słowników z danymi produktów
         """
-        # Wykryj typ pliku i wczytaj dane
-        if file_path.endswith('.csv'):
-            # Próbuj najpierw z separatorem średnik
-            try:
-                df = pd.read_csv(file_path, encoding='utf-8-sig', sep=';')
-                # Jeśli mamy tylko jedną kolumnę, spróbuj z przecinkiem
-                if len(df.columns) == 1:
-                    df = pd.read_csv(file_path, encoding='utf-8-sig', sep=',')
-            except:
-                df = pd.read_csv(file_path, encoding='utf-8-sig')
-        elif file_path.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_path)
-        else:
-            raise ValueError("Nieobsługiwany format pliku. Użyj CSV, XLS lub XLSX.")
-        
-        # Mapowanie nazw kolumn (elastyczne dopasowanie)
-        column_mapping = {
-            'Nr': 'code',
-            'nr': 'code',
-            'Indeks': 'code',
-            'Kod': 'code',
-            'Opis': 'name',
-            'opis': 'name',
-            'Nazwa': 'name',
-            'nazwa': 'name',
-            'Podst. jednostka miary': 'unit',
-            'Jednostka': 'unit',
-            'jednostka': 'unit',
-            'JM': 'unit',
-            'Ostatni koszt bezpośredni': 'purchase_price_net',
-            'Cena zakupu': 'purchase_price_net',
-            'Cena zakupu netto': 'purchase_price_net',
-            'cena zakupu': 'purchase_price_net',
-            'cena zakupu netto': 'purchase_price_net',
-            'Koszt': 'purchase_price_net',
-            'Tow. grupa księgowa VAT': 'vat_rate',
-            'VAT': 'vat_rate',
-            'Vat': 'vat_rate',
-            'vat': 'vat_rate',
-            'Stawka VAT': 'vat_rate',
-            'stawka vat': 'vat_rate'
-        }
-        
-        # Znajdź i zmapuj kolumny
-        renamed_columns = {}
-        for col in df.columns:
-            col_clean = col.strip()
-            if col_clean in column_mapping:
-                renamed_columns[col] = column_mapping[col_clean]
+        products = []
+        for batch in DataImporter.iter_product_batches(file_path, category_id):
+            products.extend(batch)
+        return products
+    
+    @staticmethod
+    @instrumented(rows=lambda result, args, kwargs: len(result['products']))
+    def import_from_files(file_paths: List[str], category_id: Optional[int] = None,
+                          max_workers: Optional[int] = None) -> Dict[str, any]:
+        """
+        Importuje wiele plików równolegle (osobny proces na plik)
         
-        df = df.rename(columns=renamed_columns)
+        Pliki są parsowane niezależnie, a wyniki łączone po kodzie produktu.
+        Rozstrzyganie konfliktów jest deterministyczne: pliki są porządkowane
+        według ścieżki i przy powtórzonym kodzie wygrywa późniejszy plik
+        (w obrębie pliku - późniejszy wiersz).
         
-        # Sprawdź czy mamy wymagane kolumny
-        required_columns = ['code', 'name']
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        Args:
+            file_paths: Ścieżki do plików
+            category_id: ID kategorii do przypisania (opcjonalne)
+            max_workers: Liczba procesów (domyślnie liczba rdzeni)
         
-        if missing_columns:
-            raise ValueError(f"Brak wymaganych kolumn: {', '.join(missing_columns)}")
+        Returns:
+            Słownik z kluczami:
+            - products: List[Dict] - połączone produkty (gotowe do import_products_batch)
+            - files: List[Dict] - per plik: file, rows, overridden, seconds, error
+            - conflicts: int - liczba kodów występujących w więcej niż jednym pliku
+            - seconds: float - czas parsowania
+        """
+        ordered = sorted(file_paths)
+        start = time.perf_counter()
         
-        # Ustaw domyślne wartości dla brakujących kolumn
-        if 'unit' not in df.columns:
-            df['unit'] = 'szt.'
-        if 'purchase_price_net' not in df.columns:
-            df['purchase_price_net'] = 0.0
-        if 'vat_rate' not in df.columns:
-            df['vat_rate'] = 23.0
+        jobs = [(path, category_id) for path in ordered]
+        workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+        if workers <= 1:
+            results = [_parse_file_worker(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_parse_file_worker, jobs))
         
-        # Przetwórz dane
-        products = []
-        for _, row in df.iterrows():
-            # Pomiń puste wiersze
-            if pd.isna(row['code']) or str(row['code']).strip() == '':
-                continue
-            
-            product = {
-                'code': str(row['code']).strip(),
-                'name': str(row['name']).strip() if not pd.isna(row['name']) else '',
-                'unit': str(row['unit']).strip() if not pd.isna(row['unit']) else 'szt.',
-                'purchase_price_net': float(row['purchase_price_net']) if not pd.isna(row['purchase_price_net']) else 0.0,
-                'vat_rate': DataImporter.parse_vat_rate(row['vat_rate']),
-                'category_id': category_id
-            }
-            
-            products.append(product)
+        merged = {}
+        owner = {}
+        files = []
+        conflict_codes = set()
+        for index, (path, products, seconds, error) in enumerate(results):
+            files.append({
+                'file': path,
+                'rows': len(products),
+                'overridden': 0,
+                'seconds': seconds,
+                'error': error
+            })
+            for product in products:
+                code = product['code']
+                previous = owner.get(code)
+                if previous is not None and previous != index:
+                    files[previous]['overridden'] += 1
+                    conflict_codes.add(code)
+                # Usunięcie przed wstawieniem zachowuje kolejność ostatniego wystąpienia
+                merged.pop(code, None)
+                merged[code] = product
+                owner[code] = index
         
-        return products
+        return {
+            'products': list(merged.values()),
+            'files': files,
+            'conflicts': len(conflict_codes),
+            'seconds': time.perf_counter() - start
+        }
     
     @staticmethod
-    def validate_import_file(file_path: str) -> Dict[str, any]:
+    @instrumented(rows=lambda result, args, kwargs: result['total_rows'])
+    def validate_import_file(file_path: str, preview_rows: int = 5) -> Dict[str, any]:
         """
         Waliduje plik przed importem
         
+        Czyta tylko początek pliku (podgląd), a liczbę wierszy wyznacza
+        tanim skanowaniem - działa szybko także dla bardzo dużych plików.
+        
         Returns:
             Słownik z informacjami: 
             - valid: bool
             - message: str
-            - preview: List[Dict] (pierwsze 5 rekordów)
+            - preview: List[Dict] (pierwsze preview_rows rekordów)
             - total_rows: int
         """
+        if not file_path.endswith(('.csv', '.xlsx', '.xls')):
+            return {
+                'valid': False,
+                'message': 'Nieobsługiwany format pliku',
+                'preview': [],
+                'total_rows': 0
+            }
+        
         try:
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path, encoding='utf-8-sig')
-            elif file_path.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(file_path)
-            else:
-                return {
-                    'valid': False,
-                    'message': 'Nieobsługiwany format pliku',
-                    'preview': [],
-                    'total_rows': 0
-                }
+            head = DataImporter.read_preview(file_path, preview_rows)
+            total_rows = DataImporter.count_data_rows(file_path) if head['preview'] else 0
             
             # Sprawdź czy są jakieś dane
-            if len(df) == 0:
+            if total_rows == 0:
                 return {
                     'valid': False,
                     'message': 'Plik jest pusty',
@@ -170,15 +453,12 @@ class DataImporter:
                     'total_rows': 0
                 }
             
-            # Podgląd pierwszych 5 wierszy
-            preview = df.head(5).to_dict('records')
-            
             return {
                 'valid': True,
-                'message': f'Plik zawiera {len(df)} wierszy',
-                'preview': preview,
-                'total_rows': len(df),
-                'columns': list(df.columns)
+                'message': f'Plik zawiera {total_rows} wierszy',
+                'preview': head['preview'],
+                'total_rows': total_rows,
+                'columns': head['columns']
             }
             
         except Exception as e:
@@ -188,3 +468,19 @@ class DataImporter:
                 'preview': [],
                 'total_rows': 0
             }
+
+
+def _parse_file_worker(job):
+    """
+    Parsuje jeden plik w procesie roboczym import_from_files
+    
+    Returns:
+        (ścieżka, produkty, czas w sekundach, komunikat błędu lub None)
+    """
+    file_path, category_id = job
+    start = time.perf_counter()
+    try:
+        products = DataImporter.import_from_file(file_path, category_id)
+        return file_path, products, time.perf_counter() - start, None
+    except Exception as e:
+        return file_path, [], time.perf_counter() - start, str(e)
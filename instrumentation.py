@@ -0,0 +1,302 @@
+"""
+Opcjonalna instrumentacja gorących ścieżek aplikacji
+
+Rejestruje dla każdej operacji: liczbę wywołań, błędy, czas (łączny,
+średni, maksymalny), liczbę przetworzonych wierszy i zapisanych bajtów.
+Domyślnie wyłączona - włączana zmienną środowiskową
+OFERTOMAT_INSTRUMENTATION=1 lub funkcją enable(). Gdy jest wyłączona,
+udekorowane funkcje wywoływane są bez pomiaru.
+
+Profilowanie (start_profiling/stop_profiling) obejmuje zewnętrzne wywołania
+instrumentowanych operacji w dowolnym wątku - każde jest profilowane
+osobnym cProfile.Profile, a wyniki są sumowane. Od Pythona 3.12 profiler
+jest jeden na proces, więc profilowana jest naraz operacja tylko jednego
+wątku (pozostałe wykonują się bez profilu). Profilowanie nigdy nie
+przerywa samej operacji.
+
+Przykład:
+    @instrumented('Database.get_products', rows=lambda result, args, kwargs: len(result))
+    def get_products(self, ...): ...
+
+    with measure('eksport') as m:
+        ...
+        m.rows = 100
+"""
+import cProfile
+import csv
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+_enabled = os.environ.get('OFERTOMAT_INSTRUMENTATION', '') == '1'
+_lock = threading.Lock()
+_stats: Dict[str, Dict] = {}
+_profiling = False
+_profile_stats: Optional[pstats.Stats] = None
+_local = threading.local()
+# Od Pythona 3.12 aktywny może być tylko jeden profiler w procesie
+_PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+_profiler_slot = threading.Lock()
+
+
+def enable():
+    """Włącza rejestrowanie pomiarów"""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Wyłącza rejestrowanie pomiarów (zebrane dane zostają)"""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Czyści zebrane pomiary"""
+    with _lock:
+        _stats.clear()
+
+
+def record(name: str, seconds: float, rows: int = 0, bytes_written: int = 0, error: bool = False):
+    """Dopisuje pojedynczy pomiar operacji do rejestru"""
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = {
+                'calls': 0, 'errors': 0, 'total_s': 0.0, 'max_s': 0.0,
+                'rows': 0, 'bytes': 0
+            }
+        stats['calls'] += 1
+        stats['errors'] += 1 if error else 0
+        stats['total_s'] += seconds
+        stats['max_s'] = max(stats['max_s'], seconds)
+        stats['rows'] += rows or 0
+        stats['bytes'] += bytes_written or 0
+
+
+class Measurement:
+    """Bieżący pomiar w bloku measure() - pozwala ustawić rows i bytes_written"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = 0
+        self.bytes_written = 0
+
+
+@contextmanager
+def measure(name: str):
+    """Mierzy blok kodu (gdy instrumentacja jest włączona)"""
+    measurement = Measurement(name)
+    if not _enabled and not _profiling:
+        yield measurement
+        return
+
+    profiler = _begin_profile()
+    start = time.perf_counter()
+    error = False
+    try:
+        yield measurement
+    except BaseException:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _end_profile(profiler)
+        if _enabled:
+            record(name, elapsed, measurement.rows, measurement.bytes_written, error)
+
+
+def instrumented(name: Optional[str] = None, rows: Optional[Callable] = None,
+                 bytes_written: Optional[Callable] = None):
+    """
+    Dekorator mierzący wywołania funkcji
+
+    Args:
+        name: Nazwa operacji (domyślnie kwalifikowana nazwa funkcji)
+        rows: Funkcja (wynik, args, kwargs) -> liczba przetworzonych wierszy
+        bytes_written: Funkcja (wynik, args, kwargs) -> liczba zapisanych bajtów
+    """
+    def decorator(func):
+        op_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled and not _profiling:
+                return func(*args, **kwargs)
+
+            profiler = _begin_profile()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                elapsed = time.perf_counter() - start
+                _end_profile(profiler)
+                if _enabled:
+                    record(op_name, elapsed, error=True)
+                raise
+            elapsed = time.perf_counter() - start
+            _end_profile(profiler)
+            if not _enabled:
+                return result
+
+            row_count = 0
+            byte_count = 0
+            try:
+                if rows:
+                    row_count = rows(result, args, kwargs)
+                if bytes_written:
+                    byte_count = bytes_written(result, args, kwargs)
+            except Exception:
+                pass  # Metryki pomocnicze nie mogą psuć wywołania
+            record(op_name, elapsed, row_count, byte_count)
+            return result
+        return wrapper
+    return decorator
+
+
+def result_count(result, args, kwargs) -> int:
+    """Metryka rows: liczba elementów wyniku (listy)"""
+    return len(result) if result is not None else 0
+
+
+def rendered_bytes(result, args, kwargs) -> int:
+    """Metryka bytes_written dla generatorów: rozmiar z metadanych render_offer_*"""
+    return result.get('bytes', 0) if result else 0
+
+
+def offer_item_count(result, args, kwargs) -> int:
+    """Metryka rows dla generatorów: liczba pozycji oferty"""
+    offer_data = kwargs.get('offer_data', args[1] if len(args) > 1 else None)
+    return len(offer_data.get('items', [])) if offer_data else 0
+
+
+def summary() -> List[Dict]:
+    """
+    Zestawienie pomiarów posortowane malejąco po łącznym czasie
+
+    Returns:
+        Lista słowników: name, calls, errors, total_ms, mean_ms, max_ms, rows, bytes
+    """
+    with _lock:
+        items = [(name, dict(stats)) for name, stats in _stats.items()]
+
+    result = []
+    for name, stats in items:
+        result.append({
+            'name': name,
+            'calls': stats['calls'],
+            'errors': stats['errors'],
+            'total_ms': round(stats['total_s'] * 1000, 3),
+            'mean_ms': round(stats['total_s'] * 1000 / stats['calls'], 3) if stats['calls'] else 0.0,
+            'max_ms': round(stats['max_s'] * 1000, 3),
+            'rows': stats['rows'],
+            'bytes': stats['bytes'],
+        })
+    result.sort(key=lambda s: s['total_ms'], reverse=True)
+    return result
+
+
+def dump_json(path: str) -> str:
+    """Zapisuje zestawienie pomiarów do pliku JSON"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary(), f, indent=2, ensure_ascii=False)
+    return path
+
+
+def dump_csv(path: str) -> str:
+    """Zapisuje zestawienie pomiarów do pliku CSV"""
+    fields = ['name', 'calls', 'errors', 'total_ms', 'mean_ms', 'max_ms', 'rows', 'bytes']
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, delimiter=';')
+        writer.writeheader()
+        writer.writerows(summary())
+    return path
+
+
+# === PROFILOWANIE ===
+
+def is_profiling() -> bool:
+    return _profiling
+
+
+def start_profiling():
+    """Włącza profilowanie instrumentowanych operacji (cProfile)"""
+    global _profiling, _profile_stats
+    with _lock:
+        _profile_stats = None
+    _profiling = True
+
+
+def stop_profiling(path: Optional[str] = None, top: int = 30) -> str:
+    """
+    Wyłącza profilowanie
+
+    Args:
+        path: Plik .prof na statystyki (do otwarcia np. w snakeviz), opcjonalnie
+        top: Liczba funkcji w zwracanym raporcie tekstowym
+
+    Returns:
+        Raport tekstowy (funkcje posortowane po czasie skumulowanym),
+        pusty jeśli nic nie zostało zarejestrowane
+    """
+    global _profiling, _profile_stats
+    _profiling = False
+    with _lock:
+        stats = _profile_stats
+        _profile_stats = None
+    if stats is None:
+        return ''
+
+    if path:
+        stats.dump_stats(path)
+
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats('cumulative').print_stats(top)
+    return output.getvalue()
+
+
+def _begin_profile() -> Optional[cProfile.Profile]:
+    """Zaczyna profil zewnętrznej operacji w bieżącym wątku (zagnieżdżone są pomijane)"""
+    if not _profiling or getattr(_local, 'profiling', False):
+        return None
+    if _PROCESS_WIDE_PROFILER and not _profiler_slot.acquire(blocking=False):
+        return None  # Profil innego wątku w toku
+    _local.profiling = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Aktywne inne narzędzie profilujące - operacja wykonuje się bez profilu
+        _local.profiling = False
+        if _PROCESS_WIDE_PROFILER:
+            _profiler_slot.release()
+        return None
+    return profiler
+
+
+def _end_profile(profiler: Optional[cProfile.Profile]):
+    """Kończy profil operacji i dołącza go do zbiorczych statystyk"""
+    global _profile_stats
+    if profiler is None:
+        return
+    profiler.disable()
+    _local.profiling = False
+    if _PROCESS_WIDE_PROFILER:
+        _profiler_slot.release()
+    with _lock:
+        if _profile_stats is None:
+            _profile_stats = pstats.Stats(profiler)
+        else:
+            _profile_stats.add(profiler)
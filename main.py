@@ -1,21 +1,56 @@
 import flet as ft
+import asyncio
+import io
 from database import Database
-from importer import DataImporter
-from pdf_generator import PDFGenerator
-from docx_generator import DOCXGenerator
+from async_database import AsyncDatabase
+import instrumentation
+from offer_rendering import render_offer_formats
+from render_cache import RenderCache
+from ui_updates import UpdateScheduler
+from offer_editor import OfferEditor
+from offer_totals import OfferTotals
+from offer_history import OfferHistory
+from product_index import ProductIndex
+from category_selector import CategoryTreeSelector
+import offer_bulk
 from datetime import datetime
+import threading
+import time
 import os
 
+# Moduły importer (pandas), pdf_generator (reportlab) i docx_generator (python-docx)
+# są ładowane leniwie - ich import kosztuje więcej niż cały start interfejsu
+
+# Najwięcej marż produktów klienta pokazywanych w widoku klientów
+CUSTOMER_PRODUCTS_SHOWN = 200
+
 class OfertomatApp:
     def __init__(self, page: ft.Page):
         self.page = page
+        # Odświeżenia strony łączone w jedno na klatkę
+        self.ui = UpdateScheduler(page)
         self.db = Database()
-        self.importer = DataImporter()
-        self.pdf_gen = PDFGenerator()
-        self.docx_gen = DOCXGenerator()
+        # Zapytania z obsługi zdarzeń async def - bez blokowania interfejsu
+        self.adb = AsyncDatabase(self.db)
+        
+        # Ciężkie komponenty tworzone przy pierwszym użyciu (patrz właściwości niżej)
+        self._importer = None
+        self._pdf_gen = None
+        self._docx_gen = None
+        self._lazy_lock = threading.Lock()
+        
+        # Wygenerowane oferty wg treści - ponowne generowanie bez zmian nie renderuje
+        self.render_cache = RenderCache()
         
         # Dane tymczasowe dla oferty
         self.offer_items = []
+        # Sumy oferty aktualizowane przy każdej zmianie pozycji
+        self.offer_totals = OfferTotals()
+        # Zmiany pozycji do cofnięcia (Ctrl+Z) i ponowienia (Ctrl+Y)
+        self.offer_history = OfferHistory()
+        self.offer_editor = None
+        # Podpowiedzi produktów po kodzie/nazwie (budowany w tle, aktualizowany po zapisach)
+        self.product_index = ProductIndex()
         
         # Konfiguracja strony
         self.page.title = "Ofertomat"
@@ -62,17 +97,28 @@ class OfertomatApp:
                     selected_icon="description",
                     label="Nowa Oferta"
                 ),
+                ft.NavigationRailDestination(
+                    icon="people_outlined",
+                    selected_icon="people",
+                    label="Klienci"
+                ),
                 ft.NavigationRailDestination(
                     icon="badge_outlined",
                     selected_icon="badge",
                     label="Wizytówka"
                 ),
+                ft.NavigationRailDestination(
+                    icon="monitor_heart_outlined",
+                    selected_icon="monitor_heart",
+                    label="Diagnostyka"
+                ),
             ],
             on_change=self.navigate
         )
         
         # Kontener na zawartość
         self.content = ft.Container(expand=True)
+        self.page.on_keyboard_event = self.on_keyboard
         
         # Layout
         self.page.add(
@@ -85,6 +131,52 @@ class OfertomatApp:
         
         # Pokaż pierwszy widok
         self.show_categories_view()
+        
+        # Po pierwszym wyrenderowaniu doładuj ciężkie moduły w tle
+        threading.Thread(target=self.warm_up, daemon=True).start()
+    
+    # === LENIWE ŁADOWANIE ===
+    
+    @property
+    def importer(self):
+        """Importer danych - ładuje pandas przy pierwszym użyciu"""
+        with self._lazy_lock:
+            if self._importer is None:
+                from importer import DataImporter
+                self._importer = DataImporter()
+            return self._importer
+    
+    @property
+    def pdf_gen(self):
+        """Generator PDF - ładuje reportlab przy pierwszym użyciu"""
+        with self._lazy_lock:
+            if self._pdf_gen is None:
+                from pdf_generator import PDFGenerator
+                self._pdf_gen = PDFGenerator()
+            return self._pdf_gen
+    
+    @property
+    def docx_gen(self):
+        """Generator DOCX - ładuje python-docx przy pierwszym użyciu"""
+        with self._lazy_lock:
+            if self._docx_gen is None:
+                from docx_generator import DOCXGenerator
+                self._docx_gen = DOCXGenerator()
+            return self._docx_gen
+    
+    def warm_up(self):
+        """Ładuje ciężkie moduły w tle, żeby pierwszy import/oferta nie czekały"""
+        try:
+            self.importer
+            self.pdf_gen
+            self.docx_gen
+        except Exception as e:
+            # Błąd zostanie zgłoszony ponownie przy faktycznym użyciu
+            print(f"Błąd wstępnego ładowania modułów: {e}")
+        try:
+            self.product_index.attach(self.db)
+        except Exception as e:
+            print(f"Błąd budowy indeksu produktów: {e}")
     
     def navigate(self, e):
         """Nawigacja między widokami"""
@@ -97,13 +189,17 @@ class OfertomatApp:
         elif e.control.selected_index == 3:
             self.show_offer_view()
         elif e.control.selected_index == 4:
+            self.show_customers_view()
+        elif e.control.selected_index == 5:
             self.show_business_card_view()
+        elif e.control.selected_index == 6:
+            self.show_diagnostics_view()
     
     # === KATEGORIE ===
     
     def show_categories_view(self):
-        """Widok zarządzania kategoriami"""
-        categories = self.db.get_categories()
+        """Widok zarządzania kategoriami (drzewo - podkategorie z wcięciem)"""
+        categories = self.db.get_category_tree()
         
         # Tabela kategorii
         rows = []
@@ -114,8 +210,9 @@ class OfertomatApp:
             rows.append(
                 ft.DataRow(
                     cells=[
-                        ft.DataCell(ft.Text(cat['name'])),
-                        ft.DataCell(ft.Text(f"{cat['default_margin']:.1f}%")),
+                        ft.DataCell(ft.Container(ft.Text(cat['name']),
+                                                 padding=ft.padding.only(left=24 * cat['depth']))),
+                        ft.DataCell(ft.Text(self.category_margin_text(cat))),
                         ft.DataCell(
                             ft.Row([
                                 ft.IconButton(
@@ -163,22 +260,24 @@ class OfertomatApp:
                 padding=20
             )
         ], scroll=ft.ScrollMode.AUTO, expand=True)
-        self.page.update()
+        self.ui.request()
     
     def add_category_dialog(self, e):
         """Dialog dodawania kategorii"""
         def close_dlg(e):
             dlg.open = False
-            self.page.update()
+            self.ui.request(dlg)
         
         def save_category(e):
             try:
-                if name_field.value and margin_field.value:
-                    margin = float(margin_field.value)
-                    success = self.db.add_category(name_field.value, margin)
+                if name_field.value:
+                    margin = self.parse_category_margin(margin_field.value, parent_dropdown.value)
+                    if margin is False:
+                        return
+                    success = self.db.add_category(name_field.value, margin, self.parent_id(parent_dropdown.value))
                     if success:
                         dlg.open = False
-                        self.page.update()
+                        self.ui.request(dlg)
                         self.show_categories_view()
                         self.show_snackbar(f"Kategoria '{name_field.value}' dodana!", ft.Colors.GREEN_400)
                     else:
@@ -190,12 +289,14 @@ class OfertomatApp:
                 self.show_snackbar(f"Błąd: {str(ex)}", ft.Colors.RED_400)
         
         name_field = ft.TextField(label="Nazwa kategorii", autofocus=True)
-        margin_field = ft.TextField(label="Domyślna marża (%)", value="30", keyboard_type=ft.KeyboardType.NUMBER)
+        margin_field = ft.TextField(label="Domyślna marża (%)", value="30", keyboard_type=ft.KeyboardType.NUMBER,
+                                    helper_text="Puste - marża kategorii nadrzędnej")
+        parent_dropdown = self.category_parent_dropdown()
         
         dlg = ft.AlertDialog(
             modal=True,
             title=ft.Text("Dodaj kategorię"),
-            content=ft.Column([name_field, margin_field], tight=True, height=150),
+            content=ft.Column([name_field, parent_dropdown, margin_field], tight=True, height=240),
             actions=[
                 ft.TextButton("Anuluj", on_click=close_dlg),
                 ft.FilledButton("Zapisz", on_click=save_category),
@@ -205,26 +306,31 @@ class OfertomatApp:
         
         self.page.overlay.append(dlg)
         dlg.open = True
-        self.page.update()
+        self.ui.request()
     
     def edit_category(self, category):
         """Dialog edycji kategorii"""
         def close_dlg(e):
             dlg.open = False
-            self.page.update()
+            self.ui.request(dlg)
         
         def save_category(e):
             try:
-                if name_field.value and margin_field.value:
-                    margin = float(margin_field.value)
-                    success = self.db.update_category(category['id'], name_field.value, margin)
+                if name_field.value:
+                    margin = self.parse_category_margin(margin_field.value, parent_dropdown.value)
+                    if margin is False:
+                        return
+                    # Przeniesienie i zmiana nazwy razem - nieudany zapis niczego nie zmienia
+                    parent_id = self.parent_id(parent_dropdown.value)
+                    success = self.db.update_category(category['id'], name_field.value, margin, parent_id)
                     if success:
                         dlg.open = False
-                        self.page.update()
+                        self.ui.request(dlg)
                         self.show_categories_view()
                         self.show_snackbar(f"Kategoria '{name_field.value}' zaktualizowana!", ft.Colors.GREEN_400)
                     else:
-                        self.show_snackbar("Kategoria o tej nazwie już istnieje!", ft.Colors.RED_400)
+                        self.show_snackbar("Kategoria o tej nazwie już istnieje lub nie można jej przenieść "
+                                           "do podkategorii!", ft.Colors.RED_400)
             except ValueError:
                 self.show_snackbar("Nieprawidłowa wartość marży!", ft.Colors.RED_400)
             except Exception as ex:
@@ -232,12 +338,16 @@ class OfertomatApp:
                 self.show_snackbar(f"Błąd: {str(ex)}", ft.Colors.RED_400)
         
         name_field = ft.TextField(label="Nazwa kategorii", value=category['name'])
-        margin_field = ft.TextField(label="Domyślna marża (%)", value=str(category['default_margin']), keyboard_type=ft.KeyboardType.NUMBER)
+        margin = category['default_margin']
+        margin_field = ft.TextField(label="Domyślna marża (%)", value="" if margin is None else str(margin),
+                                    keyboard_type=ft.KeyboardType.NUMBER,
+                                    helper_text="Puste - marża kategorii nadrzędnej")
+        parent_dropdown = self.category_parent_dropdown(category)
         
         dlg = ft.AlertDialog(
             modal=True,
             title=ft.Text("Edytuj kategorię"),
-            content=ft.Column([name_field, margin_field], tight=True, height=150),
+            content=ft.Column([name_field, parent_dropdown, margin_field], tight=True, height=240),
             actions=[
                 ft.TextButton("Anuluj", on_click=close_dlg),
                 ft.FilledButton("Zapisz", on_click=save_category),
@@ -247,21 +357,60 @@ class OfertomatApp:
         
         self.page.overlay.append(dlg)
         dlg.open = True
-        self.page.update()
+        self.ui.request()
+    
+    @staticmethod
+    def category_margin_text(category):
+        """Marża kategorii do tabeli - własna albo dziedziczona"""
+        if category['default_margin'] is not None:
+            return f"{category['default_margin']:.1f}%"
+        return f"{category['effective_margin']:.1f}% (dziedziczona)"
+    
+    def category_parent_dropdown(self, category=None):
+        """Lista wyboru kategorii nadrzędnej (bez edytowanej kategorii i jej podkategorii)"""
+        options = [ft.dropdown.Option(key="", text="Brak (kategoria główna)")]
+        skip_depth = None
+        for cat in self.db.get_category_tree():
+            if skip_depth is not None and cat['depth'] > skip_depth:
+                continue
+            skip_depth = None
+            if category is not None and cat['id'] == category['id']:
+                skip_depth = cat['depth']
+                continue
+            options.append(ft.dropdown.Option(key=str(cat['id']), text="    " * cat['depth'] + cat['name']))
+        parent_id = category['parent_id'] if category else None
+        return ft.Dropdown(label="Kategoria nadrzędna", options=options,
+                           value="" if parent_id is None else str(parent_id))
+    
+    @staticmethod
+    def parent_id(value):
+        return int(value) if value else None
+    
+    def parse_category_margin(self, value, parent):
+        """Marża z pola dialogu: liczba, None (dziedziczona) albo False przy błędzie"""
+        if not (value or '').strip():
+            if not parent:
+                self.show_snackbar("Kategoria główna musi mieć marżę!", ft.Colors.RED_400)
+                return False
+            return None
+        return float(value.replace(',', '.'))
     
     def delete_category(self, category):
         """Dialog usuwania kategorii"""
         def close_dlg(e):
             dlg.open = False
-            self.page.update()
+            self.ui.request(dlg)
         
         def confirm_delete(e):
             try:
-                self.db.delete_category(category['id'])
+                deleted = self.db.delete_category(category['id'])
                 dlg.open = False
-                self.page.update()
+                self.ui.request(dlg)
                 self.show_categories_view()
-                self.show_snackbar(f"Kategoria '{category['name']}' usunięta!", ft.Colors.GREEN_400)
+                if deleted:
+                    self.show_snackbar(f"Kategoria '{category['name']}' usunięta!", ft.Colors.GREEN_400)
+                else:
+                    self.show_snackbar("Kategoria ma produkty lub podkategorie!", ft.Colors.ORANGE_400)
             except Exception as ex:
                 print(f"Błąd usuwania kategorii: {ex}")
                 self.show_snackbar(f"Błąd: {str(ex)}", ft.Colors.RED_400)
@@ -279,7 +428,7 @@ class OfertomatApp:
         
         self.page.overlay.append(dlg)
         dlg.open = True
-        self.page.update()
+        self.ui.request()
     
     # === PRODUKTY ===
     
@@ -292,8 +441,10 @@ class OfertomatApp:
             expand=True
         )
         
-        self.products_table_container = ft.Container(padding=20)
-        self.refresh_products_table()
+        self.products_table_container = ft.Container(
+            content=ft.ProgressRing(width=24, height=24),
+            padding=20
+        )
         
         self.content.content = ft.Column([
             ft.Container(
@@ -312,7 +463,13 @@ class OfertomatApp:
             ),
             self.products_table_container
         ], scroll=ft.ScrollMode.AUTO, expand=True)
-        self.page.update()
+        self.ui.request()
+        self.page.run_task(self.load_products_table)
+    
+    async def load_products_table(self):
+        """Wczytuje katalog w tle i wypełnia tabelę produktów"""
+        products = await self.adb.get_products()
+        self.refresh_products_table(products)
     
     def refresh_products_table(self, products=None):
         """Odświeża tabelę produktów"""
@@ -367,15 +524,18 @@ class OfertomatApp:
         )
         
         self.products_table_container.content = table
-        self.page.update()
+        self.ui.request(self.products_table_container)
     
-    def search_products(self, e):
-        """Wyszukiwanie produktów"""
+    async def search_products(self, e):
+        """Wyszukiwanie produktów (nowe naciśnięcie klawisza anuluje poprzednie zapytanie)"""
         query = e.control.value
-        if query:
-            products = self.db.search_products(query)
-        else:
-            products = self.db.get_products()
+        try:
+            if query:
+                products = await self.adb.latest('product_search', 'search_products', query)
+            else:
+                products = await self.adb.latest('product_search', 'get_products')
+        except asyncio.CancelledError:
+            return
         self.refresh_products_table(products)
     
     def add_product_dialog(self, e):
@@ -392,7 +552,7 @@ class OfertomatApp:
         
         def close_dlg(e):
             dialog.open = False
-            self.page.update()
+            self.ui.request(dialog)
         
         def save_product(e):
             if code_field.value and name_field.value:
@@ -411,7 +571,7 @@ class OfertomatApp:
                     )
                     if success:
                         dialog.open = False
-                        self.page.update()
+                        self.ui.request(dialog)
                         self.show_products_view()
                     else:
                         self.show_snackbar("Produkt o tym kodzie już istnieje!", ft.Colors.RED_400)
@@ -431,7 +591,7 @@ class OfertomatApp:
         
         self.page.overlay.append(dialog)
         dialog.open = True
-        self.page.update()
+        self.ui.request()
     
     def edit_product(self, product):
         """Dialog edycji produktu"""
@@ -451,7 +611,7 @@ class OfertomatApp:
         
         def close_dlg(e):
             dialog.open = False
-            self.page.update()
+            self.ui.request(dialog)
         
         def save_product(e):
             if code_field.value and name_field.value:
@@ -471,7 +631,7 @@ class OfertomatApp:
                     )
                     if success:
                         dialog.open = False
-                        self.page.update()
+                        self.ui.request(dialog)
                         self.show_products_view()
                     else:
                         self.show_snackbar("Produkt o tym kodzie już istnieje!", ft.Colors.RED_400)
@@ -491,18 +651,18 @@ class OfertomatApp:
         
         self.page.overlay.append(dialog)
         dialog.open = True
-        self.page.update()
+        self.ui.request()
     
     def delete_product(self, product):
         """Dialog usuwania produktu"""
         def close_dlg(e):
             dialog.open = False
-            self.page.update()
+            self.ui.request(dialog)
         
         def confirm_delete(e):
             self.db.delete_product(product['id'])
             dialog.open = False
-            self.page.update()
+            self.ui.request(dialog)
             self.show_products_view()
         
         dialog = ft.AlertDialog(
@@ -516,7 +676,7 @@ class OfertomatApp:
         
         self.page.overlay.append(dialog)
         dialog.open = True
-        self.page.update()
+        self.ui.request()
     
     # === IMPORT ===
     
@@ -534,13 +694,18 @@ class OfertomatApp:
         self.import_file_picker = ft.FilePicker(on_result=self.on_file_picked)
         self.page.overlay.append(self.import_file_picker)
         
+        self.import_force_checkbox = ft.Checkbox(
+            label="Importuj ponownie także pliki bez zmian",
+            value=False
+        )
+        
         self.import_status = ft.Text()
         
         self.content.content = ft.Column([
             ft.Container(
                 content=ft.Column([
                     ft.Text("Import produktów", size=24, weight=ft.FontWeight.BOLD),
-                    ft.Text("Importuj produkty z plików CSV lub Excel (.xlsx, .xls)"),
+                    ft.Text("Importuj produkty z plików CSV lub Excel (.xlsx, .xls) - można wybrać wiele plików naraz"),
                     ft.Divider(),
                     ft.Text("Wymagane kolumny w pliku:", weight=ft.FontWeight.BOLD),
                     ft.Text("• Nr/Indeks/Kod - kod produktu"),
@@ -550,12 +715,14 @@ class OfertomatApp:
                     ft.Text("• Tow. grupa księgowa VAT/VAT (opcjonalne)"),
                     ft.Divider(),
                     self.import_category_dropdown,
+                    self.import_force_checkbox,
                     ft.FilledButton(
-                        "Wybierz plik do importu",
+                        "Wybierz pliki do importu",
                         icon="upload_file",
                         on_click=lambda e: self.import_file_picker.pick_files(
                             allowed_extensions=["csv", "xlsx", "xls"],
-                            dialog_title="Wybierz plik do importu"
+                            dialog_title="Wybierz pliki do importu",
+                            allow_multiple=True
                         )
                     ),
                     self.import_status,
@@ -563,47 +730,141 @@ class OfertomatApp:
                 padding=20
             ),
         ], scroll=ft.ScrollMode.AUTO, expand=True)
-        self.page.update()
+        self.ui.request()
     
-    def on_file_picked(self, e: ft.FilePickerResultEvent):
-        """Obsługa wybranego pliku"""
+    async def on_file_picked(self, e: ft.FilePickerResultEvent):
+        """Obsługa wybranych plików"""
         if e.files:
-            file_path = e.files[0].path
-            self.import_status.value = f"Importowanie: {e.files[0].name}..."
-            self.page.update()
-            
             try:
                 category_id = int(self.import_category_dropdown.value) if self.import_category_dropdown.value else None
-                products = self.importer.import_from_file(file_path, category_id)
-                added, updated = self.db.import_products_batch(products)
-                
-                self.import_status.value = f"✓ Import zakończony! Dodano: {added}, Zaktualizowano: {updated}"
-                self.import_status.color = ft.Colors.GREEN_400
-                self.show_snackbar(f"Import zakończony! Dodano: {added}, Zaktualizowano: {updated}", ft.Colors.GREEN_400)
+                if len(e.files) == 1:
+                    await self.import_single_file(e.files[0], category_id)
+                else:
+                    await self.import_multiple_files(e.files, category_id)
             except Exception as ex:
                 self.import_status.value = f"✗ Błąd importu: {str(ex)}"
                 self.import_status.color = ft.Colors.RED_400
                 self.show_snackbar(f"Błąd importu: {str(ex)}", ft.Colors.RED_400)
             
-            self.page.update()
+            self.ui.request(self.import_status)
+    
+    async def import_single_file(self, file, category_id):
+        """Importuje jeden plik partiami (duże arkusze nie trafiają w całości do pamięci)"""
+        importer = await asyncio.to_thread(lambda: self.importer)
+        digest = await asyncio.to_thread(importer.file_digest, file.path)
+        if not self.import_force_checkbox.value and await self.adb.is_file_imported(digest, category_id):
+            self.import_status.value = f"Plik {file.name} nie zmienił się od ostatniego importu - pominięto"
+            self.import_status.color = ft.Colors.ORANGE_400
+            self.show_snackbar("Plik bez zmian - import pominięty", ft.Colors.ORANGE_400)
+            return
+        
+        self.import_status.value = f"Importowanie: {file.name}..."
+        self.ui.request(self.import_status)
+        
+        added = 0
+        updated = 0
+        unchanged = 0
+        with instrumentation.measure('Import.single_file') as measurement:
+            # Parsowanie kolejnych partii w wątku, zapis przez AsyncDatabase
+            batches = importer.iter_product_batches(file.path, category_id)
+            while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+                batch_added, batch_updated, batch_unchanged = await self.adb.import_products_batch(batch)
+                added += batch_added
+                updated += batch_updated
+                unchanged += batch_unchanged
+                self.import_status.value = f"Importowanie: {file.name}... ({added + updated + unchanged} wierszy)"
+                self.ui.request(self.import_status)
+            measurement.rows = added + updated + unchanged
+        
+        await self.adb.record_imported_file(digest, category_id, file.name, added + updated + unchanged)
+        
+        summary = f"Dodano: {added}, Zaktualizowano: {updated}, Bez zmian: {unchanged}"
+        self.import_status.value = f"✓ Import zakończony! {summary}"
+        self.import_status.color = ft.Colors.GREEN_400
+        self.show_snackbar(f"Import zakończony! {summary}", ft.Colors.GREEN_400)
+    
+    async def import_multiple_files(self, files, category_id):
+        """Importuje wiele plików: równoległe parsowanie i zapis w jednej transakcji"""
+        self.import_status.value = f"Importowanie {len(files)} plików..."
+        self.ui.request(self.import_status)
+        
+        start = time.perf_counter()
+        
+        # Pomiń pliki zaimportowane wcześniej bez zmian
+        importer = await asyncio.to_thread(lambda: self.importer)
+        digests = {f.path: await asyncio.to_thread(importer.file_digest, f.path) for f in files}
+        skipped = []
+        if not self.import_force_checkbox.value:
+            skipped = [f for f in files if await self.adb.is_file_imported(digests[f.path], category_id)]
+        to_import = [f for f in files if f not in skipped]
+        
+        result = await asyncio.to_thread(importer.import_from_files, [f.path for f in to_import], category_id)
+        added, updated, unchanged = await self.adb.import_products_batch(result['products'])
+        elapsed = time.perf_counter() - start
+        
+        for f in result['files']:
+            if not f['error']:
+                await self.adb.record_imported_file(digests[f['file']], category_id,
+                                                    os.path.basename(f['file']), f['rows'])
+        
+        total_rows = sum(f['rows'] for f in result['files'])
+        lines = []
+        for f in result['files']:
+            name = os.path.basename(f['file'])
+            if f['error']:
+                lines.append(f"✗ {name}: {f['error']}")
+            else:
+                lines.append(f"✓ {name}: {f['rows']} wierszy ({f['overridden']} nadpisanych przez inne pliki)")
+        for f in skipped:
+            lines.append(f"– {f.name}: bez zmian od ostatniego importu, pominięto")
+        lines.append(
+            f"Dodano: {added}, Zaktualizowano: {updated}, Bez zmian: {unchanged}, "
+            f"Konflikty kodów: {result['conflicts']} | "
+            f"{total_rows} wierszy w {elapsed:.1f} s ({total_rows / elapsed if elapsed > 0 else 0:.0f} wierszy/s)"
+        )
+        
+        failed = [f for f in result['files'] if f['error']]
+        self.import_status.value = "\n".join(lines)
+        self.import_status.color = ft.Colors.ORANGE_400 if failed else ft.Colors.GREEN_400
+        self.show_snackbar(
+            f"Import {len(to_import) - len(failed)}/{len(files)} plików zakończony! Dodano: {added}, Zaktualizowano: {updated}",
+            ft.Colors.ORANGE_400 if failed else ft.Colors.GREEN_400
+        )
     
     # === OFERTA ===
     
     def show_offer_view(self):
         """Widok tworzenia oferty"""
         self.offer_items = []
+        self.offer_history.clear()
         
-        categories = self.db.get_categories()
-        self.offer_category_checkboxes = []
-        
-        category_selection = ft.Column()
-        for cat in categories:
-            cb = ft.Checkbox(label=cat['name'], value=False, data=cat['id'])
-            self.offer_category_checkboxes.append(cb)
-            category_selection.controls.append(cb)
+        # Drzewo kategorii - zaznaczenie kategorii obejmuje jej podkategorie
+        self.offer_category_selector = CategoryTreeSelector(self.db.get_category_tree(), self.ui.request)
         
         self.offer_table_container = ft.Container()
+        self.offer_editor = None
         self.offer_title_field = ft.TextField(label="Tytuł oferty", value="Oferta handlowa", width=400)
+        # Klient - jego marże zastępują marże kategorii
+        self.offer_customer_dropdown = ft.Dropdown(
+            label="Klient",
+            width=400,
+            options=[ft.dropdown.Option(key="", text="Bez klienta")] + [
+                ft.dropdown.Option(key=str(customer['id']), text=customer['name'])
+                for customer in self.db.get_customers()
+            ],
+            value="",
+            on_change=self.change_offer_customer,
+        )
+        
+        # Dodawanie pojedynczych produktów z podpowiedziami
+        self.offer_search_field = ft.TextField(
+            label="Dodaj produkt (kod lub nazwa)",
+            prefix_icon="search",
+            width=400,
+            on_change=self.on_offer_search,
+            on_submit=self.add_first_suggestion,
+        )
+        self.offer_suggestions = ft.Column(spacing=0, width=600)
         
         self.content.content = ft.Column([
             ft.Container(
@@ -611,195 +872,214 @@ class OfertomatApp:
                     ft.Text("Kreator oferty", size=24, weight=ft.FontWeight.BOLD),
                     ft.Divider(),
                     self.offer_title_field,
+                    self.offer_customer_dropdown,
                     ft.Text("Wybierz kategorie do oferty:", weight=ft.FontWeight.BOLD),
-                    category_selection,
+                    self.offer_category_selector.control,
                     ft.FilledButton(
                         "Załaduj produkty z wybranych kategorii",
                         icon="add_shopping_cart",
                         on_click=self.load_offer_products
                     ),
+                    self.offer_search_field,
+                    self.offer_suggestions,
                     ft.Divider(),
                     self.offer_table_container,
                 ]),
                 padding=20
             ),
         ], scroll=ft.ScrollMode.AUTO, expand=True)
-        self.page.update()
+        self.ui.request()
     
-    def load_offer_products(self, e):
+    async def load_offer_products(self, e):
         """Ładuje produkty z wybranych kategorii do oferty"""
-        selected_categories = [cb.data for cb in self.offer_category_checkboxes if cb.value]
+        selected_categories = self.offer_category_selector.selected_ids()
         
         if not selected_categories:
             self.show_snackbar("Wybierz przynajmniej jedną kategorię!", ft.Colors.ORANGE_400)
             return
         
         self.offer_items = []
-        for cat_id in selected_categories:
-            products = self.db.get_products(cat_id)
-            for prod in products:
-                # Debug: wypisz unit dla pierwszego produktu
-                if len(self.offer_items) == 0:
-                    print(f"DEBUG: Product unit = '{prod.get('unit')}' for product: {prod['name']}")
-                
-                self.offer_items.append({
-                    'product_id': prod['id'],
-                    'name': prod['name'],
-                    'unit': prod.get('unit') or 'szt.',  # Obsługa NULL
-                    'quantity': 1.0,
-                    'purchase_price_net': prod['purchase_price_net'],
-                    'vat_rate': prod['vat_rate'],
-                    'margin': prod.get('default_margin', 30.0),
-                    'category_name': prod.get('category_name', 'Brak')
-                })
+        self.offer_history.clear()
+        # Całe gałęzie jednym zapytaniem (marże dziedziczone po kategoriach nadrzędnych)
+        products = await self.adb.get_products_in_subtrees(selected_categories, self.offer_customer_id())
+        for prod in products:
+            self.offer_items.append(self.offer_item(prod))
         
         self.refresh_offer_table()
     
-    def refresh_offer_table(self):
-        """Odświeża tabelę oferty"""
-        rows = []
-        for i, item in enumerate(self.offer_items):
-            # Kalkulacja cen
-            net_price = item['purchase_price_net'] * (1 + item['margin'] / 100)
-            gross_price = net_price * (1 + item['vat_rate'] / 100)
-            
-            # Pole edycji nazwy
-            name_field = ft.TextField(
-                value=item['name'],
-                multiline=True,
-                min_lines=1,
-                max_lines=3,
-                data=i,
-                on_blur=lambda e: self.update_item_name(e.control.data, e.control.value)
-            )
-            
-            # Pole edycji J.M.
-            unit_value = item.get('unit', 'szt.')
-            if not unit_value:  # Jeśli None lub pusty string
-                unit_value = 'szt.'
-            
-            print(f"DEBUG refresh_offer_table: Creating unit field for row {i}, value='{unit_value}'")
-            
-            unit_field = ft.TextField(
-                value=unit_value,
-                width=120,  # Zwiększona szerokość
-                data=i,
-                on_blur=lambda e: self.update_item_unit(e.control.data, e.control.value)
-            )
-            
-            print(f"DEBUG: unit_field.value = '{unit_field.value}'")
-            
-            # Pole edycji marży
-            margin_field = ft.TextField(
-                value=str(item['margin']),
-                width=100,
-                keyboard_type=ft.KeyboardType.NUMBER,
-                data=i,
-                on_blur=lambda e: self.update_margin(e.control.data, e.control.value)
-            )
-            
-            # Pole edycji ceny netto
-            net_field = ft.TextField(
-                value=f"{net_price:.2f}",
-                width=100,
-                keyboard_type=ft.KeyboardType.NUMBER,
-                data=i,
-                on_blur=lambda e: self.update_net_price(e.control.data, e.control.value)
-            )
-            
-            # Pole edycji ceny brutto
-            gross_field = ft.TextField(
-                value=f"{gross_price:.2f}",
-                width=100,
-                keyboard_type=ft.KeyboardType.NUMBER,
-                data=i,
-                on_blur=lambda e: self.update_gross_price(e.control.data, e.control.value)
+    @staticmethod
+    def offer_item(prod):
+        """Pozycja oferty z produktu z bazy"""
+        # Produkt bez kategorii - marża i kategoria z bazy to NULL
+        margin = prod.get('default_margin')
+        return {
+            'product_id': prod['id'],
+            'name': prod['name'],
+            'unit': prod.get('unit') or 'szt.',  # Obsługa NULL
+            'quantity': 1.0,
+            'purchase_price_net': prod['purchase_price_net'],
+            'vat_rate': prod['vat_rate'],
+            'margin': 30.0 if margin is None else margin,
+            'category_name': prod.get('category_name') or 'Brak'
+        }
+    
+    def on_offer_search(self, e):
+        """Podpowiedzi produktów dla wpisanego kodu lub początku słów nazwy"""
+        matches = self.product_index.search(e.control.value or '')
+        self.offer_suggestions.controls = [
+            ft.ListTile(
+                title=ft.Text(product['name']),
+                subtitle=ft.Text(product['code']),
+                dense=True,
+                data=product['id'],
+                on_click=self.add_suggested_product,
             )
-            
-            rows.append(
-                ft.DataRow(
-                    cells=[
-                        ft.DataCell(ft.Text(item['category_name'])),
-                        ft.DataCell(
-                            ft.Container(
-                                content=name_field,
-                                width=350
-                            )
-                        ),
-                        ft.DataCell(ft.Text(f"{item['purchase_price_net']:.2f} zł")),
-                        ft.DataCell(
-                            ft.Container(
-                                content=unit_field,
-                                width=120
-                            )
-                        ),
-                        ft.DataCell(margin_field),
-                        ft.DataCell(ft.Text(f"{item['vat_rate']:.0f}%")),
-                        ft.DataCell(net_field),
-                        ft.DataCell(gross_field),
-                        ft.DataCell(
-                            ft.IconButton(
-                                icon="delete",
-                                icon_color=ft.Colors.RED_400,
-                                tooltip="Usuń",
-                                data=i,
-                                on_click=lambda e: self.remove_offer_item(e.control.data)
-                            )
-                        ),
-                    ]
-                )
+            for product in matches
+        ]
+        self.ui.request(self.offer_suggestions)
+    
+    async def add_first_suggestion(self, e):
+        """Enter w polu wyszukiwania dodaje pierwszą podpowiedź"""
+        if self.offer_suggestions.controls:
+            await self.add_offer_product(self.offer_suggestions.controls[0].data)
+    
+    async def add_suggested_product(self, e):
+        await self.add_offer_product(e.control.data)
+    
+    async def add_offer_product(self, product_id):
+        """Dodaje produkt na koniec oferty (krok historii jak edycja)"""
+        prod = await self.adb.get_product_by_id(product_id, self.offer_customer_id())
+        if prod is None:
+            self.show_snackbar("Produkt nie istnieje!", ft.Colors.RED_400)
+            return
+        item = self.offer_item(prod)
+        self.offer_items.append(item)
+        self.offer_history.record_insertion(len(self.offer_items) - 1, item)
+        
+        self.offer_search_field.value = ""
+        self.offer_suggestions.controls = []
+        self.ui.request(self.offer_search_field, self.offer_suggestions)
+        if self.offer_editor is None or len(self.offer_items) == 1:
+            # Pierwsza pozycja - pełny układ tabeli (z przyciskiem generowania)
+            self.refresh_offer_table()
+        else:
+            self.offer_totals.add(item)
+            self.offer_editor.refresh()
+            self.refresh_offer_totals()
+        self.show_snackbar(f"Dodano: {item['name']}", ft.Colors.GREEN_400)
+    
+    def refresh_offer_table(self):
+        """Odświeża tabelę oferty (tworzone są tylko widoczne wiersze)"""
+        if self.offer_editor is None:
+            self.offer_editor = OfferEditor(
+                self.offer_items,
+                handlers={
+                    'name': self.update_item_name,
+                    'unit': self.update_item_unit,
+                    'margin': self.update_margin,
+                    'net': self.update_net_price,
+                    'gross': self.update_gross_price,
+                },
+                on_remove=self.remove_offer_item,
+                request_update=self.ui.request,
             )
+        else:
+            self.offer_editor.set_items(self.offer_items)
+        self.offer_totals.reset(self.offer_items)
+        self.offer_totals_text = ft.Text(weight=ft.FontWeight.BOLD)
+        self.offer_vat_text = ft.Text(color=ft.Colors.GREY_700)
+        self.offer_undo_button = ft.IconButton(icon="undo", tooltip="Cofnij (Ctrl+Z)",
+                                               on_click=lambda e: self.undo_offer_change())
+        self.offer_redo_button = ft.IconButton(icon="redo", tooltip="Ponów (Ctrl+Y)",
+                                               on_click=lambda e: self.redo_offer_change())
+        self.refresh_offer_totals(update=False)
         
-        table = ft.DataTable(
-            columns=[
-                ft.DataColumn(ft.Text("Kategoria")),
-                ft.DataColumn(ft.Text("Produkt")),
-                ft.DataColumn(ft.Text("Cena zakupu")),
-                ft.DataColumn(ft.Text("J.M.")),
-                ft.DataColumn(ft.Text("Marża %"), numeric=True),
-                ft.DataColumn(ft.Text("VAT"), numeric=True),
-                ft.DataColumn(ft.Text("Cena netto jedn."), numeric=True),
-                ft.DataColumn(ft.Text("Cena brutto jedn."), numeric=True),
-                ft.DataColumn(ft.Text("Akcje")),
-            ],
-            rows=rows,
-            column_spacing=20,
-            horizontal_margin=10,
-            heading_row_height=50,
-            data_row_max_height=80,
+        # Operacje zbiorcze na marżach
+        categories = sorted({item.get('category_name') or 'Brak' for item in self.offer_items})
+        self.bulk_category_dropdown = ft.Dropdown(
+            label="Kategoria",
+            width=250,
+            options=[ft.dropdown.Option(name) for name in categories],
+            value=categories[0] if categories else None,
         )
+        self.bulk_value_field = ft.TextField(label="Wartość (%)", width=120, keyboard_type=ft.KeyboardType.NUMBER)
         
         self.offer_table_container.content = ft.Column([
+            ft.Row([
+                ft.Text("Kliknij ikonę edycji, aby zmienić wiersz", color=ft.Colors.GREY_700),
+                self.offer_undo_button,
+                self.offer_redo_button,
+            ]),
+            ft.Row([
+                self.bulk_category_dropdown,
+                self.bulk_value_field,
+                ft.OutlinedButton("Ustaw marżę kategorii", icon="category",
+                                  on_click=self.bulk_set_category_margin),
+                ft.OutlinedButton("Zmień ceny zaznaczonych o %", icon="percent",
+                                  on_click=self.bulk_change_prices),
+                ft.OutlinedButton("Końcówki ,99 (zaznaczone lub wszystkie)", icon="price_change",
+                                  on_click=self.bulk_round_99),
+                ft.OutlinedButton("Zapisz marże w cenniku klienta", icon="person",
+                                  on_click=self.save_customer_margins),
+            ], wrap=True),
             ft.Container(
-                content=ft.Row([table], scroll=ft.ScrollMode.AUTO),
+                content=self.offer_editor.control,
                 padding=10,
             ),
+            self.offer_totals_text,
+            self.offer_vat_text,
             ft.Divider(),
             ft.FilledButton(
                 "Generuj PDF",
                 icon="picture_as_pdf",
                 on_click=self.generate_offer_pdf
             ) if len(self.offer_items) > 0 else ft.Container(),
-        ], scroll=ft.ScrollMode.AUTO)
-        self.page.update()
+        ])
+        self.ui.request(self.offer_table_container)
+    
+    def refresh_offer_totals(self, update=True):
+        """Pokazuje bieżące sumy oferty (bez przeliczania pozycji) i stan cofnij/ponów"""
+        totals = self.offer_totals.snapshot()
+        self.offer_totals_text.value = (f"Pozycji: {totals['items']} | Razem netto: {totals['net']:.2f} zł | VAT: {totals['vat']:.2f} zł | "
+                                        f"brutto: {totals['gross']:.2f} zł")
+        self.offer_vat_text.value = "   ".join(
+            f"VAT {group['vat_rate']:.0f}%: netto {group['net']:.2f} zł, VAT {group['vat']:.2f} zł, "
+            f"brutto {group['gross']:.2f} zł" for group in totals['by_vat'])
+        self.offer_undo_button.disabled = not self.offer_history.can_undo
+        self.offer_redo_button.disabled = not self.offer_history.can_redo
+        if update:
+            self.ui.request(self.offer_totals_text, self.offer_vat_text,
+                            self.offer_undo_button, self.offer_redo_button)
     
     def update_item_name(self, index, value):
         """Aktualizuje nazwę produktu w ofercie"""
         if value and value.strip():
+            self.offer_history.record(index, 'name', self.offer_items[index]['name'], value.strip())
             self.offer_items[index]['name'] = value.strip()
+            self.refresh_offer_totals()
     
     def update_item_unit(self, index, value):
         """Aktualizuje jednostkę miary w ofercie"""
         if value and value.strip():
+            self.offer_history.record(index, 'unit', self.offer_items[index].get('unit'), value.strip())
             self.offer_items[index]['unit'] = value.strip()
+            self.refresh_offer_totals()
+    
+    def set_item_margin(self, index, margin):
+        """Zmienia marżę pozycji: historia, sumy i wiersz edytora"""
+        item = self.offer_items[index]
+        self.offer_history.record(index, 'margin', item['margin'], margin)
+        item['margin'] = margin
+        self.offer_totals.update(item)
+        self.offer_editor.refresh_row(index)
+        self.refresh_offer_totals()
     
     def update_margin(self, index, value):
         """Aktualizuje marżę w ofercie"""
         try:
             # Zamień przecinek na kropkę dla poprawnego parsowania
             margin = float(value.replace(',', '.'))
-            self.offer_items[index]['margin'] = margin
-            self.refresh_offer_table()
+            self.set_item_margin(index, margin)
         except ValueError:
             self.show_snackbar("Nieprawidłowa wartość marży!", ft.Colors.RED_400)
     
@@ -813,8 +1093,7 @@ class OfertomatApp:
             # Przelicz marżę na podstawie nowej ceny netto
             if item['purchase_price_net'] > 0:
                 new_margin = ((net_price / item['purchase_price_net']) - 1) * 100
-                item['margin'] = round(new_margin, 2)
-                self.refresh_offer_table()
+                self.set_item_margin(index, round(new_margin, 2))
             else:
                 self.show_snackbar("Cena zakupu nie może być zero!", ft.Colors.RED_400)
         except ValueError:
@@ -833,8 +1112,7 @@ class OfertomatApp:
             # Przelicz marżę na podstawie nowej ceny netto
             if item['purchase_price_net'] > 0:
                 new_margin = ((net_price / item['purchase_price_net']) - 1) * 100
-                item['margin'] = round(new_margin, 2)
-                self.refresh_offer_table()
+                self.set_item_margin(index, round(new_margin, 2))
             else:
                 self.show_snackbar("Cena zakupu nie może być zero!", ft.Colors.RED_400)
         except ValueError:
@@ -842,8 +1120,147 @@ class OfertomatApp:
     
     def remove_offer_item(self, index):
         """Usuwa pozycję z oferty"""
-        self.offer_items.pop(index)
-        self.refresh_offer_table()
+        self.offer_history.record_removal(index, self.offer_items[index])
+        self.offer_totals.remove(self.offer_items[index])
+        self.offer_editor.remove(index)
+        if not self.offer_items:
+            self.refresh_offer_table()
+        else:
+            self.refresh_offer_totals()
+    
+    # === MARŻE KLIENTA ===
+    
+    def offer_customer_id(self):
+        """ID klienta wybranego w ofercie (None - bez klienta)"""
+        value = self.offer_customer_dropdown.value
+        return int(value) if value else None
+    
+    async def offer_customer_margins(self):
+        """Marże klienta dla produktów z oferty - jednym zapytaniem"""
+        product_ids = list({item['product_id'] for item in self.offer_items if item.get('product_id')})
+        return await self.adb.resolve_customer_margins(self.offer_customer_id(), product_ids)
+    
+    async def change_offer_customer(self, e):
+        """Po zmianie klienta pozycje oferty dostają jego marże (jeden krok historii)"""
+        if not self.offer_items:
+            return
+        margins = await self.offer_customer_margins()
+        changes = [(index, margins[item['product_id']]) for index, item in enumerate(self.offer_items)
+                   if margins.get(item.get('product_id')) is not None
+                   and abs(margins[item['product_id']] - item['margin']) > 1e-9]
+        self.apply_bulk_margins(changes)
+    
+    async def save_customer_margins(self, e):
+        """Zapisuje marże pozycji różne od bieżących marż klienta jako jego marże produktów"""
+        customer_id = self.offer_customer_id()
+        if customer_id is None:
+            self.show_snackbar("Wybierz klienta!", ft.Colors.ORANGE_400)
+            return
+        margins = await self.offer_customer_margins()
+        changed = {item['product_id']: item['margin'] for item in self.offer_items
+                   if item.get('product_id') in margins and margins[item['product_id']] is not None
+                   and abs(margins[item['product_id']] - item['margin']) > 1e-9}
+        if not changed:
+            self.show_snackbar("Brak zmian", ft.Colors.ORANGE_400)
+            return
+        saved = await self.adb.set_customer_product_margins(customer_id, changed)
+        self.show_snackbar(f"Zapisano {saved} marż w cenniku klienta", ft.Colors.GREEN_400)
+    
+    # === OPERACJE ZBIORCZE ===
+    
+    def bulk_value(self):
+        """Wartość procentowa z pola operacji zbiorczych (None gdy nieprawidłowa)"""
+        try:
+            return float((self.bulk_value_field.value or '').replace(',', '.'))
+        except ValueError:
+            self.show_snackbar("Podaj wartość w procentach!", ft.Colors.RED_400)
+            return None
+    
+    def bulk_set_category_margin(self, e):
+        """Ustawia marżę wszystkim pozycjom wybranej kategorii"""
+        margin = self.bulk_value()
+        if margin is None or not self.bulk_category_dropdown.value:
+            return
+        indices = offer_bulk.category_indices(self.offer_items, self.bulk_category_dropdown.value)
+        self.apply_bulk_margins(offer_bulk.set_margin(self.offer_items, indices, margin))
+    
+    def bulk_change_prices(self, e):
+        """Zmienia ceny zaznaczonych pozycji o podany procent"""
+        percent = self.bulk_value()
+        if percent is None:
+            return
+        indices = self.offer_editor.selected_indices()
+        if not indices:
+            self.show_snackbar("Zaznacz pozycje do zmiany!", ft.Colors.ORANGE_400)
+            return
+        try:
+            self.apply_bulk_margins(offer_bulk.change_prices(self.offer_items, indices, percent))
+        except ValueError as ex:
+            self.show_snackbar(str(ex), ft.Colors.RED_400)
+    
+    def bulk_round_99(self, e):
+        """Zaokrągla ceny brutto do końcówki ,99 (zaznaczone pozycje, a bez zaznaczenia - wszystkie)"""
+        indices = self.offer_editor.selected_indices() or range(len(self.offer_items))
+        self.apply_bulk_margins(offer_bulk.round_gross_to_99(self.offer_items, indices))
+    
+    def apply_bulk_margins(self, changes):
+        """Zapisuje nowe marże jako jeden krok historii i odświeża tabelę raz"""
+        if not changes:
+            self.show_snackbar("Brak zmian", ft.Colors.ORANGE_400)
+            return
+        with self.offer_history.group():
+            for index, margin in changes:
+                item = self.offer_items[index]
+                self.offer_history.record(index, 'margin', item['margin'], margin)
+                item['margin'] = margin
+                self.offer_totals.update(item)
+        self.offer_editor.refresh()
+        self.refresh_offer_totals()
+        self.show_snackbar(f"Zmieniono marżę {len(changes)} pozycji", ft.Colors.GREEN_400)
+    
+    def undo_offer_change(self):
+        """Cofa ostatnią zmianę pozycji oferty"""
+        self.apply_offer_changes(self.offer_history.undo(self.offer_items))
+    
+    def redo_offer_change(self):
+        """Ponawia ostatnią cofniętą zmianę pozycji oferty"""
+        self.apply_offer_changes(self.offer_history.redo(self.offer_items))
+    
+    def apply_offer_changes(self, changes):
+        """Odświeża sumy i edytor po cofnięciu lub ponowieniu zmian"""
+        if not changes or self.offer_editor is None:
+            return
+        structural = False
+        for kind, index, item in changes:
+            if kind == 'update':
+                self.offer_totals.update(item)
+            elif kind == 'insert':
+                self.offer_totals.add(item)
+                structural = True
+            else:
+                self.offer_totals.remove(item)
+                structural = True
+        
+        if structural and len(self.offer_items) <= 1:
+            # Pusta oferta ma inny układ widoku (bez przycisku generowania)
+            self.refresh_offer_table()
+            return
+        if structural:
+            self.offer_editor.refresh()
+        else:
+            for index in {index for _, index, _ in changes}:
+                self.offer_editor.refresh_row(index)
+        self.refresh_offer_totals()
+    
+    def on_keyboard(self, e: ft.KeyboardEvent):
+        """Skróty w widoku oferty: Ctrl+Z cofnij, Ctrl+Y lub Ctrl+Shift+Z ponów"""
+        if self.rail.selected_index != 3 or self.offer_editor is None or not (e.ctrl or e.meta):
+            return
+        key = e.key.upper()
+        if key == 'Z' and not e.shift:
+            self.undo_offer_change()
+        elif key == 'Y' or key == 'Z':
+            self.redo_offer_change()
     
     def generate_offer_pdf(self, e):
         """Generuje PDF i DOCX z oferty"""
@@ -856,7 +1273,9 @@ class OfertomatApp:
             'title': self.offer_title_field.value,
             'date': datetime.now().strftime('%d.%m.%Y'),
             'items': self.offer_items,
-            'business_card': self.db.get_business_card()
+            'business_card': self.db.get_business_card(),
+            # Sumy utrzymywane przez edytor - generatory ich nie przeliczają
+            'totals': self.offer_totals.snapshot(),
         }
         
         # Generuj nazwę pliku
@@ -864,13 +1283,16 @@ class OfertomatApp:
         pdf_path = f"Oferta_{timestamp}.pdf"
         docx_path = f"Oferta_{timestamp}.docx"
         
-        # Generuj oba formaty
-        pdf_success = self.pdf_gen.generate_offer_pdf(offer_data, pdf_path)
-        docx_success = self.docx_gen.generate_offer_docx(offer_data, docx_path)
+        # Generuj oba formaty (niezmieniona oferta pochodzi z pamięci podręcznej)
+        hits_before = self.render_cache.hits
+        written = self.write_offer_files(offer_data, {'pdf': pdf_path, 'docx': docx_path})
+        pdf_success, docx_success = written['pdf'], written['docx']
+        cached = self.render_cache.hits - hits_before
         
         if pdf_success and docx_success:
             abs_path = os.path.abspath(pdf_path)
-            self.show_snackbar(f"Oferta wygenerowana: PDF i DOCX", ft.Colors.GREEN_400)
+            suffix = " (bez zmian - z pamięci podręcznej)" if cached == 2 else ""
+            self.show_snackbar(f"Oferta wygenerowana: PDF i DOCX{suffix}", ft.Colors.GREEN_400)
             
             # Otwórz folder z plikiem
             os.startfile(os.path.dirname(abs_path))
@@ -881,6 +1303,188 @@ class OfertomatApp:
         else:
             self.show_snackbar("Błąd generowania oferty!", ft.Colors.RED_400)
     
+    def write_offer_files(self, offer_data, paths):
+        """Zapisuje ofertę w formatach {format: ścieżka} - z pamięci podręcznej lub nowo wygenerowaną"""
+        contents = {}
+        buffers = {}
+        for fmt in paths:
+            key = self.render_cache.offer_key(offer_data, fmt)
+            contents[fmt] = self.render_cache.get(key)
+            if contents[fmt] is None:
+                buffers[fmt] = io.BytesIO()
+        if buffers:
+            # Brakujące formaty z jednego modelu układu, renderowane równolegle
+            results = render_offer_formats(offer_data, buffers,
+                                           generators={'pdf': self.pdf_gen, 'docx': self.docx_gen})
+            for fmt, buffer in buffers.items():
+                if 'error' not in results[fmt]:
+                    contents[fmt] = buffer.getvalue()
+                    self.render_cache.put(self.render_cache.offer_key(offer_data, fmt), contents[fmt])
+        
+        written = {}
+        for fmt, output_path in paths.items():
+            written[fmt] = False
+            if contents[fmt] is None:
+                continue
+            try:
+                with open(output_path, 'wb') as f:
+                    f.write(contents[fmt])
+                written[fmt] = True
+            except OSError as e:
+                print(f"Błąd zapisu oferty ({fmt.upper()}): {e}")
+        return written
+    
+    # === KLIENCI ===
+    
+    def show_customers_view(self):
+        """Widok klientów i ich marż (nadpisują marże kategorii w ofercie)"""
+        customers = self.db.get_customers()
+        
+        rows = []
+        for customer in customers:
+            rows.append(
+                ft.DataRow(
+                    cells=[
+                        ft.DataCell(ft.Text(customer['name'])),
+                        ft.DataCell(ft.Text(str(customer['category_margins']))),
+                        ft.DataCell(ft.Text(str(customer['product_margins']))),
+                        ft.DataCell(
+                            ft.Row([
+                                ft.IconButton(
+                                    icon="tune",
+                                    tooltip="Marże klienta",
+                                    data=customer,
+                                    on_click=lambda e: self.show_customer_margins(e.control.data)
+                                ),
+                                ft.IconButton(
+                                    icon="delete",
+                                    tooltip="Usuń",
+                                    icon_color=ft.Colors.RED_400,
+                                    data=customer,
+                                    on_click=lambda e: self.delete_customer(e.control.data)
+                                ),
+                            ])
+                        ),
+                    ]
+                )
+            )
+        
+        table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Klient")),
+                ft.DataColumn(ft.Text("Marże kategorii"), numeric=True),
+                ft.DataColumn(ft.Text("Marże produktów"), numeric=True),
+                ft.DataColumn(ft.Text("Akcje")),
+            ],
+            rows=rows,
+        )
+        
+        name_field = ft.TextField(label="Nazwa klienta", width=400)
+        
+        def add_customer(e):
+            if not (name_field.value or '').strip():
+                return
+            if self.db.add_customer(name_field.value.strip()):
+                self.show_customers_view()
+                self.show_snackbar(f"Klient '{name_field.value.strip()}' dodany!", ft.Colors.GREEN_400)
+            else:
+                self.show_snackbar("Klient o tej nazwie już istnieje!", ft.Colors.RED_400)
+        
+        self.customer_margins_container = ft.Container()
+        self.content.content = ft.Column([
+            ft.Container(
+                content=ft.Column([
+                    ft.Text("Klienci", size=24, weight=ft.FontWeight.BOLD),
+                    ft.Text("Marże klienta zastępują marże kategorii przy tworzeniu oferty dla klienta",
+                            color=ft.Colors.GREY_700),
+                    ft.Row([
+                        name_field,
+                        ft.FilledButton("Dodaj klienta", icon="person_add", on_click=add_customer),
+                    ]),
+                ]),
+                padding=20
+            ),
+            ft.Container(
+                content=table,
+                padding=20
+            ),
+            self.customer_margins_container,
+        ], scroll=ft.ScrollMode.AUTO, expand=True)
+        self.ui.request()
+    
+    def show_customer_margins(self, customer):
+        """Marże klienta dla kategorii (z podkategoriami) i pojedynczych produktów"""
+        margins = self.db.get_customer_margins(customer['id'])
+        
+        category_dropdown = ft.Dropdown(
+            label="Kategoria",
+            width=350,
+            options=[ft.dropdown.Option(key=str(cat['id']), text="    " * cat['depth'] + cat['name'])
+                     for cat in self.db.get_category_tree()],
+        )
+        margin_field = ft.TextField(label="Marża (%)", width=120, keyboard_type=ft.KeyboardType.NUMBER)
+        
+        def set_category_margin(e):
+            if not category_dropdown.value:
+                return
+            try:
+                margin = float((margin_field.value or '').replace(',', '.'))
+            except ValueError:
+                self.show_snackbar("Nieprawidłowa wartość marży!", ft.Colors.RED_400)
+                return
+            self.db.set_customer_category_margin(customer['id'], int(category_dropdown.value), margin)
+            self.show_customer_margins(customer)
+        
+        def remove_category_margin(category_id):
+            self.db.set_customer_category_margin(customer['id'], category_id, None)
+            self.show_customer_margins(customer)
+        
+        def remove_product_margin(product_id):
+            self.db.set_customer_product_margins(customer['id'], {product_id: None})
+            self.show_customer_margins(customer)
+        
+        category_rows = [
+            ft.Row([
+                ft.Text(f"{override['category_name']}: {override['margin']:g}%", width=400),
+                ft.IconButton(icon="close", tooltip="Usuń marżę", data=override['category_id'],
+                              on_click=lambda e: remove_category_margin(e.control.data)),
+            ])
+            for override in margins['categories']
+        ]
+        # Produktów może być wiele - pokazywane pierwsze CUSTOMER_PRODUCTS_SHOWN
+        product_rows = [
+            ft.Row([
+                ft.Text(f"{override['code']} - {override['name']}: {override['margin']:g}%", width=600),
+                ft.IconButton(icon="close", tooltip="Usuń marżę", data=override['product_id'],
+                              on_click=lambda e: remove_product_margin(e.control.data)),
+            ])
+            for override in margins['products'][:CUSTOMER_PRODUCTS_SHOWN]
+        ]
+        
+        self.customer_margins_container.content = ft.Container(
+            content=ft.Column([
+                ft.Text(f"Marże klienta: {customer['name']}", size=20, weight=ft.FontWeight.BOLD),
+                ft.Row([
+                    category_dropdown,
+                    margin_field,
+                    ft.OutlinedButton("Ustaw marżę kategorii", icon="category", on_click=set_category_margin),
+                ]),
+                ft.Text("Kategorie (obejmują podkategorie):", weight=ft.FontWeight.BOLD),
+                *(category_rows or [ft.Text("Brak", color=ft.Colors.GREY_700)]),
+                ft.Text(f"Produkty ({len(margins['products'])}) - zapisywane z edytora oferty:",
+                        weight=ft.FontWeight.BOLD),
+                *(product_rows or [ft.Text("Brak", color=ft.Colors.GREY_700)]),
+            ]),
+            padding=20
+        )
+        self.ui.request(self.customer_margins_container)
+    
+    def delete_customer(self, customer):
+        """Usuwa klienta razem z jego marżami"""
+        self.db.delete_customer(customer['id'])
+        self.show_customers_view()
+        self.show_snackbar(f"Klient '{customer['name']}' usunięty!", ft.Colors.GREEN_400)
+    
     # === WIZYTÓWKA ===
     
     def show_business_card_view(self):
@@ -945,7 +1549,185 @@ class OfertomatApp:
             ),
         ], scroll=ft.ScrollMode.AUTO)
         
-        self.page.update()
+        self.ui.request()
+    
+    # === DIAGNOSTYKA ===
+    
+    def show_diagnostics_view(self):
+        """Widok pomiarów wydajności (instrumentacja i profilowanie)"""
+        self.diagnostics_table_container = ft.Container()
+        self.diagnostics_sql_container = ft.Container()
+        self.diagnostics_profile_text = ft.Text(selectable=True, font_family="monospace", size=11)
+        
+        def toggle_instrumentation(e):
+            if e.control.value:
+                instrumentation.enable()
+            else:
+                instrumentation.disable()
+        
+        def toggle_sql_trace(e):
+            if e.control.value:
+                self.db.enable_sql_trace()
+            else:
+                self.db.disable_sql_trace()
+            self.refresh_diagnostics_table()
+        
+        def reset_stats(e):
+            instrumentation.reset()
+            if self.db.sql_tracer:
+                self.db.sql_tracer.reset()
+            self.refresh_diagnostics_table()
+        
+        def export_stats(e, fmt):
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            path = f"Diagnostyka_{timestamp}.{fmt}"
+            if fmt == 'json':
+                instrumentation.dump_json(path)
+            else:
+                instrumentation.dump_csv(path)
+            self.show_snackbar(f"Zapisano raport: {os.path.abspath(path)}", ft.Colors.GREEN_400)
+        
+        def toggle_profiling(e):
+            if instrumentation.is_profiling():
+                path = f"Profil_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof"
+                report = instrumentation.stop_profiling(path)
+                if report:
+                    self.diagnostics_profile_text.value = report
+                    self.show_snackbar(f"Zapisano profil: {os.path.abspath(path)}", ft.Colors.GREEN_400)
+                else:
+                    self.diagnostics_profile_text.value = "Brak zarejestrowanych operacji"
+                e.control.text = "Start profilowania"
+            else:
+                instrumentation.start_profiling()
+                self.diagnostics_profile_text.value = "Profilowanie w toku - wykonaj operacje i zatrzymaj"
+                e.control.text = "Stop profilowania"
+            self.ui.request(self.diagnostics_profile_text, e.control)
+        
+        self.refresh_diagnostics_table(update=False)
+        
+        self.content.content = ft.Column([
+            ft.Container(
+                content=ft.Column([
+                    ft.Text("Diagnostyka wydajności", size=24, weight=ft.FontWeight.BOLD),
+                    ft.Text("Czas, liczba wywołań, wiersze i bajty dla operacji bazy, importu i generatorów",
+                            color=ft.Colors.GREY_700),
+                    ft.Switch(
+                        label="Rejestruj pomiary",
+                        value=instrumentation.is_enabled(),
+                        on_change=toggle_instrumentation
+                    ),
+                    ft.Switch(
+                        label="Śledź zapytania SQL (wolne zapytania trafiają do logu z planem wykonania)",
+                        value=self.db.sql_tracer is not None,
+                        on_change=toggle_sql_trace
+                    ),
+                    ft.Row([
+                        ft.OutlinedButton("Odśwież", icon="refresh",
+                                          on_click=lambda e: self.refresh_diagnostics_table()),
+                        ft.OutlinedButton("Wyczyść", icon="delete_sweep", on_click=reset_stats),
+                        ft.OutlinedButton("Zapisz JSON", icon="save",
+                                          on_click=lambda e: export_stats(e, 'json')),
+                        ft.OutlinedButton("Zapisz CSV", icon="save",
+                                          on_click=lambda e: export_stats(e, 'csv')),
+                        ft.FilledButton(
+                            "Stop profilowania" if instrumentation.is_profiling() else "Start profilowania",
+                            icon="speed",
+                            on_click=toggle_profiling
+                        ),
+                    ], wrap=True),
+                    ft.Divider(),
+                    self.diagnostics_table_container,
+                    ft.Divider(),
+                    self.diagnostics_sql_container,
+                    ft.Divider(),
+                    self.diagnostics_profile_text,
+                ]),
+                padding=20
+            ),
+        ], scroll=ft.ScrollMode.AUTO, expand=True)
+        self.ui.request()
+    
+    def refresh_diagnostics_table(self, update=True):
+        """Odświeża tabelę pomiarów"""
+        rows = []
+        for stats in instrumentation.summary():
+            rows.append(
+                ft.DataRow(
+                    cells=[
+                        ft.DataCell(ft.Text(stats['name'])),
+                        ft.DataCell(ft.Text(str(stats['calls']))),
+                        ft.DataCell(ft.Text(str(stats['errors']))),
+                        ft.DataCell(ft.Text(f"{stats['total_ms']:.1f}")),
+                        ft.DataCell(ft.Text(f"{stats['mean_ms']:.2f}")),
+                        ft.DataCell(ft.Text(f"{stats['max_ms']:.1f}")),
+                        ft.DataCell(ft.Text(str(stats['rows']))),
+                        ft.DataCell(ft.Text(f"{stats['bytes'] / 1024:.1f}")),
+                    ]
+                )
+            )
+        
+        self.diagnostics_table_container.content = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Operacja")),
+                ft.DataColumn(ft.Text("Wywołania"), numeric=True),
+                ft.DataColumn(ft.Text("Błędy"), numeric=True),
+                ft.DataColumn(ft.Text("Łącznie [ms]"), numeric=True),
+                ft.DataColumn(ft.Text("Średnio [ms]"), numeric=True),
+                ft.DataColumn(ft.Text("Maks. [ms]"), numeric=True),
+                ft.DataColumn(ft.Text("Wiersze"), numeric=True),
+                ft.DataColumn(ft.Text("Zapisano [KB]"), numeric=True),
+            ],
+            rows=rows,
+        ) if rows else ft.Text("Brak pomiarów - włącz rejestrowanie i wykonaj operacje",
+                               color=ft.Colors.GREY_700)
+        
+        self.diagnostics_sql_container.content = self.build_sql_trace_table()
+        if update:
+            self.ui.request(self.diagnostics_table_container, self.diagnostics_sql_container)
+    
+    def build_sql_trace_table(self):
+        """Tabela najdroższych kształtów zapytań SQL i ostatnich wolnych zapytań"""
+        tracer = self.db.sql_tracer
+        if tracer is None:
+            return ft.Text("Śledzenie zapytań SQL wyłączone", color=ft.Colors.GREY_700)
+        
+        rows = []
+        for stats in tracer.summary()[:20]:
+            rows.append(
+                ft.DataRow(
+                    cells=[
+                        ft.DataCell(ft.Text(stats['sql'][:120], size=11, tooltip=stats['sql'])),
+                        ft.DataCell(ft.Text(str(stats['calls']))),
+                        ft.DataCell(ft.Text(f"{stats['total_ms']:.1f}")),
+                        ft.DataCell(ft.Text(f"{stats['mean_ms']:.2f}")),
+                        ft.DataCell(ft.Text(f"{stats['max_ms']:.1f}")),
+                        ft.DataCell(ft.Text(str(stats['rows']))),
+                    ]
+                )
+            )
+        
+        slow = [
+            ft.Text(f"{q['ms']:.1f} ms, {q['rows']} wierszy: {q['sql'][:120]}\n    {' | '.join(q['plan'])}",
+                    selectable=True, font_family="monospace", size=11)
+            for q in reversed(tracer.slow_queries)
+        ]
+        
+        return ft.Column([
+            ft.Text("Zapytania SQL", size=18, weight=ft.FontWeight.BOLD),
+            ft.DataTable(
+                columns=[
+                    ft.DataColumn(ft.Text("Zapytanie")),
+                    ft.DataColumn(ft.Text("Wywołania"), numeric=True),
+                    ft.DataColumn(ft.Text("Łącznie [ms]"), numeric=True),
+                    ft.DataColumn(ft.Text("Średnio [ms]"), numeric=True),
+                    ft.DataColumn(ft.Text("Maks. [ms]"), numeric=True),
+                    ft.DataColumn(ft.Text("Wiersze"), numeric=True),
+                ],
+                rows=rows,
+            ) if rows else ft.Text("Brak zapytań", color=ft.Colors.GREY_700),
+            ft.Text(f"Wolne zapytania (≥ {tracer.slow_query_ms:.0f} ms)", weight=ft.FontWeight.BOLD),
+            *(slow or [ft.Text("Brak", color=ft.Colors.GREY_700)]),
+        ])
     
     # === POMOCNICZE ===
     
@@ -956,7 +1738,7 @@ class OfertomatApp:
             bgcolor=color
         )
         self.page.snack_bar.open = True
-        self.page.update()
+        self.ui.request()
 
 
 def main(page: ft.Page):
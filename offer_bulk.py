@@ -0,0 +1,74 @@
+"""
+Zbiorcze zmiany marż w edytorze oferty
+
+Operacje liczą nowe marże dla wielu pozycji naraz na tablicach numpy
+(jedno przejście zamiast edycji wiersz po wierszu) i zwracają tylko
+zmienione pozycje jako [(indeks, nowa marża)]. Aplikacja zapisuje je
+w historii jako jeden krok i odświeża tabelę raz.
+
+numpy jest importowane przy pierwszej operacji (jak pandas w importerze) -
+nie spowalnia startu aplikacji.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def category_indices(items: List[Dict], category_name: str) -> List[int]:
+    """Indeksy pozycji z danej kategorii"""
+    return [i for i, item in enumerate(items) if item.get('category_name') == category_name]
+
+
+def _arrays(items: List[Dict], indices: Iterable[int]):
+    import numpy as np
+    indices = np.fromiter(indices, dtype=np.int64)
+    selected = [items[i] for i in indices]
+    purchase = np.fromiter((item['purchase_price_net'] for item in selected), dtype=float, count=len(selected))
+    margin = np.fromiter((item['margin'] for item in selected), dtype=float, count=len(selected))
+    vat = np.fromiter((item['vat_rate'] for item in selected), dtype=float, count=len(selected))
+    return np, indices, purchase, margin, vat
+
+
+def _changes(np, indices, old, new) -> List[Tuple[int, float]]:
+    changed = ~np.isclose(old, new, rtol=0.0, atol=1e-9)
+    return list(zip(indices[changed].tolist(), new[changed].tolist()))
+
+
+def set_margin(items: List[Dict], indices: Iterable[int], margin: float) -> List[Tuple[int, float]]:
+    """Ustawia jedną marżę (%) dla wskazanych pozycji"""
+    np, indices, _, old, _ = _arrays(items, indices)
+    return _changes(np, indices, old, np.full_like(old, float(margin)))
+
+
+def change_prices(items: List[Dict], indices: Iterable[int], percent: float,
+                  decimals: Optional[int] = 2) -> List[Tuple[int, float]]:
+    """
+    Zmienia ceny sprzedaży wskazanych pozycji o percent % (np. -5 to obniżka o 5%)
+
+    Cena zakupu się nie zmienia, więc zmianę ceny wyraża nowa marża:
+    (1 + m'/100) = (1 + m/100) * (1 + percent/100). Marża zaokrąglana
+    do decimals miejsc jak przy edycji ceny w wierszu (None - bez zaokrąglania).
+    """
+    if percent <= -100:
+        raise ValueError("Zmiana ceny musi być większa niż -100%")
+    np, indices, _, old, _ = _arrays(items, indices)
+    new = ((1 + old / 100) * (1 + percent / 100) - 1) * 100
+    if decimals is not None:
+        new = np.round(new, decimals)
+    return _changes(np, indices, old, new)
+
+
+def round_gross_to_99(items: List[Dict], indices: Iterable[int]) -> List[Tuple[int, float]]:
+    """
+    Podnosi ceny brutto do najbliższej końcówki ,99 (jak reguła ending_99 w bazie)
+
+    Marża nie jest zaokrąglana - inaczej cena brutto po przeliczeniu
+    (calculate_price) mogłaby odejść od ,99. Pozycje z zerową ceną zakupu
+    są pomijane.
+    """
+    np, indices, purchase, old, vat = _arrays(items, indices)
+    gross = np.round(purchase * (1 + old / 100) * (1 + vat / 100), 2)
+    target = np.floor(gross + 0.005) + 0.99
+    # Ceny już z końcówką ,99 zostają bez zmian
+    valid = (purchase > 0) & ~np.isclose(gross, target, rtol=0.0, atol=0.001)
+    indices, purchase, old, vat, target = indices[valid], purchase[valid], old[valid], vat[valid], target[valid]
+    new = (target / (1 + vat / 100) / purchase - 1) * 100
+    return _changes(np, indices, old, new)
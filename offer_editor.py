@@ -0,0 +1,296 @@
+"""
+Edytor pozycji oferty z wirtualizowaną listą wierszy
+
+Oferta z kilku kategorii ma tysiące pozycji - tabela z polami edycji dla
+każdej z nich tworzyła dziesiątki tysięcy kontrolek. OfferEditor:
+- tworzy tylko wiersze widoczne w oknie listy (plus zapas OVERSCAN),
+  resztę zastępują dwa odstępy o wysokości pominiętych wierszy,
+- wiersze są tylko do odczytu (tekst); pola edycji powstają wyłącznie
+  dla wiersza klikniętego do edycji.
+
+Dane pozostają na liście pozycji przekazanej do edytora (offer_items).
+"""
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import flet as ft
+
+from offer_layout import calculate_price
+
+ROW_HEIGHT = 48
+VIEWPORT_HEIGHT = 600
+OVERSCAN = 10
+
+# Kolumny: nagłówek, szerokość, wyrównanie do prawej
+COLUMNS = [
+    ('Kategoria', 180, False),
+    ('Produkt', 350, False),
+    ('Cena zakupu', 110, True),
+    ('J.M.', 110, False),
+    ('Marża %', 100, True),
+    ('VAT', 60, True),
+    ('Cena netto jedn.', 120, True),
+    ('Cena brutto jedn.', 120, True),
+    ('Akcje', 100, False),
+]
+
+SELECT_WIDTH = 40
+TABLE_WIDTH = SELECT_WIDTH + sum(width for _, width, _ in COLUMNS) + 10 * (len(COLUMNS) + 1) + 20
+
+# Pola edytowalne: klucz obsługi zmiany i kolumna w wierszu
+EDIT_FIELDS = (('name', 1), ('unit', 3), ('margin', 4), ('net', 6), ('gross', 7))
+
+
+def visible_range(offset: float, viewport: float, total: int,
+                  row_height: int = ROW_HEIGHT) -> Tuple[int, int]:
+    """Zakres indeksów [start, end) wierszy widocznych przy przewinięciu o offset pikseli"""
+    start = min(total, max(0, int(offset // row_height)))
+    end = min(total, int((offset + viewport) // row_height) + 1)
+    return start, max(start, end)
+
+
+def window_range(offset: float, viewport: float, total: int, row_height: int = ROW_HEIGHT,
+                 overscan: int = OVERSCAN) -> Tuple[int, int]:
+    """Zakres wierszy do utworzenia - widoczne plus overscan z każdej strony"""
+    start, end = visible_range(offset, viewport, total, row_height)
+    return max(0, start - overscan), min(total, end + overscan)
+
+
+def cell_values(item: Dict) -> List[str]:
+    """Teksty komórek wiersza pozycji (bez kolumny akcji)"""
+    prices = calculate_price(item['purchase_price_net'], item['margin'], item['vat_rate'])
+    return [
+        item.get('category_name') or 'Brak',
+        item['name'],
+        f"{item['purchase_price_net']:.2f} zł",
+        item.get('unit') or 'szt.',
+        f"{item['margin']:g}",
+        f"{item['vat_rate']:.0f}%",
+        f"{prices['net_unit']:.2f}",
+        f"{prices['gross_unit']:.2f}",
+    ]
+
+
+class OfferEditor:
+    """Wirtualizowana lista pozycji oferty z edycją jednego wiersza naraz"""
+
+    def __init__(self, items: List[Dict], handlers: Dict[str, Callable[[int, str], None]],
+                 on_remove: Callable[[int], None], request_update: Callable,
+                 row_height: int = ROW_HEIGHT, viewport_height: int = VIEWPORT_HEIGHT,
+                 overscan: int = OVERSCAN):
+        """
+        Args:
+            items: Pozycje oferty (lista współdzielona z aplikacją)
+            handlers: Obsługa zmiany pola: name, unit, margin, net, gross -> f(index, value)
+            on_remove: Obsługa usunięcia pozycji f(index)
+            request_update: Zgłoszenie odświeżenia kontrolek (UpdateScheduler.request)
+        """
+        self.items = items
+        self.handlers = handlers
+        self.on_remove = on_remove
+        self.request_update = request_update
+        self.row_height = row_height
+        self.viewport_height = viewport_height
+        self.overscan = overscan
+        self.start = 0
+        self.end = 0
+        self.offset = 0.0
+        self.editing: Optional[int] = None
+        self._edit_fields: Dict[str, ft.TextField] = {}
+        # Zaznaczone pozycje (id słownika - zaznaczenie przetrwa usunięcie wiersza wyżej)
+        self.selected = set()
+        self._lock = threading.RLock()
+
+        self.top_spacer = ft.Container(height=0)
+        self.bottom_spacer = ft.Container(height=0)
+        self.list_view = ft.ListView(
+            controls=[self.top_spacer, self.bottom_spacer],
+            height=viewport_height,
+            width=TABLE_WIDTH,
+            spacing=0,
+            on_scroll=self.on_scroll,
+            on_scroll_interval=50,
+        )
+        self.select_all_checkbox = ft.Checkbox(value=False, tooltip="Zaznacz wszystkie",
+                                               on_change=lambda e: self.select_all(e.control.value))
+        header = ft.Row(
+            [ft.Container(self.select_all_checkbox, width=SELECT_WIDTH)]
+            + [self._cell(ft.Text(title, weight=ft.FontWeight.BOLD), width, numeric)
+               for title, width, numeric in COLUMNS],
+            spacing=10,
+        )
+        self.control = ft.Column([ft.Container(header, padding=ft.padding.symmetric(horizontal=10)),
+                                  ft.Divider(height=1), self.list_view], spacing=0, width=TABLE_WIDTH)
+        self.render_window(0, viewport_height)
+
+    # === OKNO WIERSZY ===
+
+    def render_window(self, offset: float, viewport: float):
+        """Tworzy wiersze widoczne przy danym przewinięciu, resztę zastępują odstępy"""
+        with self._lock:
+            total = len(self.items)
+            self.offset = offset
+            self.start, self.end = window_range(offset, viewport, total, self.row_height, self.overscan)
+            self.top_spacer.height = self.start * self.row_height
+            self.bottom_spacer.height = (total - self.end) * self.row_height
+            self.list_view.controls = ([self.top_spacer]
+                                       + [self.build_row(i) for i in range(self.start, self.end)]
+                                       + [self.bottom_spacer])
+        self.request_update(self.list_view)
+
+    def on_scroll(self, e):
+        """Przewinięcie listy - nowe okno, gdy widoczne wiersze wychodzą poza utworzone"""
+        viewport = e.viewport_dimension or self.viewport_height
+        start, end = visible_range(e.pixels, viewport, len(self.items), self.row_height)
+        self.offset = e.pixels
+        if start < self.start or end > self.end:
+            self.render_window(e.pixels, viewport)
+
+    def set_items(self, items: List[Dict]):
+        """Nowa lista pozycji - edycja zakończona, lista od początku"""
+        self.items = items
+        self.editing = None
+        self._edit_fields = {}
+        self.selected = set()
+        self.select_all_checkbox.value = False
+        self.render_window(0, self.viewport_height)
+
+    def refresh_row(self, index: int):
+        """Odświeża wiersz po zmianie pozycji (w edytowanym wierszu tylko wartości pól)"""
+        with self._lock:
+            if not self.start <= index < self.end:
+                return
+            if index == self.editing and self._edit_fields:
+                values = self._edit_values(self.items[index])
+                for key, field in self._edit_fields.items():
+                    field.value = values[key]
+                self.request_update(*self._edit_fields.values())
+                return
+            self.list_view.controls[1 + index - self.start] = self.build_row(index)
+        self.request_update(self.list_view)
+
+    def remove(self, index: int):
+        """Usuwa pozycję z listy i przesuwa okno"""
+        with self._lock:
+            self.selected.discard(id(self.items.pop(index)))
+            if self.editing == index:
+                self.editing = None
+                self._edit_fields = {}
+            elif self.editing is not None and self.editing > index:
+                self.editing -= 1
+        self.refresh()
+
+    def refresh(self):
+        """Przebudowuje okno przy bieżącym przewinięciu (po dodaniu lub usunięciu pozycji)"""
+        if self.editing is not None and self.editing >= len(self.items):
+            self.editing = None
+            self._edit_fields = {}
+        self.render_window(min(self.offset, max(0, len(self.items) * self.row_height - self.viewport_height)),
+                           self.viewport_height)
+
+    # === ZAZNACZENIE ===
+
+    def selected_indices(self) -> List[int]:
+        """Indeksy zaznaczonych pozycji"""
+        return [i for i, item in enumerate(self.items) if id(item) in self.selected]
+
+    def select_all(self, value: bool):
+        self.selected = {id(item) for item in self.items} if value else set()
+        self.select_all_checkbox.value = value
+        self.refresh()
+        self.request_update(self.select_all_checkbox)
+
+    def _toggle_selected(self, e):
+        item = e.control.data
+        if e.control.value:
+            self.selected.add(id(item))
+        else:
+            self.selected.discard(id(item))
+
+    # === EDYCJA ===
+
+    def start_edit(self, index: int):
+        """Zamienia wiersz na pola edycji (poprzednio edytowany wraca do tekstu)"""
+        previous = self.editing
+        self.editing = index
+        self._edit_fields = {}
+        if previous is not None and previous != index:
+            self.refresh_row(previous)
+        self.refresh_row(index)
+
+    def stop_edit(self, index: int):
+        if self.editing != index:
+            return
+        self.editing = None
+        self._edit_fields = {}
+        self.refresh_row(index)
+
+    # === KONTROLKI ===
+
+    def build_row(self, index: int) -> ft.Control:
+        if index == self.editing:
+            return self._build_edit_row(index)
+        values = cell_values(self.items[index])
+        cells = [self._cell(ft.Text(value, no_wrap=True, overflow=ft.TextOverflow.ELLIPSIS,
+                                    tooltip=value if column == 1 else None), width, numeric)
+                 for column, (value, (_, width, numeric)) in enumerate(zip(values, COLUMNS))]
+        cells.append(self._actions(index, 'edit', "Edytuj", lambda e: self.start_edit(e.control.data)))
+        return ft.Container(ft.Row([self._select_cell(index)] + cells, spacing=10), height=self.row_height,
+                            padding=ft.padding.symmetric(horizontal=10))
+
+    def _build_edit_row(self, index: int) -> ft.Control:
+        values = cell_values(self.items[index])
+        fields = {}
+        for key, column in EDIT_FIELDS:
+            fields[key] = ft.TextField(
+                value=self._edit_values(self.items[index])[key],
+                dense=True,
+                text_size=13,
+                content_padding=ft.padding.symmetric(horizontal=6, vertical=8),
+                keyboard_type=None if key in ('name', 'unit') else ft.KeyboardType.NUMBER,
+                data=(key, self.items[index]),
+                on_blur=self._field_changed,
+                on_submit=self._field_changed,
+            )
+        self._edit_fields = fields
+        editors = {column: fields[key] for key, column in EDIT_FIELDS}
+        cells = [self._cell(editors.get(column) or ft.Text(value), width, numeric)
+                 for column, (value, (_, width, numeric)) in enumerate(zip(values, COLUMNS))]
+        cells.append(self._actions(index, 'check', "Zakończ edycję", lambda e: self.stop_edit(e.control.data)))
+        return ft.Container(ft.Row([self._select_cell(index)] + cells, spacing=10), height=self.row_height,
+                            bgcolor=ft.Colors.GREY_100, padding=ft.padding.symmetric(horizontal=10))
+
+    def _field_changed(self, e):
+        # Pozycja szukana po tożsamości - indeks mógł się zmienić (usunięcie wiersza wyżej)
+        key, item = e.control.data
+        index = next((i for i, candidate in enumerate(self.items) if candidate is item), None)
+        if index is not None:
+            self.handlers[key](index, e.control.value)
+
+    @staticmethod
+    def _edit_values(item: Dict) -> Dict[str, str]:
+        prices = calculate_price(item['purchase_price_net'], item['margin'], item['vat_rate'])
+        return {
+            'name': item['name'],
+            'unit': item.get('unit') or 'szt.',
+            'margin': str(item['margin']),
+            'net': f"{prices['net_unit']:.2f}",
+            'gross': f"{prices['gross_unit']:.2f}",
+        }
+
+    def _select_cell(self, index: int) -> ft.Control:
+        item = self.items[index]
+        return ft.Container(ft.Checkbox(value=id(item) in self.selected, data=item,
+                                        on_change=self._toggle_selected), width=SELECT_WIDTH)
+
+    def _actions(self, index: int, icon: str, tooltip: str, on_click) -> ft.Control:
+        return ft.Row([
+            ft.IconButton(icon=icon, tooltip=tooltip, data=index, on_click=on_click),
+            ft.IconButton(icon="delete", icon_color=ft.Colors.RED_400, tooltip="Usuń", data=index,
+                          on_click=lambda e: self.on_remove(e.control.data)),
+        ], spacing=0, width=COLUMNS[-1][1])
+
+    @staticmethod
+    def _cell(content: ft.Control, width: int, numeric: bool) -> ft.Control:
+        return ft.Container(content, width=width,
+                            alignment=ft.alignment.center_right if numeric else ft.alignment.center_left)
@@ -0,0 +1,123 @@
+"""
+Cofanie i ponawianie zmian w edytorze oferty
+
+Historia nie kopiuje listy pozycji - zapisuje tylko zmiany:
+- zmiana pola: (indeks, pole, stara wartość, nowa wartość),
+- usunięcie pozycji: (indeks, REMOVED, pozycja, None),
+- dodanie pozycji: (indeks, INSERTED, pozycja, None).
+
+Krok historii to krotka zmian (jedna edycja albo cała operacja zbiorcza
+w bloku group()). Pamięć rośnie z liczbą zmian, nie z wielkością oferty,
+a cofnięcie zmiany pola to jedno przypisanie.
+"""
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+REMOVED = '__removed__'
+INSERTED = '__inserted__'
+DEFAULT_LIMIT = 500
+
+
+class OfferHistory:
+    """Stosy cofnij/ponów dla zmian pozycji oferty"""
+
+    def __init__(self, limit: int = DEFAULT_LIMIT):
+        """
+        Args:
+            limit: Najwięcej zapamiętanych kroków (najstarsze są zapominane)
+        """
+        self.limit = limit
+        self._undo: deque = deque(maxlen=limit)
+        self._redo: List[Tuple] = []
+        self._group: Optional[List[Tuple]] = None
+
+    def record(self, index: int, field: str, old, new):
+        """Zapisuje zmianę pola pozycji (bez zmiany wartości - pomijana)"""
+        if old != new:
+            self._push((index, field, old, new))
+
+    def record_removal(self, index: int, item: Dict):
+        """Zapisuje usunięcie pozycji (przed items.pop(index))"""
+        self._push((index, REMOVED, item, None))
+
+    def record_insertion(self, index: int, item: Dict):
+        """Zapisuje dodanie pozycji (po items.insert(index, item))"""
+        self._push((index, INSERTED, item, None))
+
+    @contextmanager
+    def group(self):
+        """Zmiany zapisane w bloku tworzą jeden krok (np. zmiana marży wielu pozycji)"""
+        if self._group is not None:
+            yield
+            return
+        self._group = []
+        try:
+            yield
+        finally:
+            deltas, self._group = self._group, None
+            if deltas:
+                self._undo.append(tuple(deltas))
+                self._redo.clear()
+
+    def _push(self, delta: Tuple):
+        if self._group is not None:
+            self._group.append(delta)
+        else:
+            self._undo.append((delta,))
+            self._redo.clear()
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    @property
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+
+    def undo(self, items: List[Dict]) -> List[Tuple[str, int, Dict]]:
+        """
+        Cofa ostatni krok na liście items
+
+        Returns:
+            Wykonane zmiany (rodzaj, indeks, pozycja); rodzaj: 'update', 'insert'
+            lub 'remove' - do odświeżenia sum i widoku
+        """
+        if not self._undo:
+            return []
+        step = self._undo.pop()
+        changes = [self._apply(items, delta, undo=True) for delta in reversed(step)]
+        self._redo.append(step)
+        return changes
+
+    def redo(self, items: List[Dict]) -> List[Tuple[str, int, Dict]]:
+        """Ponawia ostatni cofnięty krok (zwraca zmiany jak undo)"""
+        if not self._redo:
+            return []
+        step = self._redo.pop()
+        changes = [self._apply(items, delta, undo=False) for delta in step]
+        self._undo.append(step)
+        return changes
+
+    @staticmethod
+    def _apply(items: List[Dict], delta: Tuple, undo: bool) -> Tuple[str, int, Dict]:
+        index, field, old, new = delta
+        if field in (REMOVED, INSERTED):
+            if undo == (field == REMOVED):
+                items.insert(index, old)
+                return 'insert', index, old
+            return 'remove', index, items.pop(index)
+        item = items[index]
+        item[field] = old if undo else new
+        return 'update', index, item
+
+    def stats(self) -> Dict:
+        return {
+            'undo': len(self._undo),
+            'redo': len(self._redo),
+            'deltas': sum(len(step) for step in self._undo) + sum(len(step) for step in self._redo),
+        }
@@ -0,0 +1,141 @@
+"""
+Model układu oferty wspólny dla wszystkich generatorów
+
+build_layout() raz grupuje pozycje po kategoriach, sortuje kategorie,
+liczy ceny i formatuje komórki tabel. Generatory PDF, DOCX, XLSX i CSV
+tylko przenoszą gotowy model na swój format.
+
+Struktura modelu (zwykłe słowniki - można go przekazać do innego procesu):
+    title, date, business_card
+    sections: lista sekcji kategorii:
+        category: nazwa kategorii
+        key: skrót sekcji (klucz pamięci fragmentów generatorów)
+        rows: sformatowane wiersze tabeli (jak TABLE_HEADERS)
+        items: pozycje z cenami (name, unit, quantity, vat_rate,
+               net_unit, gross_unit, net_total, vat_amount, gross_total)
+        net_total, gross_total: sumy sekcji
+    totals: items, net, vat, gross - sumy całej oferty
+        by_vat: sumy per stawka VAT (vat_rate, items, net, vat, gross)
+
+Sumy pochodzą z offer_data['totals'] (OfferTotals.snapshot() utrzymywane
+przez edytor), a gdy ich brak - są liczone z pozycji.
+"""
+from datetime import datetime
+from typing import Dict
+
+from render_cache import FragmentCache
+
+TABLE_HEADERS = ['Nazwa', 'Cena netto', 'J.M.', 'VAT', 'Cena brutto']
+
+DEFAULT_TITLE = 'Oferta handlowa'
+DEFAULT_CATEGORY = 'Bez kategorii'
+VALIDITY_TEXT = 'Oferta ważna w dniu przedstawienia do momentu zmiany cen rynkowych.'
+
+SUMMARY_TITLE = 'Podsumowanie'
+VAT_SUMMARY_HEADERS = ['Stawka VAT', 'Pozycje', 'Wartość netto', 'VAT', 'Wartość brutto']
+
+
+def calculate_price(purchase_price: float, margin: float, vat_rate: float, quantity: float = 1):
+    """
+    Kalkuluje ceny
+
+    Returns:
+        dict z kluczami: net_unit, gross_unit, net_total, vat_amount, gross_total
+    """
+    # Cena jednostkowa netto sprzedaży
+    net_unit = purchase_price * (1 + margin / 100)
+
+    # Cena jednostkowa brutto
+    gross_unit = net_unit * (1 + vat_rate / 100)
+
+    # Wartości dla ilości
+    net_total = net_unit * quantity
+    vat_amount = net_total * (vat_rate / 100)
+    gross_total = net_total + vat_amount
+
+    return {
+        'net_unit': round(net_unit, 2),
+        'gross_unit': round(gross_unit, 2),
+        'net_total': round(net_total, 2),
+        'vat_amount': round(vat_amount, 2),
+        'gross_total': round(gross_total, 2)
+    }
+
+
+def build_layout(offer_data: Dict) -> Dict:
+    """
+    Buduje model układu oferty
+
+    Args:
+        offer_data: Dane oferty w formacie generate_offer_pdf/generate_offer_docx
+
+    Returns:
+        Model układu (patrz opis modułu)
+    """
+    from offer_totals import OfferTotals
+    
+    totals = offer_data.get('totals') or OfferTotals(offer_data.get('items', [])).snapshot()
+    
+    # Pogrupuj produkty po kategoriach
+    items_by_category = {}
+    for item in offer_data.get('items', []):
+        category = item.get('category_name', DEFAULT_CATEGORY)
+        if category not in items_by_category:
+            items_by_category[category] = []
+        items_by_category[category].append(item)
+
+    sections = []
+    for category_name, items in sorted(items_by_category.items()):
+        rows = []
+        priced = []
+        for item in items:
+            unit = item.get('unit', 'szt.')
+            prices = calculate_price(
+                item['purchase_price_net'],
+                item['margin'],
+                item['vat_rate'],
+                item['quantity']
+            )
+            rows.append((
+                item['name'],
+                f"{prices['net_unit']:.2f}",
+                f"zł/{unit}",
+                f"{item['vat_rate']:.0f}%",
+                f"{prices['gross_unit']:.2f} zł"
+            ))
+            priced.append({
+                'name': item['name'],
+                'unit': unit,
+                'quantity': item['quantity'],
+                'vat_rate': item['vat_rate'],
+                **prices,
+            })
+
+        section_totals = totals['by_category'][category_name]
+        sections.append({
+            'category': category_name,
+            'key': FragmentCache.section_key(category_name, rows),
+            'rows': rows,
+            'items': priced,
+            'net_total': section_totals['net'],
+            'gross_total': section_totals['gross'],
+        })
+
+    return {
+        'title': offer_data.get('title', DEFAULT_TITLE),
+        'date': offer_data.get('date', datetime.now().strftime('%d.%m.%Y')),
+        'business_card': offer_data.get('business_card'),
+        'sections': sections,
+        'totals': {key: totals[key] for key in ('items', 'net', 'vat', 'gross', 'by_vat')},
+    }
+
+
+def vat_summary_rows(totals: Dict) -> list:
+    """Sformatowane wiersze podsumowania (VAT_SUMMARY_HEADERS): stawki VAT i wiersz Razem"""
+    def row(label, sums):
+        return (label, str(sums['items']), f"{sums['net']:.2f} zł", f"{sums['vat']:.2f} zł",
+                f"{sums['gross']:.2f} zł")
+
+    rows = [row(f"{group['vat_rate']:.0f}%", group) for group in totals['by_vat']]
+    rows.append(row('Razem', totals))
+    return rows
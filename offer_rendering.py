@@ -0,0 +1,217 @@
+"""
+Renderowanie ofert do plików, strumieni i bajtów (PDF/DOCX/XLSX/CSV)
+
+Generatory (render_offer_<format>) piszą do dowolnego wyjścia obsługiwanego
+przez OfferOutput: ścieżki pliku albo zapisywalnego strumienia binarnego
+(BytesIO, gniazdo, potok).
+
+render_offer_formats buduje model układu oferty raz i renderuje z niego
+kilka formatów równolegle.
+
+Funkcja render_offer_bytes jest na poziomie modułu, więc może być wywoływana
+w procesach roboczych ProcessPoolExecutor. Generatory są tworzone raz na proces.
+"""
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+FORMATS = ('pdf', 'docx', 'xlsx', 'csv')
+
+# Zmienić przy każdej zmianie wyglądu ofert w generatorach - unieważnia pamięć podręczną
+TEMPLATE_VERSION = 2
+
+# Pliki graficzne używane przez generatory (ścieżki względem katalogu roboczego)
+TEMPLATE_ASSETS = ('logo_piwowar.png',)
+
+MEDIA_TYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+_generators: Dict[str, object] = {}
+
+
+class CountingWriter:
+    """Opakowanie strumienia bez seek/tell (gniazdo, potok) liczące zapisane bajty"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_written = 0
+
+    def write(self, data) -> int:
+        written = self.stream.write(data)
+        count = len(data) if written is None else written
+        self.bytes_written += count
+        return count
+
+    def flush(self):
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+
+class OfferOutput:
+    """
+    Wyjście generatora oferty (context manager zwracający strumień binarny)
+
+    - ścieżka (str/PathLike): tworzy katalog i plik, zamyka go po zapisie,
+    - strumień z seek/tell: zapis bezpośrednio, rozmiar z przesunięcia pozycji,
+    - inny strumień: zapis przez CountingWriter.
+
+    Po wyjściu z bloku metadata() zwraca format, rozmiar i czas od utworzenia
+    obiektu (generator tworzy go na początku renderowania).
+    """
+
+    def __init__(self, output, fmt: str):
+        self.output = output
+        self.fmt = fmt
+        self.path: Optional[str] = None
+        self.bytes_written = 0
+        self.seconds = 0.0
+        self._stream = None
+        self._start_pos = 0
+        # Czas liczony od utworzenia - obejmuje budowę dokumentu i zapis
+        self._start_time = time.perf_counter()
+        if isinstance(output, (str, os.PathLike)):
+            self.path = os.fspath(output)
+        elif not hasattr(output, 'write'):
+            raise TypeError(f"Wyjście oferty musi być ścieżką lub strumieniem binarnym, nie {type(output).__name__}")
+
+    def __enter__(self):
+        if self.path is not None:
+            # Stwórz katalog jeśli nie istnieje
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._stream = open(self.path, 'wb')
+        elif self._is_seekable(self.output):
+            self._stream = self.output
+            self._start_pos = self.output.tell()
+        else:
+            self._stream = CountingWriter(self.output)
+        return self._stream
+
+    def __exit__(self, exc_type, exc, tb):
+        stream = self._stream
+        if isinstance(stream, CountingWriter):
+            stream.flush()
+            self.bytes_written = stream.bytes_written
+        else:
+            self.bytes_written = stream.tell() - self._start_pos
+            if self.path is not None:
+                stream.close()
+        self.seconds = time.perf_counter() - self._start_time
+        return False
+
+    @staticmethod
+    def _is_seekable(stream) -> bool:
+        try:
+            return stream.seekable() and hasattr(stream, 'tell')
+        except (AttributeError, ValueError):
+            return False
+
+    def metadata(self, items: int) -> Dict:
+        metadata = {
+            'format': self.fmt,
+            'bytes': self.bytes_written,
+            'seconds': round(self.seconds, 6),
+            'items': items,
+        }
+        if self.path is not None:
+            metadata['path'] = self.path
+        return metadata
+
+
+def get_generator(fmt: str):
+    """Generator dla formatu (tworzony przy pierwszym użyciu w danym procesie)"""
+    generator = _generators.get(fmt)
+    if generator is None:
+        if fmt == 'pdf':
+            from pdf_generator import PDFGenerator
+            generator = PDFGenerator()
+        elif fmt == 'docx':
+            from docx_generator import DOCXGenerator
+            generator = DOCXGenerator()
+        elif fmt in ('xlsx', 'csv'):
+            from spreadsheet_generator import SpreadsheetGenerator
+            generator = _generators.get('xlsx') or _generators.get('csv') or SpreadsheetGenerator()
+        else:
+            raise ValueError(f"Nieobsługiwany format: {fmt}")
+        _generators[fmt] = generator
+    return generator
+
+
+def render_offer(offer_data: Dict, fmt: str, output, generator=None, layout: Optional[Dict] = None) -> Dict:
+    """Generuje ofertę w formacie fmt do ścieżki lub strumienia; zwraca metadane"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Nieobsługiwany format: {fmt}")
+    generator = generator or get_generator(fmt)
+    return getattr(generator, f'render_offer_{fmt}')(offer_data, output, layout=layout)
+
+
+def render_offer_formats(offer_data: Dict, outputs: Dict[str, object],
+                         generators: Optional[Dict[str, object]] = None,
+                         max_workers: Optional[int] = None) -> Dict[str, Dict]:
+    """
+    Renderuje ofertę do kilku formatów z jednego modelu układu
+
+    Model (grupowanie, ceny, formatowanie) jest liczony raz, a formaty
+    renderowane równolegle w wątkach - po jednym wątku na format, więc
+    każdy generator jest używany tylko przez jeden wątek naraz.
+
+    Args:
+        offer_data: Dane oferty
+        outputs: {format: ścieżka lub strumień}, np. {'pdf': 'a.pdf', 'xlsx': buf}
+        generators: Gotowe generatory {format: generator} (domyślnie współdzielone)
+        max_workers: Liczba wątków (domyślnie liczba formatów)
+
+    Returns:
+        {format: metadane} dla udanych formatów oraz {format: {'error': opis}} dla nieudanych
+    """
+    from offer_layout import build_layout
+
+    unknown = [fmt for fmt in outputs if fmt not in FORMATS]
+    if unknown:
+        raise ValueError(f"Nieobsługiwany format: {', '.join(unknown)}")
+    generators = generators or {}
+    layout = build_layout(offer_data)
+
+    def render_one(fmt):
+        try:
+            return render_offer(offer_data, fmt, outputs[fmt], generators.get(fmt), layout)
+        except Exception as e:
+            print(f"Błąd generowania {fmt.upper()}: {e}")
+            return {'format': fmt, 'error': str(e)}
+
+    if len(outputs) <= 1:
+        return {fmt: render_one(fmt) for fmt in outputs}
+    with ThreadPoolExecutor(max_workers=max_workers or len(outputs)) as executor:
+        results = executor.map(render_one, list(outputs))
+        return dict(zip(list(outputs), results))
+
+
+def render_offer_bytes(offer_data: Dict, fmt: str = 'pdf', generator=None) -> bytes:
+    """
+    Generuje ofertę w pamięci i zwraca zawartość pliku
+
+    Args:
+        offer_data: Dane oferty w formacie generate_offer_pdf/generate_offer_docx
+        fmt: Format z FORMATS ('pdf', 'docx', 'xlsx', 'csv')
+        generator: Gotowy generator (domyślnie współdzielony w procesie)
+
+    Returns:
+        Zawartość wygenerowanego pliku
+
+    Raises:
+        ValueError: Nieobsługiwany format
+        RuntimeError: Generator zgłosił błąd
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Nieobsługiwany format: {fmt}")
+    buffer = io.BytesIO()
+    try:
+        render_offer(offer_data, fmt, buffer, generator)
+    except Exception as e:
+        raise RuntimeError(f"Nie udało się wygenerować oferty ({fmt.upper()}): {e}") from e
+    return buffer.getvalue()
@@ -0,0 +1,433 @@
+"""
+Lokalny serwer HTTP Ofertomatu (asyncio)
+
+Udostępnia katalog z bazy i renderowanie ofert innym narzędziom biura.
+Nasłuchuje domyślnie tylko na 127.0.0.1.
+
+Endpointy:
+    GET  /health                      - stan serwera
+    GET  /categories                  - lista kategorii
+    GET  /products?category_id=&q=    - produkty (filtr kategorii lub wyszukiwanie)
+    GET  /products/<id>               - pojedynczy produkt
+    GET  /metrics                     - liczniki i opóźnienia żądań, stan kolejki
+    POST /offers/pdf, /offers/docx    - treść: JSON offer_data, odpowiedź: plik
+
+Renderowanie odbywa się w puli procesów (workers). Oczekujące renderowania
+czekają w kolejce do max_pending - kolejne żądania dostają 503 z nagłówkiem
+Retry-After (backpressure), zamiast zalegać w pamięci. Renderowanie przerwane
+limitem czasu lub rozłączeniem klienta zajmuje miejsce do końca pracy procesu.
+Po awarii procesu roboczego pula jest tworzona od nowa.
+
+Użycie:
+    python offer_server.py --port 8765 --workers 2 --max-pending 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import instrumentation
+from database import Database
+from offer_rendering import FORMATS, MEDIA_TYPES, render_offer_bytes
+from render_cache import RenderCache
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_HEADER_LINES = 100
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+
+class HTTPError(Exception):
+    """Błąd żądania zamieniany na odpowiedź JSON {'error': ...}"""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class LatencyMetrics:
+    """Liczniki i opóźnienia żądań per trasa (ostatnie window pomiarów do percentyli)"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.routes: Dict[str, Dict] = {}
+        self.started = time.time()
+
+    def record(self, route: str, status: int, seconds: float):
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = {
+                'requests': 0, 'statuses': {}, 'total_s': 0.0, 'max_s': 0.0,
+                'latencies': deque(maxlen=self.window),
+            }
+        stats['requests'] += 1
+        stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+        stats['total_s'] += seconds
+        stats['max_s'] = max(stats['max_s'], seconds)
+        stats['latencies'].append(seconds)
+
+    @staticmethod
+    def percentile(values, q: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    def snapshot(self) -> Dict:
+        routes = {}
+        for route, stats in self.routes.items():
+            latencies = list(stats['latencies'])
+            routes[route] = {
+                'requests': stats['requests'],
+                'statuses': dict(stats['statuses']),
+                'mean_ms': round(stats['total_s'] * 1000 / stats['requests'], 3),
+                'p50_ms': round(statistics.median(latencies) * 1000, 3) if latencies else 0.0,
+                'p95_ms': round(self.percentile(latencies, 0.95) * 1000, 3),
+                'p99_ms': round(self.percentile(latencies, 0.99) * 1000, 3),
+                'max_ms': round(stats['max_s'] * 1000, 3),
+            }
+        return {'uptime_s': round(time.time() - self.started, 1), 'routes': routes}
+
+
+class OfferServer:
+    """Serwer HTTP z pulą procesów renderujących oferty"""
+
+    def __init__(self, db_path: str = "ofertomat.db", host: str = "127.0.0.1", port: int = 8765,
+                 workers: Optional[int] = None, max_pending: int = 8, render_timeout: float = 120.0,
+                 cache: Optional[RenderCache] = None):
+        """
+        Args:
+            db_path: Baza katalogu
+            host, port: Adres nasłuchu (port 0 - dowolny wolny)
+            workers: Procesy renderujące (domyślnie liczba rdzeni)
+            max_pending: Maksymalna liczba renderowań w toku i w kolejce
+            render_timeout: Limit czasu pojedynczego renderowania [s]
+            cache: Pamięć podręczna wygenerowanych ofert (trafienia omijają pulę)
+        """
+        self.db = Database(db_path)
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max(max_pending, self.workers)
+        self.render_timeout = render_timeout
+        self.cache = cache
+        self.metrics = LatencyMetrics()
+        self.render_stats = {'rendered': 0, 'rejected': 0, 'failed': 0, 'queue_wait_s': 0.0}
+        self._pending = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """Rzeczywisty adres nasłuchu (po start())"""
+        if self._server and self._server.sockets:
+            return self._server.sockets[0].getsockname()[:2]
+        return self.host, self.port
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.workers)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def serve_forever(self):
+        await self.start()
+        host, port = self.address
+        print(f"Serwer ofert: http://{host}:{port} (procesy: {self.workers}, kolejka: {self.max_pending})")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    # === HTTP ===
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Obsługuje jedno żądanie na połączenie (Connection: close)"""
+        start = time.perf_counter()
+        route = 'invalid'
+        try:
+            try:
+                method, path, query, body = await self.read_request(reader)
+                route = self.route_name(method, path)
+                status, headers, payload = await self.dispatch(method, path, query, body)
+            except HTTPError as e:
+                status, headers = e.status, {'Content-Type': 'application/json', **e.headers}
+                payload = json.dumps({'error': e.message}, ensure_ascii=False).encode('utf-8')
+            except Exception as e:
+                print(f"Błąd serwera: {e}")
+                status, headers = 500, {'Content-Type': 'application/json'}
+                payload = json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8')
+
+            await self.write_response(writer, status, headers, payload)
+            seconds = time.perf_counter() - start
+            self.metrics.record(route, status, seconds)
+            if instrumentation.is_enabled():
+                instrumentation.record(f"HTTP {route}", seconds, bytes_written=len(payload),
+                                       error=status >= 500)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # Klient rozłączył się
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    async def read_request(reader: asyncio.StreamReader):
+        """Parsuje linię żądania, nagłówki i treść (Content-Length)"""
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise HTTPError(400, "Nieprawidłowa linia żądania")
+        method, target = parts[0].upper(), parts[1]
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HTTPError(400, "Zbyt wiele nagłówków")
+
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise HTTPError(400, "Nieprawidłowy Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Treść przekracza {MAX_BODY_BYTES // (1024 * 1024)} MB")
+        body = await reader.readexactly(length) if length > 0 else b''
+
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return method, url.path.rstrip('/') or '/', query, body
+
+    @staticmethod
+    async def write_response(writer: asyncio.StreamWriter, status: int, headers: Dict[str, str], payload: bytes):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        headers = {**headers, 'Content-Length': str(len(payload)), 'Connection': 'close'}
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload)
+        await writer.drain()
+
+    @staticmethod
+    def route_name(method: str, path: str) -> str:
+        """Nazwa trasy do metryk (identyfikatory zastąpione symbolem)"""
+        segments = path.strip('/').split('/')
+        if segments[0] == 'products' and len(segments) == 2:
+            return f"{method} /products/<id>"
+        if segments[0] == 'offers' and len(segments) == 2 and segments[1] in FORMATS:
+            return f"{method} {path}"
+        if path in ('/health', '/metrics', '/categories', '/products'):
+            return f"{method} {path}"
+        return 'other'
+
+    async def dispatch(self, method: str, path: str, query: Dict[str, str], body: bytes):
+        """Zwraca (status, nagłówki, treść)"""
+        segments = path.strip('/').split('/')
+
+        if segments[0] == 'offers' and len(segments) == 2:
+            if segments[1] not in FORMATS:
+                raise HTTPError(404, f"Nieobsługiwany format: {segments[1]}")
+            if method != 'POST':
+                raise HTTPError(405, "Użyj POST", {'Allow': 'POST'})
+            return await self.render_offer(segments[1], body)
+
+        if method != 'GET':
+            raise HTTPError(405, "Użyj GET", {'Allow': 'GET'})
+
+        if path == '/health':
+            return 200, *self.json_body({'status': 'ok'})
+        if path == '/metrics':
+            return 200, *self.json_body(self.metrics_snapshot())
+        if path == '/categories':
+            categories = await self.run_blocking(self.db.get_categories)
+            return 200, *self.json_body(categories)
+        if path == '/products':
+            if 'q' in query:
+                products = await self.run_blocking(self.db.search_products, query['q'])
+            else:
+                products = await self.run_blocking(self.db.get_products, self.int_param(query, 'category_id'))
+            return 200, *self.json_body(products)
+        if segments[0] == 'products' and len(segments) == 2:
+            product = await self.run_blocking(self.db.get_product_by_id, self.int_param({'id': segments[1]}, 'id'))
+            if product is None:
+                raise HTTPError(404, "Nie znaleziono produktu")
+            return 200, *self.json_body(product)
+
+        raise HTTPError(404, "Nie znaleziono")
+
+    @staticmethod
+    def json_body(data) -> Tuple[Dict[str, str], bytes]:
+        return ({'Content-Type': 'application/json; charset=utf-8'},
+                json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def int_param(query: Dict[str, str], name: str) -> Optional[int]:
+        if name not in query or query[name] == '':
+            return None
+        try:
+            return int(query[name])
+        except ValueError:
+            raise HTTPError(400, f"Parametr {name} musi być liczbą całkowitą")
+
+    @staticmethod
+    async def run_blocking(func, *args):
+        """Operacje blokujące (baza, pliki) w puli wątków - nie blokują pętli zdarzeń"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    # === RENDEROWANIE ===
+
+    @staticmethod
+    def parse_offer(body: bytes) -> Dict:
+        """Waliduje treść żądania w formacie offer_data"""
+        try:
+            offer_data = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise HTTPError(400, f"Nieprawidłowy JSON: {e}")
+        if not isinstance(offer_data, dict) or not isinstance(offer_data.get('items'), list):
+            raise HTTPError(400, "Oczekiwano obiektu z listą 'items'")
+        if not offer_data['items']:
+            raise HTTPError(400, "Oferta nie zawiera pozycji")
+
+        required = ('name', 'purchase_price_net', 'margin', 'vat_rate')
+        for i, item in enumerate(offer_data['items']):
+            if not isinstance(item, dict):
+                raise HTTPError(400, f"Pozycja {i}: oczekiwano obiektu")
+            missing = [key for key in required if key not in item]
+            if missing:
+                raise HTTPError(400, f"Pozycja {i}: brak pól {', '.join(missing)}")
+            for key in ('purchase_price_net', 'margin', 'vat_rate', 'quantity'):
+                if key in item and not isinstance(item[key], (int, float)):
+                    raise HTTPError(400, f"Pozycja {i}: pole {key} musi być liczbą")
+        # Sumy zawsze liczone z pozycji - nie z treści żądania
+        offer_data.pop('totals', None)
+        return offer_data
+
+    async def render_offer(self, fmt: str, body: bytes):
+        """Renderuje ofertę w puli procesów; odrzuca żądania ponad limit kolejki"""
+        offer_data = self.parse_offer(body)
+        headers = {'Content-Type': MEDIA_TYPES[fmt],
+                   'Content-Disposition': f'attachment; filename="Oferta.{fmt}"'}
+
+        key = self.cache.offer_key(offer_data, fmt) if self.cache else None
+        if key:
+            content = await self.run_blocking(self.cache.get, key)
+            if content is not None:
+                return 200, {**headers, 'X-Cache': 'HIT'}, content
+
+        if self._pending >= self.max_pending:
+            self.render_stats['rejected'] += 1
+            raise HTTPError(503, "Serwer zajęty - spróbuj ponownie", {'Retry-After': '1'})
+
+        self._pending += 1
+        try:
+            queued = time.perf_counter()
+            await self._slots.acquire()
+        except BaseException:
+            self._pending -= 1
+            raise
+        self.render_stats['queue_wait_s'] += time.perf_counter() - queued
+        pool = self._pool
+        try:
+            future = asyncio.get_running_loop().run_in_executor(pool, render_offer_bytes, offer_data, fmt)
+        except BaseException as e:
+            self._render_done(None)
+            if isinstance(e, BrokenProcessPool):
+                self._replace_pool(pool)
+            raise
+        # Miejsce zwalniane dopiero po zakończeniu pracy procesu (uruchomionej nie da się anulować)
+        future.add_done_callback(self._render_done)
+        try:
+            content = await asyncio.wait_for(asyncio.shield(future), self.render_timeout)
+        except asyncio.TimeoutError:
+            self.render_stats['failed'] += 1
+            raise HTTPError(504, "Przekroczono czas renderowania")
+        except BrokenProcessPool:
+            self.render_stats['failed'] += 1
+            self._replace_pool(pool)
+            raise HTTPError(500, "Awaria procesu renderującego - spróbuj ponownie")
+        except (RuntimeError, ValueError) as e:
+            self.render_stats['failed'] += 1
+            raise HTTPError(500, str(e))
+
+        self.render_stats['rendered'] += 1
+        if key:
+            await self.run_blocking(self.cache.put, key, content)
+            headers['X-Cache'] = 'MISS'
+        return 200, headers, content
+
+    def _render_done(self, future: Optional[asyncio.Future]):
+        """Zwalnia miejsce renderowania (także porzuconego przez klienta)"""
+        self._pending -= 1
+        self._slots.release()
+        if future is not None and not future.cancelled():
+            future.exception()  # Wynik porzuconego renderowania nie trafia do logu asyncio
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        """Tworzy nową pulę po awarii procesu (raz dla wszystkich żądań ze starej puli)"""
+        if self._pool is broken:
+            print("Pula renderująca uszkodzona - tworzenie nowej")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def metrics_snapshot(self) -> Dict:
+        snapshot = self.metrics.snapshot()
+        snapshot['render'] = {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self._pending,
+            'rendered': self.render_stats['rendered'],
+            'rejected': self.render_stats['rejected'],
+            'failed': self.render_stats['failed'],
+            'queue_wait_ms': round(self.render_stats['queue_wait_s'] * 1000, 3),
+        }
+        if self.cache:
+            snapshot['cache'] = self.cache.stats()
+        return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokalny serwer HTTP Ofertomatu")
+    parser.add_argument('--db', default="ofertomat.db", help="plik bazy danych")
+    parser.add_argument('--host', default="127.0.0.1", help="adres nasłuchu")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, help="procesy renderujące (domyślnie liczba rdzeni)")
+    parser.add_argument('--max-pending', type=int, default=8, help="limit renderowań w toku i w kolejce")
+    parser.add_argument('--no-cache', action='store_true', help="bez pamięci podręcznej ofert")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else RenderCache()
+    server = OfferServer(args.db, args.host, args.port, args.workers, args.max_pending, cache=cache)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("Serwer zatrzymany")
+
+
+if __name__ == '__main__':
+    main()
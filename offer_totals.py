@@ -0,0 +1,111 @@
+"""
+Sumy oferty aktualizowane przyrostowo
+
+OfferTotals trzyma wkład każdej pozycji (netto, VAT, brutto po zaokrągleniu
+do groszy, jak w offer_layout.calculate_price) oraz sumy per kategoria
+i stawka VAT. Zmiana marży lub ceny jednej pozycji koryguje sumy o różnicę
+jej wkładu - bez przeliczania całej oferty.
+
+Kwoty są przechowywane w groszach (int), więc wielokrotne dodawanie
+i odejmowanie nie kumuluje błędów zaokrągleń.
+
+snapshot() zwraca zwykły słownik przekazywany generatorom jako offer_data['totals'].
+"""
+from typing import Dict, Iterable, Tuple
+
+from offer_layout import DEFAULT_CATEGORY, calculate_price
+
+# (pozycje, netto, VAT, brutto) - kwoty w groszach
+_EMPTY = (0, 0, 0, 0)
+
+
+def to_grosze(amount: float) -> int:
+    return int(round(amount * 100))
+
+
+def item_contribution(item: Dict) -> Tuple[int, int, int]:
+    """Wkład pozycji w sumy: netto, VAT, brutto w groszach"""
+    prices = calculate_price(item['purchase_price_net'], item['margin'], item['vat_rate'],
+                             item.get('quantity', 1))
+    return to_grosze(prices['net_total']), to_grosze(prices['vat_amount']), to_grosze(prices['gross_total'])
+
+
+class OfferTotals:
+    """Sumy netto, VAT i brutto oferty - łącznie, per kategoria i per stawka VAT"""
+
+    def __init__(self, items: Iterable[Dict] = ()):
+        self.reset(items)
+
+    def reset(self, items: Iterable[Dict] = ()):
+        """Liczy sumy od nowa dla listy pozycji (np. po załadowaniu kategorii)"""
+        # id(pozycji) -> (kategoria, stawka VAT, netto, VAT, brutto)
+        self._contributions: Dict[int, Tuple] = {}
+        self._by_category: Dict[str, Tuple[int, int, int, int]] = {}
+        self._by_vat: Dict[float, Tuple[int, int, int, int]] = {}
+        self._total = _EMPTY
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Dict):
+        """Dodaje pozycję do sum"""
+        contribution = (item.get('category_name', DEFAULT_CATEGORY), float(item['vat_rate']),
+                        *item_contribution(item))
+        self._contributions[id(item)] = contribution
+        self._apply(contribution, 1)
+
+    def remove(self, item: Dict):
+        """Usuwa pozycję z sum (wkład zapamiętany przy dodaniu)"""
+        contribution = self._contributions.pop(id(item), None)
+        if contribution is not None:
+            self._apply(contribution, -1)
+
+    def update(self, item: Dict):
+        """Koryguje sumy po zmianie marży lub ceny pozycji"""
+        self.remove(item)
+        self.add(item)
+
+    def _apply(self, contribution: Tuple, sign: int):
+        category, vat_rate, net, vat, gross = contribution
+        delta = (sign, sign * net, sign * vat, sign * gross)
+        self._total = self._add(self._total, delta)
+        self._by_category[category] = self._add(self._by_category.get(category, _EMPTY), delta)
+        self._by_vat[vat_rate] = self._add(self._by_vat.get(vat_rate, _EMPTY), delta)
+        # Pusta grupa znika z podsumowania
+        if self._by_category[category][0] == 0:
+            del self._by_category[category]
+        if self._by_vat[vat_rate][0] == 0:
+            del self._by_vat[vat_rate]
+
+    @staticmethod
+    def _add(current: Tuple, delta: Tuple) -> Tuple:
+        return tuple(a + b for a, b in zip(current, delta))
+
+    @staticmethod
+    def _amounts(sums: Tuple[int, int, int, int]) -> Dict:
+        items, net, vat, gross = sums
+        return {'items': items, 'net': net / 100, 'vat': vat / 100, 'gross': gross / 100}
+
+    @property
+    def net(self) -> float:
+        return self._total[1] / 100
+
+    @property
+    def vat(self) -> float:
+        return self._total[2] / 100
+
+    @property
+    def gross(self) -> float:
+        return self._total[3] / 100
+
+    def snapshot(self) -> Dict:
+        """
+        Sumy jako zwykły słownik (offer_data['totals']):
+            items, net, vat, gross
+            by_category: {kategoria: {items, net, vat, gross}}
+            by_vat: lista {vat_rate, items, net, vat, gross} wg rosnącej stawki
+        """
+        return {
+            **self._amounts(self._total),
+            'by_category': {category: self._amounts(sums) for category, sums in self._by_category.items()},
+            'by_vat': [{'vat_rate': rate, **self._amounts(sums)} for rate, sums in sorted(self._by_vat.items())],
+        }
@@ -7,9 +7,26 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 from reportlab.pdfgen import canvas
-from datetime import datetime
-from typing import List, Dict
+from copy import copy
+from typing import List, Dict, Optional
+import io
 import os
+from instrumentation import instrumented, offer_item_count, rendered_bytes
+from offer_layout import (TABLE_HEADERS, VALIDITY_TEXT, SUMMARY_TITLE, VAT_SUMMARY_HEADERS,
+                          build_layout, calculate_price, vat_summary_rows)
+from offer_rendering import OfferOutput
+from render_cache import FragmentCache
+
+class LaidOutParagraph(Paragraph):
+    """Paragraph zapamiętujący podział na linie - ponowny wrap przy tej samej szerokości nic nie liczy"""
+    
+    def wrap(self, availWidth, availHeight):
+        if getattr(self, '_wrapped_width', None) == availWidth:
+            return self.width, self.height
+        result = super().wrap(availWidth, availHeight)
+        self._wrapped_width = availWidth
+        return result
+
 
 class PDFGenerator:
     """Klasa do generowania raportów PDF z ofert"""
@@ -17,6 +34,9 @@ class PDFGenerator:
     def __init__(self):
         self.styles = getSampleStyleSheet()
         
+        # Gotowe sekcje kategorii - po drobnej zmianie oferty przebudowywane są tylko zmienione
+        self.section_cache = FragmentCache()
+        
         # Rejestruj czcionkę obsługującą Unicode (polskie znaki)
         try:
             # Pobierz ścieżkę do systemowych czcionek Windows
@@ -109,29 +129,12 @@ class PDFGenerator:
     
     def calculate_price(self, purchase_price: float, margin: float, vat_rate: float, quantity: float = 1):
         """
-        Kalkuluje ceny
+        Kalkuluje ceny (zob. offer_layout.calculate_price)
         
         Returns:
             dict z kluczami: net_unit, gross_unit, net_total, vat_amount, gross_total
         """
-        # Cena jednostkowa netto sprzedaży
-        net_unit = purchase_price * (1 + margin / 100)
-        
-        # Cena jednostkowa brutto
-        gross_unit = net_unit * (1 + vat_rate / 100)
-        
-        # Wartości dla ilości
-        net_total = net_unit * quantity
-        vat_amount = net_total * (vat_rate / 100)
-        gross_total = net_total + vat_amount
-        
-        return {
-            'net_unit': round(net_unit, 2),
-            'gross_unit': round(gross_unit, 2),
-            'net_total': round(net_total, 2),
-            'vat_amount': round(vat_amount, 2),
-            'gross_total': round(gross_total, 2)
-        }
+        return calculate_price(purchase_price, margin, vat_rate, quantity)
     
     def add_watermark(self, canvas_obj, doc):
         """Dodaje znak wodny (logo) w tle każdej strony"""
@@ -160,9 +163,74 @@ class PDFGenerator:
             except Exception as e:
                 print(f"Błąd dodawania znaku wodnego: {e}")
     
-    def generate_offer_pdf(self, offer_data: Dict, output_path: str) -> bool:
+    def build_category_section(self, category_name: str, rows: List[tuple]) -> list:
+        """
+        Sekcja kategorii: nagłówek i tabela produktów
+        
+        Args:
+            category_name: Nazwa kategorii
+            rows: Sformatowane wiersze (nazwa, cena netto, J.M., VAT, cena brutto)
+        
+        Returns:
+            Lista flowables - gotowych do ponownego użycia w kolejnych dokumentach
+        """
+        # Użyj Paragraph dla nazwy aby obsługiwać długie teksty
+        # (podział na linie liczony raz i używany przez kolejne dokumenty)
+        table_data = [list(TABLE_HEADERS)]
+        for name, *values in rows:
+            table_data.append([LaidOutParagraph(name, self.styles['TableText']), *values])
+        
+        # Stwórz tabelę - dostosowane szerokości kolumn
+        table = Table(table_data, colWidths=[9*cm, 2.5*cm, 2*cm, 1.5*cm, 2.5*cm])
+        
+        # Stylizacja tabeli
+        table.setStyle(TableStyle([
+            # Nagłówek
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#C8102E')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), self.font_bold),
+            ('FONTSIZE', (0, 0), (-1, 0), 9),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            
+            # Dane
+            ('FONTNAME', (0, 1), (-1, -1), self.font_name),
+            ('FONTSIZE', (0, 1), (-1, -1), 8),
+            ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+            ('ALIGN', (0, 1), (0, -1), 'LEFT'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            
+            # Siatka
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            
+            # Padding
+            ('TOPPADDING', (0, 1), (-1, -1), 6),
+            ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+        ]))
+        
+        return [Paragraph(category_name, self.styles['CategoryHeader']), table, Spacer(1, 15)]
+    
+    def build_summary(self, totals: Dict) -> list:
+        """Podsumowanie oferty: wartości per stawka VAT i razem"""
+        table = Table([list(VAT_SUMMARY_HEADERS)] + vat_summary_rows(totals),
+                      colWidths=[3*cm, 2*cm, 3.5*cm, 3*cm, 3.5*cm])
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#C8102E')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), self.font_bold),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('FONTNAME', (0, 1), (-1, -2), self.font_name),
+            ('FONTNAME', (0, -1), (-1, -1), self.font_bold),
+            ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ]))
+        return [Paragraph(SUMMARY_TITLE, self.styles['CategoryHeader']), table]
+    
+    @instrumented('PDFGenerator.generate_offer_pdf', rows=offer_item_count, bytes_written=rendered_bytes)
+    def render_offer_pdf(self, offer_data: Dict, output, layout: Optional[Dict] = None) -> Dict:
         """
-        Generuje PDF z ofertą
+        Generuje PDF z ofertą do pliku lub strumienia
         
         Args:
             offer_data: Słownik z danymi oferty:
@@ -175,167 +243,110 @@ class PDFGenerator:
                     - vat_rate: float
                     - margin: float (z kategorii)
                     - category_name: str
-            output_path: Ścieżka do pliku wyjściowego PDF
+            output: Ścieżka pliku PDF albo zapisywalny strumień binarny (BytesIO, gniazdo, potok)
+            layout: Gotowy model układu (offer_layout.build_layout), opcjonalnie
         
         Returns:
-            bool - True jeśli sukces
+            Metadane: format, bytes, seconds, items (oraz path dla ścieżki)
+        
+        Raises:
+            Exception: Błąd generowania (generate_offer_pdf zamienia go na False)
         """
-        try:
-            # Stwórz katalog jeśli nie istnieje
-            os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
-            
-            # Utwórz dokument
-            doc = SimpleDocTemplate(
-                output_path,
-                pagesize=A4,
-                rightMargin=2*cm,
-                leftMargin=2*cm,
-                topMargin=2*cm,
-                bottomMargin=2*cm
-            )
-            
-            # Elementy dokumentu
-            elements = []
-            
-            # 1. Logo w nagłówku (jeśli istnieje)
-            logo_path = 'logo_piwowar.png'
-            if os.path.exists(logo_path):
-                try:
-                    logo = Image(logo_path, width=8*cm, height=3*cm, kind='proportional')
-                    logo.hAlign = 'CENTER'
-                    elements.append(logo)
-                    elements.append(Spacer(1, 15))
-                except Exception as e:
-                    print(f"Nie można załadować logo: {e}")
-            
-            # 2. Wizytówka - Firma (pogrubiona, wyśrodkowana)
-            business_card = offer_data.get('business_card')
-            if business_card and business_card.get('company'):
-                company_para = Paragraph(business_card['company'], self.styles['CompanyName'])
-                elements.append(company_para)
-            
-            # 3. Wizytówka - reszta danych (pogrubiona, wyśrodkowana)
-            if business_card:
-                contact_parts = []
-                if business_card.get('full_name'):
-                    contact_parts.append(business_card['full_name'])
-                if business_card.get('phone'):
-                    contact_parts.append(f"Tel: {business_card['phone']}")
-                if business_card.get('email'):
-                    contact_parts.append(f"E-mail: {business_card['email']}")
-                
-                if contact_parts:
-                    contact_para = Paragraph(" | ".join(contact_parts), self.styles['ContactInfo'])
-                    elements.append(contact_para)
-            
-            # 4. Data (kursywa, wyśrodkowana)
-            date_str = offer_data.get('date', datetime.now().strftime('%d.%m.%Y'))
-            date_para = Paragraph(f"<i>Data: {date_str}</i>", self.styles['DateItalic'])
-            elements.append(date_para)
-            
-            # 5. Tytuł (np. "Oferta handlowa")
-            title = offer_data.get('title', 'Oferta handlowa')
-            elements.append(Paragraph(title, self.styles['CustomTitle']))
-            elements.append(Spacer(1, 20))
-            
-            # Pogrupuj produkty po kategoriach
-            items_by_category = {}
-            for item in offer_data.get('items', []):
-                category = item.get('category_name', 'Bez kategorii')
-                if category not in items_by_category:
-                    items_by_category[category] = []
-                items_by_category[category].append(item)
-            
-            # Suma całkowita
-            grand_total_net = 0
-            grand_total_gross = 0
-            
-            # Dla każdej kategorii
-            for category_name, items in sorted(items_by_category.items()):
-                # Nagłówek kategorii
-                elements.append(Paragraph(category_name, self.styles['CategoryHeader']))
-                
-                # Tabela produktów
-                table_data = [
-                    ['Nazwa', 'Cena netto', 'J.M.', 'VAT', 'Cena brutto']
-                ]
-                
-                category_total_net = 0
-                category_total_gross = 0
-                
-                for item in items:
-                    prices = self.calculate_price(
-                        item['purchase_price_net'],
-                        item['margin'],
-                        item['vat_rate'],
-                        item['quantity']
-                    )
-                    
-                    category_total_net += prices['net_total']
-                    category_total_gross += prices['gross_total']
-                    
-                    # Użyj Paragraph dla nazwy aby obsługiwać długie teksty
-                    name_para = Paragraph(item['name'], self.styles['TableText'])
-                    
-                    table_data.append([
-                        name_para,
-                        f"{prices['net_unit']:.2f}",
-                        f"zł/{item.get('unit', 'szt.')}",
-                        f"{item['vat_rate']:.0f}%",
-                        f"{prices['gross_unit']:.2f} zł"
-                    ])
-                
-                grand_total_net += category_total_net
-                grand_total_gross += category_total_gross
-                
-                # Stwórz tabelę - dostosowane szerokości kolumn
-                table = Table(table_data, colWidths=[9*cm, 2.5*cm, 2*cm, 1.5*cm, 2.5*cm])
-                
-                # Stylizacja tabeli
-                table.setStyle(TableStyle([
-                    # Nagłówek
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#C8102E')),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-                    ('FONTNAME', (0, 0), (-1, 0), self.font_bold),
-                    ('FONTSIZE', (0, 0), (-1, 0), 9),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    
-                    # Dane
-                    ('FONTNAME', (0, 1), (-1, -1), self.font_name),
-                    ('FONTSIZE', (0, 1), (-1, -1), 8),
-                    ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
-                    ('ALIGN', (0, 1), (0, -1), 'LEFT'),
-                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                    
-                    # Siatka
-                    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                    
-                    # Padding
-                    ('TOPPADDING', (0, 1), (-1, -1), 6),
-                    ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
-                ]))
-                
-                elements.append(table)
+        target = OfferOutput(output, 'pdf')
+        layout = layout or build_layout(offer_data)
+        
+        # Elementy dokumentu
+        elements = []
+        
+        # 1. Logo w nagłówku (jeśli istnieje)
+        logo_path = 'logo_piwowar.png'
+        if os.path.exists(logo_path):
+            try:
+                logo = Image(logo_path, width=8*cm, height=3*cm, kind='proportional')
+                logo.hAlign = 'CENTER'
+                elements.append(logo)
                 elements.append(Spacer(1, 15))
+            except Exception as e:
+                print(f"Nie można załadować logo: {e}")
+        
+        # 2. Wizytówka - Firma (pogrubiona, wyśrodkowana)
+        business_card = layout['business_card']
+        if business_card and business_card.get('company'):
+            company_para = Paragraph(business_card['company'], self.styles['CompanyName'])
+            elements.append(company_para)
+        
+        # 3. Wizytówka - reszta danych (pogrubiona, wyśrodkowana)
+        if business_card:
+            contact_parts = []
+            if business_card.get('full_name'):
+                contact_parts.append(business_card['full_name'])
+            if business_card.get('phone'):
+                contact_parts.append(f"Tel: {business_card['phone']}")
+            if business_card.get('email'):
+                contact_parts.append(f"E-mail: {business_card['email']}")
             
-            # Informacja o ważności oferty
-            elements.append(Spacer(1, 20))
-            validity_style = ParagraphStyle(
-                name='Validity',
-                parent=self.styles['Normal'],
-                fontSize=8,
-                fontName=self.font_name,
-                textColor=colors.grey,
-                alignment=TA_CENTER
-            )
-            validity_text = "<i>Oferta ważna w dniu przedstawienia do momentu zmiany cen rynkowych.</i>"
-            elements.append(Paragraph(validity_text, validity_style))
-            
-            # Zbuduj PDF ze znakiem wodnym
-            doc.build(elements, onFirstPage=self.add_watermark, onLaterPages=self.add_watermark)
+            if contact_parts:
+                contact_para = Paragraph(" | ".join(contact_parts), self.styles['ContactInfo'])
+                elements.append(contact_para)
+        
+        # 4. Data (kursywa, wyśrodkowana)
+        date_para = Paragraph(f"<i>Data: {layout['date']}</i>", self.styles['DateItalic'])
+        elements.append(date_para)
+        
+        # 5. Tytuł (np. "Oferta handlowa")
+        elements.append(Paragraph(layout['title'], self.styles['CustomTitle']))
+        elements.append(Spacer(1, 20))
+        
+        # Dla każdej kategorii - niezmienione sekcje pochodzą z pamięci fragmentów
+        for section_layout in layout['sections']:
+            section = self.section_cache.get(section_layout['key'])
+            if section is None:
+                section = self.build_category_section(section_layout['category'], section_layout['rows'])
+                self.section_cache.put(section_layout['key'], section)
+            # Płytkie kopie - platypus zapisuje w flowables stan łamania stron
+            elements.extend(copy(flowable) for flowable in section)
+        
+        # Podsumowanie (sumy z offer_data['totals'] lub policzone przy budowie układu)
+        elements.extend(self.build_summary(layout['totals']))
+        
+        # Informacja o ważności oferty
+        elements.append(Spacer(1, 20))
+        validity_style = ParagraphStyle(
+            name='Validity',
+            parent=self.styles['Normal'],
+            fontSize=8,
+            fontName=self.font_name,
+            textColor=colors.grey,
+            alignment=TA_CENTER
+        )
+        validity_text = f"<i>{VALIDITY_TEXT}</i>"
+        elements.append(Paragraph(validity_text, validity_style))
+        
+        # Zbuduj PDF ze znakiem wodnym w pamięci - błąd nie zostawia niepełnego pliku
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=A4,
+            rightMargin=2*cm,
+            leftMargin=2*cm,
+            topMargin=2*cm,
+            bottomMargin=2*cm
+        )
+        doc.build(elements, onFirstPage=self.add_watermark, onLaterPages=self.add_watermark)
+        with target as stream:
+            stream.write(buffer.getbuffer())
+        return target.metadata(layout['totals']['items'])
+    
+    def generate_offer_pdf(self, offer_data: Dict, output_path: str) -> bool:
+        """
+        Generuje PDF z ofertą do pliku (format danych - zob. render_offer_pdf)
+        
+        Returns:
+            bool - True jeśli sukces
+        """
+        try:
+            self.render_offer_pdf(offer_data, output_path)
             return True
-            
         except Exception as e:
             print(f"Błąd generowania PDF: {e}")
             return False
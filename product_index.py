@@ -0,0 +1,305 @@
+"""
+Indeks prefiksowy produktów do podpowiedzi przy dodawaniu pozycji oferty
+
+Dwie posortowane listy kluczy (małe litery) z równoległymi tablicami id:
+- kody produktów,
+- słowa z nazw produktów.
+Wyszukanie prefiksu to bisect na liście kluczy (O(log n)) i odczyt kolejnych
+wpisów do uzbierania k produktów - bez zapytań do bazy.
+
+Indeks jest budowany raz z bazy (build) i aktualizowany przez obserwatora
+Database (attach) po zapisach katalogu tym samym obiektem Database.
+Obserwator tylko zapamiętuje zmienione produkty - indeks aktualizuje wątek
+w tle (flush) po FLUSH_DELAY s bez kolejnych zmian, więc import partiami
+nie czeka na indeks, a zmiany całego importu trafiają do niego naraz.
+Kilka produktów jest wstawianych w miejsce (bisect), większe zmiany są
+scalane z listami w jednym przebiegu.
+"""
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+# Powyżej tylu zmienionych produktów listy są scalane zamiast wstawiania w miejsce
+MERGE_THRESHOLD = 32
+# Opóźnienie aktualizacji indeksu po ostatniej zmianie katalogu (s)
+FLUSH_DELAY = 0.5
+DEFAULT_LIMIT = 10
+# Najwięcej kandydatów sprawdzanych dla zapytania z kilku słów (ogranicza czas odpowiedzi)
+MAX_SCAN = 20000
+# Znak większy od każdego znaku klucza - koniec zakresu prefiksu
+_PREFIX_END = '\U0010ffff'
+
+_WORD = re.compile(r'\w+')
+
+
+def name_tokens(name: str) -> List[str]:
+    """Słowa nazwy do indeksu (małe litery, bez powtórzeń)"""
+    return list(dict.fromkeys(_WORD.findall((name or '').lower())))
+
+
+class _SortedKeys:
+    """Posortowane klucze z równoległą tablicą id produktów"""
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.ids = array('q')
+
+    def rebuild(self, entries: Iterable[Tuple[str, int]]):
+        entries = sorted(entries)
+        self.keys = [sys.intern(key) for key, _ in entries]
+        self.ids = array('q', (product_id for _, product_id in entries))
+
+    def add(self, key: str, product_id: int):
+        position = bisect_left(self.keys, key)
+        # Wśród równych kluczy - w kolejności id
+        while position < len(self.keys) and self.keys[position] == key and self.ids[position] < product_id:
+            position += 1
+        self.keys.insert(position, sys.intern(key))
+        self.ids.insert(position, product_id)
+
+    def remove(self, key: str, product_id: int):
+        position = bisect_left(self.keys, key)
+        while position < len(self.keys) and self.keys[position] == key:
+            if self.ids[position] == product_id:
+                del self.keys[position]
+                del self.ids[position]
+                return
+            position += 1
+
+    def merged(self, changed: set, entries: Iterable[Tuple[str, int]]) -> '_SortedKeys':
+        """Nowe listy bez wpisów produktów changed, z dołączonymi entries"""
+        merged = [(key, product_id) for key, product_id in zip(self.keys, self.ids) if product_id not in changed]
+        merged += sorted((sys.intern(key), product_id) for key, product_id in entries)
+        # Dwie posortowane serie - timsort scala je w jednym przebiegu
+        merged.sort()
+        result = _SortedKeys()
+        result.keys = [key for key, _ in merged]
+        result.ids = array('q', (product_id for _, product_id in merged))
+        return result
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        """Zakres [start, end) wpisów z kluczem zaczynającym się od prefix"""
+        return bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + _PREFIX_END)
+
+    def prefix(self, prefix: str, limit: int = MAX_SCAN) -> array:
+        """Id produktów z kluczem zaczynającym się od prefix (w kolejności kluczy, najwyżej limit)"""
+        start, end = self.prefix_range(prefix)
+        return self.ids[start:min(end, start + limit)]
+
+
+class ProductIndex:
+    """Podpowiedzi produktów po prefiksie kodu lub słowa nazwy"""
+
+    def __init__(self, flush_delay: float = FLUSH_DELAY):
+        self._products: Dict[int, Tuple[str, str]] = {}
+        self._codes = _SortedKeys()
+        self._tokens = _SortedKeys()
+        # _lock chroni odczyt list, _flush_lock - kolejne aktualizacje
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self.flush_delay = flush_delay
+        # Zmiany katalogu czekające na flush
+        self._pending_lock = threading.Lock()
+        self._pending_ids: set = set()
+        self._pending_codes: set = set()
+        self._pending_deleted: set = set()
+        self._timer = None
+        self.db = None
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    # === BUDOWA I AKTUALIZACJA ===
+
+    def build(self, db) -> 'ProductIndex':
+        """Wczytuje kody i nazwy wszystkich produktów z bazy"""
+        conn = db.get_connection()
+        try:
+            rows = conn.execute('SELECT id, code, name FROM Products').fetchall()
+        finally:
+            conn.close()
+        self.load((row['id'], row['code'], row['name']) for row in rows)
+        return self
+
+    def load(self, products: Iterable[Tuple[int, str, str]]):
+        """Buduje indeks od nowa z krotek (id, kod, nazwa)"""
+        with self._flush_lock, self._lock:
+            self._products = {product_id: (code or '', name or '') for product_id, code, name in products}
+            self._rebuild()
+
+    def _rebuild(self):
+        self._codes.rebuild((code.lower(), product_id)
+                            for product_id, (code, _) in self._products.items() if code)
+        self._tokens.rebuild((token, product_id) for product_id, (_, name) in self._products.items()
+                             for token in name_tokens(name))
+
+    def attach(self, db):
+        """Buduje indeks i aktualizuje go po zapisach katalogu przez db"""
+        self.db = db
+        db.add_listener(self.on_database_change)
+        return self.build(db)
+
+    def detach(self):
+        if self.db is not None:
+            self.db.remove_listener(self.on_database_change)
+            self.db = None
+        with self._pending_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._pending_ids, self._pending_codes, self._pending_deleted = set(), set(), set()
+
+    def on_database_change(self, event: str, data: Dict):
+        """Obserwator Database: zapamiętuje zmienione produkty i planuje flush"""
+        if event not in ('products_saved', 'products_deleted'):
+            return
+        with self._pending_lock:
+            if event == 'products_deleted':
+                self._pending_deleted.update(data['ids'])
+            elif 'ids' in data:
+                self._pending_ids.update(data['ids'])
+            else:
+                self._pending_codes.update(data['codes'])
+            # Każda zmiana odsuwa aktualizację - import partiami to jeden flush
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Wprowadza do indeksu zapamiętane zmiany katalogu (od razu, bez czekania)"""
+        with self._flush_lock:
+            with self._pending_lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                ids, codes, deleted = self._pending_ids, self._pending_codes, self._pending_deleted
+                self._pending_ids, self._pending_codes, self._pending_deleted = set(), set(), set()
+                db = self.db
+            if db is None or not (ids or codes or deleted):
+                return
+            try:
+                # Stan produktów czytany po wszystkich zmianach - usunięty i ponownie zapisany zostaje
+                products = {row[0]: row for row in self._fetch(db, 'id', list(ids | deleted))}
+                products.update((row[0], row) for row in self._fetch(db, 'code', list(codes)))
+            except Exception as e:
+                print(f"Błąd aktualizacji indeksu produktów: {e}")
+                return
+            self._apply(list(products.values()), deleted - products.keys())
+
+    @staticmethod
+    def _fetch(db, column: str, keys: List) -> List[Tuple[int, str, str]]:
+        rows = []
+        conn = db.get_connection()
+        try:
+            # Partie poniżej limitu parametrów SQLite
+            for start in range(0, len(keys), 900):
+                chunk = keys[start:start + 900]
+                rows += conn.execute(f'SELECT id, code, name FROM Products WHERE {column} IN '
+                                     f'({",".join("?" * len(chunk))})', chunk).fetchall()
+        finally:
+            conn.close()
+        return [(row['id'], row['code'], row['name']) for row in rows]
+
+    def upsert(self, products: List[Tuple[int, str, str]]):
+        """Dodaje lub aktualizuje produkty (id, kod, nazwa)"""
+        with self._flush_lock:
+            self._apply(products, set())
+
+    def remove(self, product_ids: Iterable[int]):
+        with self._flush_lock:
+            self._apply([], set(product_ids))
+
+    def _apply(self, products: List[Tuple[int, str, str]], deleted: set):
+        """Wprowadza zmiany (wywołujący trzyma _flush_lock)"""
+        products = [(product_id, code or '', name or '') for product_id, code, name in products]
+        if len(products) + len(deleted) <= MERGE_THRESHOLD:
+            with self._lock:
+                for product_id in deleted:
+                    self._remove_keys(product_id)
+                    self._products.pop(product_id, None)
+                for product_id, code, name in products:
+                    self._remove_keys(product_id)
+                    self._products[product_id] = (code, name)
+                    if code:
+                        self._codes.add(code.lower(), product_id)
+                    for token in name_tokens(name):
+                        self._tokens.add(token, product_id)
+            return
+        # Nowe listy powstają poza _lock (zmienia je tylko wątek z _flush_lock), wyszukiwanie nie czeka
+        changed = deleted | {product_id for product_id, _, _ in products}
+        codes = self._codes.merged(changed, ((code.lower(), product_id)
+                                             for product_id, code, _ in products if code))
+        tokens = self._tokens.merged(changed, ((token, product_id) for product_id, _, name in products
+                                               for token in name_tokens(name)))
+        catalogue = dict(self._products)
+        for product_id in deleted:
+            catalogue.pop(product_id, None)
+        catalogue.update((product_id, (code, name)) for product_id, code, name in products)
+        with self._lock:
+            self._products, self._codes, self._tokens = catalogue, codes, tokens
+
+    def _remove_keys(self, product_id: int):
+        old = self._products.get(product_id)
+        if old is None:
+            return
+        code, name = old
+        if code:
+            self._codes.remove(code.lower(), product_id)
+        for token in name_tokens(name):
+            self._tokens.remove(token, product_id)
+
+    # === WYSZUKIWANIE ===
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+        """
+        Do limit produktów pasujących do zapytania
+
+        Najpierw produkty, których kod zaczyna się od zapytania, potem te,
+        w których nazwie każde słowo zapytania jest początkiem któregoś słowa
+        (np. "śrub m8" znajdzie "Śruba sześciokątna M8x40").
+
+        Returns:
+            Lista {id, code, name}
+        """
+        query = (query or '').strip().lower()
+        if not query:
+            return []
+        words = name_tokens(query)
+        results: List[Dict] = []
+        seen = set()
+        with self._lock:
+            for product_id in self._codes.prefix(query, limit):
+                if self._collect(product_id, seen, results) >= limit:
+                    return results
+            if not words:
+                return results
+            # Słowo o najmniejszym zakresie wpisów wyznacza kandydatów, pozostałe sprawdzane w nazwie
+            lead = min(words, key=lambda word: len(range(*self._tokens.prefix_range(word))))
+            # Pozostałe słowa - na początku słowa nazwy (\b jak granice słów w name_tokens)
+            others = [re.compile(r'\b' + re.escape(word)) for word in words if word != lead]
+            for product_id in self._tokens.prefix(lead):
+                if product_id in seen:
+                    continue
+                if others:
+                    name = self._products[product_id][1].lower()
+                    if not all(pattern.search(name) for pattern in others):
+                        continue
+                if self._collect(product_id, seen, results) >= limit:
+                    break
+        return results
+
+    def _collect(self, product_id: int, seen: set, results: List[Dict]) -> int:
+        if product_id not in seen:
+            seen.add(product_id)
+            code, name = self._products[product_id]
+            results.append({'id': product_id, 'code': code, 'name': name})
+        return len(results)
+
+    def stats(self) -> Dict:
+        return {'products': len(self._products), 'codes': len(self._codes.keys),
+                'tokens': len(self._tokens.keys)}
@@ -0,0 +1,220 @@
+"""
+Pamięć podręczna wygenerowanych ofert (PDF/DOCX)
+
+RenderCache - całe pliki ofert. Klucz to skrót SHA-256 kanonicznej postaci
+offer_data razem z formatem, wersją szablonu (TEMPLATE_VERSION) i odciskiem
+plików graficznych szablonu (logo). Ta sama oferta wygenerowana ponownie
+zwraca zapisane bajty bez renderowania. Pliki są usuwane od najdawniej
+używanych, gdy łączny rozmiar przekroczy max_bytes.
+
+FragmentCache - gotowe sekcje kategorii w pamięci generatora. Po zmianie
+jednej ceny przebudowywana jest tylko sekcja tej kategorii.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from offer_rendering import TEMPLATE_ASSETS, TEMPLATE_VERSION
+
+DEFAULT_CACHE_DIR = '.ofertomat_cache'
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def canonicalize(value):
+    """Postać niezależna od kolejności kluczy i zapisu liczb (30 == 30.0)"""
+    if isinstance(value, dict):
+        return {str(k): canonicalize(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(v) for v in value]
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 6)
+    return str(value)
+
+
+def assets_fingerprint() -> list:
+    """Rozmiar i czas modyfikacji plików szablonu - zmiana logo unieważnia wpisy"""
+    fingerprint = []
+    for path in TEMPLATE_ASSETS:
+        try:
+            st = os.stat(path)
+            fingerprint.append([path, st.st_size, st.st_mtime_ns])
+        except OSError:
+            fingerprint.append([path, None, None])
+    return fingerprint
+
+
+class RenderCache:
+    """Adresowana treścią pamięć podręczna plików ofert z usuwaniem LRU"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def offer_key(offer_data: Dict, fmt: str) -> str:
+        """Klucz oferty: skrót kanonicznych danych, formatu i wersji szablonu"""
+        data = dict(offer_data)
+        # Generatory wstawiają dzisiejszą datę, gdy jej brak - jutro to inna oferta
+        data.setdefault('date', datetime.now().strftime('%d.%m.%Y'))
+        payload = {
+            'format': fmt,
+            'template': TEMPLATE_VERSION,
+            'assets': assets_fingerprint(),
+            'offer': canonicalize(data),
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return f"{hashlib.sha256(raw.encode('utf-8')).hexdigest()}.{fmt}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Zawartość wpisu lub None (chybienie)"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = os.path.join(self.cache_dir, key)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)  # Czas modyfikacji = ostatnie użycie (kolejność LRU po restarcie)
+            except OSError:
+                self._forget(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes):
+        """Zapisuje wpis (atomowo) i usuwa najdawniej używane ponad limit"""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, os.path.join(self.cache_dir, key))
+            except OSError as e:
+                print(f"Nie można zapisać w pamięci podręcznej: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+
+            self._forget(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get_or_render(self, offer_data: Dict, fmt: str, render: Callable[[], bytes]) -> bytes:
+        """Zwraca zapisane bajty oferty albo renderuje ją funkcją render() i zapamiętuje"""
+        key = self.offer_key(offer_data, fmt)
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def stats(self) -> Dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        """Usuwa wszystkie wpisy (statystyki trafień zostają)"""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _load_index(self):
+        """Odtwarza kolejność LRU z czasów modyfikacji plików w katalogu"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)  # Pozostałość po przerwanym zapisie
+                continue
+            st = os.stat(path)
+            files.append((st.st_mtime_ns, name, st.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _remove(self, key: str):
+        self._forget(key)
+        try:
+            os.remove(os.path.join(self.cache_dir, key))
+        except OSError:
+            pass
+
+
+class FragmentCache:
+    """Ograniczona pamięć LRU fragmentów dokumentu (sekcji kategorii) w procesie"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, object]' = OrderedDict()
+
+    @staticmethod
+    def section_key(category_name: str, rows: List[Tuple]) -> str:
+        """Klucz sekcji: nagłówek i sformatowane wartości wszystkich wierszy tabeli"""
+        raw = json.dumps([category_name, rows], ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def put(self, key: str, fragment):
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,200 @@
+"""
+Eksport oferty do arkusza XLSX i pliku CSV
+
+Oba formaty korzystają z modelu układu (offer_layout.build_layout) - te same
+kategorie, kolejność i ceny co w PDF/DOCX, ale ceny zapisane jako liczby.
+CSV jest w formacie polskiego Excela: średnik, przecinek dziesiętny, UTF-8 z BOM.
+
+Oba zapisy są strumieniowe (XLSX w trybie write_only, CSV sekcja po sekcji),
+więc oferty ze 100 tys. pozycji nie wymagają budowy całego dokumentu w pamięci.
+"""
+import csv
+import io
+from typing import Dict, List, Optional
+
+from instrumentation import instrumented, offer_item_count, rendered_bytes
+from offer_layout import TABLE_HEADERS, VALIDITY_TEXT, build_layout
+from offer_rendering import OfferOutput
+
+CSV_HEADERS = ['Kategoria'] + TABLE_HEADERS
+SUMMARY_HEADERS = ['Kategoria', 'Pozycje', 'Wartość netto', 'Wartość brutto']
+COLUMN_WIDTHS = (60, 14, 10, 8, 16)
+
+# Ograniczenia nazw arkuszy w Excelu
+MAX_SHEET_TITLE = 31
+INVALID_SHEET_CHARS = set('[]:*?/\\')
+
+
+class SpreadsheetGenerator:
+    """Klasa do eksportu ofert do XLSX i CSV"""
+
+    def __init__(self, sheet_per_category: bool = False):
+        # True - każda kategoria na osobnym arkuszu, arkusz główny z podsumowaniem
+        self.sheet_per_category = sheet_per_category
+
+    @instrumented('SpreadsheetGenerator.render_offer_xlsx', rows=offer_item_count, bytes_written=rendered_bytes)
+    def render_offer_xlsx(self, offer_data: Dict, output, layout: Optional[Dict] = None) -> Dict:
+        """
+        Eksportuje ofertę do arkusza XLSX
+
+        Skoroszyt jest w trybie write_only - wiersze trafiają od razu do pliku
+        tymczasowego, więc pamięć nie rośnie z liczbą pozycji.
+
+        Args:
+            offer_data: Dane oferty (jak w generate_offer_pdf)
+            output: Ścieżka pliku albo zapisywalny strumień binarny
+            layout: Gotowy model układu, opcjonalnie
+
+        Returns:
+            Metadane: format, bytes, seconds, items (oraz path dla ścieżki)
+        """
+        from openpyxl import Workbook
+
+        target = OfferOutput(output, 'xlsx')
+        layout = layout or build_layout(offer_data)
+
+        wb = Workbook(write_only=True)
+        styles = self._xlsx_styles()
+        ws = self._create_sheet(wb, 'Oferta', styles)
+
+        ws.append([self._cell(ws, layout['title'], styles['title'])])
+        business_card = layout['business_card']
+        if business_card and business_card.get('company'):
+            ws.append([business_card['company']])
+        ws.append([f"Data: {layout['date']}"])
+        ws.append([])
+
+        if self.sheet_per_category:
+            # Arkusz główny z podsumowaniem kategorii, pozycje na osobnych arkuszach
+            ws.append([self._cell(ws, header, styles['bold']) for header in SUMMARY_HEADERS])
+            for section in layout['sections']:
+                ws.append([section['category'], len(section['items']),
+                           self._cell(ws, section['net_total'], styles['money']),
+                           self._cell(ws, section['gross_total'], styles['money'])])
+            totals = layout['totals']
+            ws.append([self._cell(ws, 'Razem', styles['bold']), totals['items'],
+                       self._cell(ws, totals['net'], styles['money']),
+                       self._cell(ws, totals['gross'], styles['money'])])
+            ws.append([])
+            ws.append([VALIDITY_TEXT])
+
+            used_titles = {'Oferta'}
+            for section in layout['sections']:
+                sheet = self._create_sheet(wb, self.sheet_title(section['category'], used_titles), styles)
+                sheet.append([self._cell(sheet, header, styles['bold']) for header in TABLE_HEADERS])
+                self._append_items(sheet, section['items'], styles)
+        else:
+            # Jeden arkusz - kategorie jako wiersze grupujące
+            for section in layout['sections']:
+                ws.append([self._cell(ws, section['category'], styles['category'])])
+                ws.append([self._cell(ws, header, styles['bold']) for header in TABLE_HEADERS])
+                self._append_items(ws, section['items'], styles)
+                ws.append([])
+            ws.append([VALIDITY_TEXT])
+
+        with target as stream:
+            wb.save(stream)
+        return target.metadata(layout['totals']['items'])
+
+    @staticmethod
+    def _xlsx_styles() -> Dict:
+        """Style komórek współdzielone przez wszystkie wiersze skoroszytu"""
+        from openpyxl.styles import Font, NamedStyle
+
+        def named(name, font=None, number_format='General'):
+            style = NamedStyle(name=name, number_format=number_format)
+            if font is not None:
+                style.font = font
+            return style
+
+        return {
+            'title': named('oferta_tytul', Font(bold=True, size=14)),
+            'category': named('oferta_kategoria', Font(bold=True, color='C8102E')),
+            'bold': named('oferta_naglowek', Font(bold=True)),
+            'price': named('oferta_cena', number_format='0.00'),
+            'percent': named('oferta_procent', number_format='0%'),
+            'money': named('oferta_kwota', number_format='0.00 "zł"'),
+        }
+
+    @staticmethod
+    def _create_sheet(wb, title: str, styles: Dict):
+        """Nowy arkusz write_only z szerokościami kolumn (ustawiane przed pierwszym wierszem)"""
+        ws = wb.create_sheet(title)
+        for column, width in zip('ABCDE', COLUMN_WIDTHS):
+            ws.column_dimensions[column].width = width
+        return ws
+
+    @staticmethod
+    def _cell(ws, value, style):
+        from openpyxl.cell import WriteOnlyCell
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = style
+        return cell
+
+    def _append_items(self, ws, items: List[Dict], styles: Dict):
+        # Wiersz jest zapisywany od razu przy append, więc komórki ze stylem
+        # można użyć ponownie - zmienia się tylko wartość
+        net_cell = self._cell(ws, None, styles['price'])
+        vat_cell = self._cell(ws, None, styles['percent'])
+        gross_cell = self._cell(ws, None, styles['money'])
+        for item in items:
+            net_cell.value = item['net_unit']
+            vat_cell.value = item['vat_rate'] / 100
+            gross_cell.value = item['gross_unit']
+            ws.append([item['name'], net_cell, f"zł/{item['unit']}", vat_cell, gross_cell])
+
+    @staticmethod
+    def sheet_title(category_name: str, used: set) -> str:
+        """
+        Nazwa arkusza dla kategorii zgodna z ograniczeniami Excela
+
+        Usuwa znaki niedozwolone ([]:*?/\\), skraca do 31 znaków i dodaje
+        numer, jeśli nazwa się powtarza. Dopisuje wynik do used.
+        """
+        base = ''.join('_' if ch in INVALID_SHEET_CHARS else ch for ch in category_name)
+        base = base.strip("' ")[:MAX_SHEET_TITLE] or 'Kategoria'
+        title = base
+        counter = 2
+        while title.lower() in {name.lower() for name in used}:
+            suffix = f" ({counter})"
+            title = base[:MAX_SHEET_TITLE - len(suffix)] + suffix
+            counter += 1
+        used.add(title)
+        return title
+
+    @instrumented('SpreadsheetGenerator.render_offer_csv', rows=offer_item_count, bytes_written=rendered_bytes)
+    def render_offer_csv(self, offer_data: Dict, output, layout: Optional[Dict] = None) -> Dict:
+        """
+        Eksportuje pozycje oferty do CSV (jeden wiersz na pozycję, z nazwą kategorii)
+
+        Args:
+            offer_data: Dane oferty (jak w generate_offer_pdf)
+            output: Ścieżka pliku albo zapisywalny strumień binarny
+            layout: Gotowy model układu, opcjonalnie
+
+        Returns:
+            Metadane: format, bytes, seconds, items (oraz path dla ścieżki)
+        """
+        target = OfferOutput(output, 'csv')
+        layout = layout or build_layout(offer_data)
+
+        with target as stream:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+            writer.writerow(CSV_HEADERS)
+            stream.write(('\ufeff' + buffer.getvalue()).encode('utf-8'))
+            # Zapis po sekcjach - bez składania całego pliku w pamięci
+            for section in layout['sections']:
+                buffer.seek(0)
+                buffer.truncate()
+                for item in section['items']:
+                    writer.writerow([
+                        section['category'],
+                        item['name'],
+                        f"{item['net_unit']:.2f}".replace('.', ','),
+                        f"zł/{item['unit']}",
+                        f"{item['vat_rate']:.0f}%",
+                        f"{item['gross_unit']:.2f}".replace('.', ','),
+                    ])
+                stream.write(buffer.getvalue().encode('utf-8'))
+        return target.metadata(layout['totals']['items'])
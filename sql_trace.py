@@ -0,0 +1,258 @@
+"""
+Śledzenie zapytań SQL dla bazy SQLite
+
+SQLTracer zbiera dla każdego kształtu zapytania (tekst SQL z literałami
+zamienionymi na ?) liczbę wykonań, czas (łączny i maksymalny), liczbę
+wierszy oraz liczbę kroków maszyny wirtualnej SQLite. Zapytania dłuższe
+niż próg są logowane (logger 'ofertomat.sql') razem z EXPLAIN QUERY PLAN.
+
+Połączenia są śledzone przez fabrykę TracedConnection:
+- kursor TracedCursor mierzy execute/executemany i pobieranie wierszy,
+- set_trace_callback rejestruje instrukcje wykonywane niejawnie (BEGIN),
+- set_progress_handler przypisuje kroki VM do bieżącej instrukcji.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger('ofertomat.sql')
+
+# Co ile instrukcji maszyny wirtualnej SQLite wołany jest progress handler
+PROGRESS_STEP = 1000
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+
+def normalize_sql(sql: str) -> str:
+    """Kształt zapytania: literały zamienione na ?, listy IN zwinięte, spacje ujednolicone"""
+    shape = _STRING_LITERAL.sub('?', sql)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _PLACEHOLDER_LIST.sub('(?, ...)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class SQLTracer:
+    """Rejestr statystyk zapytań SQL współdzielony przez połączenia jednej bazy"""
+
+    def __init__(self, slow_query_ms: float = 100.0, explain_slow: bool = True,
+                 max_slow_queries: int = 50):
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow = explain_slow
+        self.slow_queries = deque(maxlen=max_slow_queries)
+        self._stats: Dict[str, Dict] = {}
+        self._shapes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def attach(self, conn: 'TracedConnection'):
+        """Podpina callbacki śledzenia do połączenia"""
+        conn.tracer = self
+        conn.set_trace_callback(self._on_trace)
+        conn.set_progress_handler(conn.on_progress, PROGRESS_STEP)
+
+    def shape(self, sql: str) -> str:
+        """Znormalizowany kształt (z pamięcią podręczną - te same teksty SQL się powtarzają)"""
+        shape = self._shapes.get(sql)
+        if shape is None:
+            shape = normalize_sql(sql)
+            if len(self._shapes) < 10000:
+                self._shapes[sql] = shape
+        return shape
+
+    def record(self, shape: str, seconds: float = 0.0, rows: int = 0,
+               vm_steps: int = 0, calls: int = 1, statement_seconds: Optional[float] = None):
+        """
+        Dopisuje pomiar do statystyk kształtu zapytania
+
+        statement_seconds to łączny czas instrukcji (wykonanie + pobrane
+        dotąd wiersze) - z niego liczony jest czas maksymalny.
+        """
+        if statement_seconds is None:
+            statement_seconds = seconds
+        with self._lock:
+            stats = self._stats.get(shape)
+            if stats is None:
+                stats = self._stats[shape] = {
+                    'calls': 0, 'total_s': 0.0, 'max_s': 0.0, 'rows': 0, 'vm_steps': 0
+                }
+            stats['calls'] += calls
+            stats['total_s'] += seconds
+            stats['rows'] += rows
+            stats['vm_steps'] += vm_steps
+            if statement_seconds > stats['max_s']:
+                stats['max_s'] = statement_seconds
+
+    def report_slow(self, conn: sqlite3.Connection, sql: str, params, seconds: float, rows: int):
+        """Loguje wolne zapytanie wraz z planem wykonania"""
+        plan = []
+        if self.explain_slow and sql.lstrip().upper().startswith(_EXPLAINABLE):
+            try:
+                # Kursor bazowy - bez ponownego śledzenia samego EXPLAIN
+                cursor = sqlite3.Cursor(conn)
+                self._local.suppress = True
+                try:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                    plan = [row[3] for row in cursor.fetchall()]
+                finally:
+                    self._local.suppress = False
+                    cursor.close()
+            except sqlite3.Error as e:
+                plan = [f"(brak planu: {e})"]
+
+        entry = {
+            'sql': self.shape(sql),
+            'ms': round(seconds * 1000, 3),
+            'rows': rows,
+            'plan': plan,
+        }
+        self.slow_queries.append(entry)
+        logger.warning(
+            "Wolne zapytanie SQL (%.1f ms, %d wierszy): %s\n  Plan: %s",
+            entry['ms'], rows, entry['sql'], " | ".join(plan) if plan else "-"
+        )
+
+    def summary(self) -> List[Dict]:
+        """
+        Statystyki posortowane malejąco po łącznym czasie
+
+        Returns:
+            Lista słowników: sql, calls, total_ms, mean_ms, max_ms, rows, vm_steps
+        """
+        with self._lock:
+            items = [(shape, dict(stats)) for shape, stats in self._stats.items()]
+        result = [{
+            'sql': shape,
+            'calls': stats['calls'],
+            'total_ms': round(stats['total_s'] * 1000, 3),
+            'mean_ms': round(stats['total_s'] * 1000 / stats['calls'], 3) if stats['calls'] else 0.0,
+            'max_ms': round(stats['max_s'] * 1000, 3),
+            'rows': stats['rows'],
+            'vm_steps': stats['vm_steps'],
+        } for shape, stats in items]
+        result.sort(key=lambda s: s['total_ms'], reverse=True)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+        self.slow_queries.clear()
+
+    def _on_trace(self, statement: str):
+        """Callback sqlite3 - zlicza instrukcje niewidoczne dla kursora (np. niejawny BEGIN)"""
+        if getattr(self._local, 'suppress', False):
+            return
+        self.record(self.shape(statement))
+
+
+class TracedConnection(sqlite3.Connection):
+    """Połączenie SQLite, którego kursory są śledzone przez SQLTracer"""
+
+    tracer: Optional[SQLTracer] = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.current_statement: Optional[Dict] = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TracedCursor)
+
+    def commit(self):
+        tracer = self.tracer
+        if tracer is None:
+            return super().commit()
+        tracer._local.suppress = True
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            tracer._local.suppress = False
+            tracer.record('COMMIT', time.perf_counter() - start)
+
+    def on_progress(self) -> int:
+        """Progress handler - kroki VM przypisywane do wykonywanej instrukcji"""
+        if self.current_statement is not None:
+            self.current_statement['vm_steps'] += PROGRESS_STEP
+        return 0
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Kursor mierzący czas wykonania i pobierania wierszy każdej instrukcji"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statement: Optional[Dict] = None
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters, many=True)
+
+    def fetchone(self):
+        return self._fetch(super().fetchone, single=True)
+
+    def fetchmany(self, size=None):
+        return self._fetch(lambda: super(TracedCursor, self).fetchmany(size or self.arraysize))
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def _run(self, method, sql, parameters, many=False):
+        tracer = self.connection.tracer
+        if tracer is None:
+            return method(sql, parameters)
+
+        statement = {'sql': sql, 'params': None if many else parameters, 'seconds': 0.0,
+                     'rows': 0, 'vm_steps': 0, 'reported': False}
+        self._statement = statement
+        self.connection.current_statement = statement
+        tracer._local.suppress = True
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            statement['seconds'] = time.perf_counter() - start
+            tracer._local.suppress = False
+            if self.rowcount > 0:
+                statement['rows'] = self.rowcount
+            tracer.record(tracer.shape(sql), statement['seconds'], statement['rows'], statement['vm_steps'])
+            statement['vm_steps'] = 0
+            # Zapytania zwracające wiersze są oceniane dopiero przy pobieraniu
+            if self.description is None:
+                self._check_slow(tracer, statement)
+
+    def _fetch(self, method, single=False):
+        tracer = self.connection.tracer
+        statement = self._statement
+        if tracer is None or statement is None:
+            return method()
+
+        self.connection.current_statement = statement
+        start = time.perf_counter()
+        result = method()
+        seconds = time.perf_counter() - start
+        rows = (1 if result is not None else 0) if single else len(result)
+
+        statement['seconds'] += seconds
+        statement['rows'] += rows
+        # Pobieranie wierszy dolicza czas i wiersze do tego samego kształtu (bez nowego wykonania)
+        tracer.record(tracer.shape(statement['sql']), seconds, rows, statement['vm_steps'],
+                      calls=0, statement_seconds=statement['seconds'])
+        statement['vm_steps'] = 0
+        self._check_slow(tracer, statement)
+        return result
+
+    def _check_slow(self, tracer: SQLTracer, statement: Dict):
+        if not statement['reported'] and statement['seconds'] * 1000 >= tracer.slow_query_ms:
+            statement['reported'] = True
+            params = statement['params'] if statement['params'] is not None else ()
+            tracer.report_slow(self.connection, statement['sql'], params,
+                               statement['seconds'], statement['rows'])
@@ -306,6 +306,1939 @@ def test_integration():
     print("\n✅ TEST 4 ZAKOŃCZONY POMYŚLNIE\n")
     return True
 
+def test_lazy_startup():
+    """Test zimnego startu - ciężkie moduły nie mogą być ładowane przy imporcie main"""
+    print("=" * 60)
+    print("TEST 5: Leniwe ładowanie modułów przy starcie")
+    print("=" * 60)
+    
+    # Budżet czasu startu sprawdza benchmarks/startup_importtime.py (zależny od obciążenia maszyny)
+    from benchmarks.startup_importtime import measure_startup
+    
+    result = measure_startup('main', runs=2)
+    print(f"\n✓ Import main: {result['cumulative_ms']:.1f} ms")
+    
+    assert result['heavy_modules'] == [], f"Załadowano przy starcie: {result['heavy_modules']}"
+    print("  ✓ pandas, reportlab i python-docx nie są ładowane przy starcie")
+    
+    print("\n✅ TEST 5 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_import_preview():
+    """Test podglądu pliku - czytanie tylko początku pliku"""
+    print("=" * 60)
+    print("TEST 6: Podgląd pliku importu")
+    print("=" * 60)
+    
+    importer = DataImporter()
+    
+    # CSV ze średnikiem, bez znaku nowej linii na końcu
+    test_csv = "test_preview.csv"
+    with open(test_csv, "w", encoding="utf-8") as f:
+        f.write("Nr;Opis;J.m.;Cena zakupu netto;Vat\n")
+        f.write("\n".join(f"P{i:04d};Produkt {i};szt.;{i}.50;23%" for i in range(1000)))
+    
+    assert importer.detect_csv_separator(test_csv) == ';'
+    result = importer.validate_import_file(test_csv)
+    assert result['valid'] == True
+    assert result['total_rows'] == 1000
+    assert len(result['preview']) == 5
+    assert result['columns'] == ['Nr', 'Opis', 'J.m.', 'Cena zakupu netto', 'Vat']
+    assert result['preview'][0]['Nr'] == 'P0000'
+    print(f"  ✓ CSV: {result['message']}, podgląd {len(result['preview'])} wierszy")
+    
+    # Separator: średnik w polu w cudzysłowach, przecinki dziesiętne, jedna kolumna
+    for content, separator in [
+        ('Kod,Nazwa,"Uwagi; dodatkowe"\nA,Śruba,x\nB,Nakrętka,y\n', ','),
+        ('Kod,Nazwa,Cena\nA,"Śruba; M8",1.5\nB,Nakrętka,2\n', ','),
+        ('Kod;Nazwa;Cena\nA;"Śruba, M8";1,50\nB;Nakrętka;2,75\n', ';'),
+        ('Nazwa\nŚruba\nNakrętka\n', ','),
+    ]:
+        with open(test_csv, "w", encoding="utf-8") as f:
+            f.write(content)
+        assert importer.detect_csv_separator(test_csv) == separator, content
+    print("  ✓ Wykrywanie separatora CSV")
+    os.remove(test_csv)
+    
+    # XLSX czytany strumieniowo (openpyxl read-only)
+    from openpyxl import Workbook
+    test_xlsx = "test_preview.xlsx"
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Indeks", "Nazwa", "Jednostka", "Cena zakupu", "VAT"])
+    for i in range(200):
+        ws.append([f"X{i}", f"Towar {i}", "kg", 10.0 + i, "8%"])
+    wb.save(test_xlsx)
+    
+    result = importer.validate_import_file(test_xlsx, preview_rows=3)
+    assert result['valid'] == True
+    assert result['total_rows'] == 200
+    assert len(result['preview']) == 3
+    assert result['preview'][2]['Nazwa'] == 'Towar 2'
+    print(f"  ✓ XLSX: {result['message']}, podgląd {len(result['preview'])} wierszy")
+    os.remove(test_xlsx)
+    
+    # Pusty plik (sam nagłówek)
+    with open(test_csv, "w", encoding="utf-8") as f:
+        f.write("Nr;Opis\n")
+    assert importer.validate_import_file(test_csv)['valid'] == False
+    os.remove(test_csv)
+    print("  ✓ Pusty plik odrzucony")
+    
+    print("\n✅ TEST 6 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_streaming_import():
+    """Test strumieniowego importu XLSX/CSV partiami"""
+    print("=" * 60)
+    print("TEST 7: Strumieniowy import partiami")
+    print("=" * 60)
+    
+    from openpyxl import Workbook
+    importer = DataImporter()
+    
+    # Arkusz w trybie write-only z dodatkową kolumną i pustymi wierszami
+    test_xlsx = "test_stream.xlsx"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Cennik")
+    ws.append(["Nr", "Opis", "Podst. jednostka miary", "Ostatni koszt bezpośredni",
+               "Tow. grupa księgowa VAT", "Uwagi"])
+    for i in range(250):
+        ws.append([f"S{i:03d}", f"Produkt {i}", None, "12,50" if i == 0 else 10.0 + i, "23%", "x"])
+    ws.append([None, None, None, None, None, None])
+    wb.create_sheet("Inny arkusz").append(["nie", "importować"])
+    wb.save(test_xlsx)
+    
+    batches = list(importer.iter_product_batches(test_xlsx, category_id=7, batch_size=100))
+    assert [len(b) for b in batches] == [100, 100, 50]
+    first = batches[0][0]
+    assert first['code'] == 'S000'
+    assert first['unit'] == 'szt.'
+    assert first['purchase_price_net'] == 12.5
+    assert first['vat_rate'] == 23.0
+    assert first['category_id'] == 7
+    print(f"  ✓ XLSX: {sum(len(b) for b in batches)} produktów w {len(batches)} partiach")
+    
+    # import_from_file zwraca to samo w jednej liście
+    assert len(importer.import_from_file(test_xlsx)) == 250
+    os.remove(test_xlsx)
+    
+    # CSV - kody z zerami wiodącymi zostają tekstem
+    test_csv = "test_stream.csv"
+    with open(test_csv, "w", encoding="utf-8") as f:
+        f.write("Kod,Nazwa,Cena zakupu\n")
+        f.write("00123,Śruba,0.35\n")
+        f.write(",Pusty wiersz,1\n")
+        f.write("00124,Nakrętka,0.20\n")
+    products = importer.import_from_file(test_csv)
+    assert [p['code'] for p in products] == ['00123', '00124']
+    assert products[1]['purchase_price_net'] == 0.20
+    print("  ✓ CSV: kody z zerami wiodącymi, puste wiersze pominięte")
+    os.remove(test_csv)
+    
+    print("\n✅ TEST 7 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_multi_file_import():
+    """Test równoległego importu wielu plików z rozstrzyganiem konfliktów"""
+    print("=" * 60)
+    print("TEST 8: Import wielu plików naraz")
+    print("=" * 60)
+    
+    files = {
+        "test_multi_b.csv": "Nr;Opis;Cena zakupu netto\nA1;Produkt A z pliku B;20\nB1;Produkt B;5\n",
+        "test_multi_a.csv": "Nr;Opis;Cena zakupu netto\nA1;Produkt A z pliku A;10\nC1;Produkt C;7\n",
+        "test_multi_c.csv": "Opis;Cena\nBrak kolumny kodu;1\n",
+    }
+    for name, content in files.items():
+        with open(name, "w", encoding="utf-8") as f:
+            f.write(content)
+    
+    importer = DataImporter()
+    result = importer.import_from_files(list(files), category_id=None, max_workers=3)
+    
+    by_code = {p['code']: p for p in result['products']}
+    assert sorted(by_code) == ['A1', 'B1', 'C1']
+    # Pliki porządkowane po ścieżce - test_multi_b.csv wygrywa z test_multi_a.csv
+    assert by_code['A1']['name'] == 'Produkt A z pliku B'
+    assert by_code['A1']['purchase_price_net'] == 20.0
+    assert result['conflicts'] == 1
+    print(f"  ✓ Połączono {len(result['products'])} produktów, konflikty: {result['conflicts']}")
+    
+    per_file = {os.path.basename(f['file']): f for f in result['files']}
+    assert per_file['test_multi_a.csv']['rows'] == 2
+    assert per_file['test_multi_a.csv']['overridden'] == 1
+    assert per_file['test_multi_b.csv']['overridden'] == 0
+    assert per_file['test_multi_c.csv']['error'] is not None
+    print("  ✓ Statystyki per plik i błąd pliku bez kolumny kodu")
+    
+    # Zapis w jednej transakcji
+    test_db = "test_multi.db"
+    if os.path.exists(test_db):
+        os.remove(test_db)
+    db = Database(test_db)
+    added, updated, unchanged = db.import_products_batch(result['products'])
+    assert (added, updated, unchanged) == (3, 0, 0)
+    print("  ✓ Zapisano do bazy w jednej transakcji")
+    
+    del db
+    os.remove(test_db)
+    for name in files:
+        os.remove(name)
+    
+    print("\n✅ TEST 8 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_import_change_detection():
+    """Test pomijania niezmienionych wierszy i plików przy imporcie"""
+    print("=" * 60)
+    print("TEST 9: Wykrywanie zmian przy imporcie")
+    print("=" * 60)
+    
+    test_db = "test_hash.db"
+    if os.path.exists(test_db):
+        os.remove(test_db)
+    db = Database(test_db)
+    
+    products = [
+        {'code': f'H{i}', 'name': f'Produkt {i}', 'unit': 'szt.',
+         'purchase_price_net': 10.0 + i, 'vat_rate': 23.0, 'category_id': None}
+        for i in range(5)
+    ]
+    assert db.import_products_batch(products) == (5, 0, 0)
+    assert db.import_products_batch(products) == (0, 0, 5)
+    print("  ✓ Ponowny import tych samych danych nic nie zapisuje")
+    
+    products[0]['purchase_price_net'] = 99.0
+    products[1]['name'] = 'Nowa nazwa'
+    assert db.import_products_batch(products) == (0, 2, 3)
+    changed = {p['code']: p for p in db.get_products()}
+    assert changed['H0']['purchase_price_net'] == 99.0
+    assert changed['H1']['name'] == 'Nowa nazwa'
+    print("  ✓ Zapisywane są tylko zmienione wiersze")
+    
+    # Ręczna edycja między importami - import musi przywrócić dane z pliku
+    product_id = changed['H2']['id']
+    assert db.update_product(product_id, 'H2', 'Edytowany', 'szt.', 1.0, 23.0, None) == True
+    assert db.import_products_batch(products) == (0, 1, 4)
+    
+    # Wiersz bez zapisanego skrótu (stare dane) porównywany po treści
+    conn = sqlite3.connect(test_db)
+    conn.execute("UPDATE Products SET content_hash = NULL")
+    conn.commit()
+    conn.close()
+    assert db.import_products_batch(products) == (0, 0, 5)
+    print("  ✓ Edycje ręczne i wiersze bez skrótu obsłużone")
+    
+    # Skrót pliku
+    test_csv = "test_hash.csv"
+    with open(test_csv, "w", encoding="utf-8") as f:
+        f.write("Nr;Opis\nH0;Produkt 0\n")
+    digest = DataImporter.file_digest(test_csv)
+    assert db.is_file_imported(digest) == False
+    db.record_imported_file(digest, None, test_csv, 1)
+    assert db.is_file_imported(digest) == True
+    assert db.is_file_imported(digest, category_id=1) == False
+    with open(test_csv, "a", encoding="utf-8") as f:
+        f.write("H1;Produkt 1\n")
+    assert db.is_file_imported(DataImporter.file_digest(test_csv)) == False
+    print("  ✓ Niezmieniony plik rozpoznawany po skrócie")
+    
+    del db
+    os.remove(test_db)
+    os.remove(test_csv)
+    
+    print("\n✅ TEST 9 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_benchmark_harness():
+    """Test zestawu benchmarków - pomiar i wykrywanie regresji"""
+    print("=" * 60)
+    print("TEST 10: Benchmarki wydajnościowe")
+    print("=" * 60)
+    
+    from benchmarks.run_benchmarks import run_benchmarks, compare_results
+    
+    current = run_benchmarks(quick=True, keyword='calculate_price', include_startup=False, verbose=False)
+    assert list(current['results']) == ['calculate_price[10000]']
+    stats = current['results']['calculate_price[10000]']
+    assert 0 < stats['min_ms'] <= stats['median_ms']
+    print(f"  ✓ calculate_price[10000]: {stats['min_ms']:.2f} ms")
+    
+    # Wolniej o 100% niż linia bazowa - regresja; szybciej - brak regresji
+    slower = {'results': {'calculate_price[10000]': dict(stats, min_ms=stats['min_ms'] / 2)}}
+    faster = {'results': {'calculate_price[10000]': dict(stats, min_ms=stats['min_ms'] * 2)}}
+    assert compare_results(current, slower, tolerance=0.25, min_delta_ms=0)[0]['regression'] == True
+    assert compare_results(current, faster, tolerance=0.25, min_delta_ms=0)[0]['regression'] == False
+    print("  ✓ Porównanie z linią bazową wykrywa regresje")
+    
+    print("\n✅ TEST 10 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_instrumentation():
+    """Test instrumentacji - rejestr pomiarów, raporty i profilowanie"""
+    print("=" * 60)
+    print("TEST 11: Instrumentacja gorących ścieżek")
+    print("=" * 60)
+    
+    import json
+    import threading
+    import instrumentation
+    
+    test_db = "test_instr.db"
+    if os.path.exists(test_db):
+        os.remove(test_db)
+    db = Database(test_db)
+    
+    # Wyłączona instrumentacja niczego nie rejestruje
+    instrumentation.reset()
+    db.get_categories()
+    assert instrumentation.summary() == []
+    
+    instrumentation.enable()
+    try:
+        db.import_products_batch([
+            {'code': f'I{i}', 'name': f'Produkt {i}', 'unit': 'szt.',
+             'purchase_price_net': 1.0, 'vat_rate': 23.0} for i in range(10)
+        ])
+        for _ in range(3):
+            db.get_products()
+        with instrumentation.measure('test.block') as m:
+            m.rows = 42
+        
+        pdf_gen = PDFGenerator()
+        test_pdf = "test_instr.pdf"
+        offer_data = {'title': 'Test', 'items': [{
+            'name': 'Produkt', 'unit': 'szt.', 'quantity': 1, 'purchase_price_net': 10.0,
+            'vat_rate': 23.0, 'margin': 30.0, 'category_name': 'Test'}]}
+        assert pdf_gen.generate_offer_pdf(offer_data, test_pdf)
+        
+        stats = {s['name']: s for s in instrumentation.summary()}
+        assert stats['Database.get_products']['calls'] == 3
+        assert stats['Database.get_products']['rows'] == 30
+        assert stats['Database.import_products_batch']['rows'] == 10
+        assert stats['test.block']['rows'] == 42
+        assert stats['PDFGenerator.generate_offer_pdf']['bytes'] == os.path.getsize(test_pdf)
+        print(f"  ✓ Zarejestrowano {len(stats)} operacji (wywołania, wiersze, bajty)")
+        
+        instrumentation.dump_json("test_instr.json")
+        instrumentation.dump_csv("test_instr.csv")
+        with open("test_instr.json", encoding="utf-8") as f:
+            assert any(s['name'] == 'Database.get_products' for s in json.load(f))
+        print("  ✓ Raporty JSON i CSV zapisane")
+        
+        # Profilowanie obejmuje operacje z innych wątków
+        instrumentation.start_profiling()
+        worker = threading.Thread(target=db.search_products, args=("Produkt",))
+        worker.start()
+        worker.join()
+        report = instrumentation.stop_profiling("test_instr.prof")
+        assert 'search_products' in report
+        assert os.path.exists("test_instr.prof")
+        print("  ✓ Profil cProfile zapisany")
+        
+        # Profiler jeden na proces (Python 3.12+): równoległe operacje nie mogą się przerwać
+        import cProfile
+        active = []
+        class ProcessWideProfile(cProfile.Profile):
+            def enable(self, *args, **kwargs):
+                if active:
+                    raise ValueError("Another profiling tool is already active")
+                active.append(self)
+                super().enable(*args, **kwargs)
+            def disable(self):
+                super().disable()
+                if self in active:
+                    active.remove(self)
+        barrier = threading.Barrier(2)
+        @instrumentation.instrumented('test.parallel')
+        def parallel():
+            barrier.wait(timeout=5)
+            return True
+        real_profile = instrumentation.cProfile.Profile
+        real_mode = instrumentation._PROCESS_WIDE_PROFILER
+        instrumentation.cProfile.Profile = ProcessWideProfile
+        try:
+            for process_wide in (True, False):
+                instrumentation._PROCESS_WIDE_PROFILER = process_wide
+                instrumentation.start_profiling()
+                errors = []
+                def call():
+                    try:
+                        assert parallel()
+                    except Exception as e:
+                        errors.append(e)
+                threads = [threading.Thread(target=call) for _ in range(2)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                assert errors == [], errors
+                assert 'parallel' in instrumentation.stop_profiling()
+                barrier.reset()
+            # Wątek, któremu nie udało się włączyć profilera, jest profilowany później
+            @instrumentation.instrumented('test.single')
+            def single():
+                return True
+            instrumentation.start_profiling()
+            active.append(None)
+            assert single() and not instrumentation._local.profiling
+            active.clear()
+            assert single()
+            assert 'single' in instrumentation.stop_profiling()
+        finally:
+            instrumentation.cProfile.Profile = real_profile
+            instrumentation._PROCESS_WIDE_PROFILER = real_mode
+        print("  ✓ Równoległe operacje podczas profilowania kończą się bez błędu")
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+    
+    del db
+    for path in [test_db, test_pdf, "test_instr.json", "test_instr.csv", "test_instr.prof"]:
+        os.remove(path)
+    
+    print("\n✅ TEST 11 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_sql_trace():
+    """Test śledzenia zapytań SQL - kształty, agregacja i wolne zapytania"""
+    print("=" * 60)
+    print("TEST 12: Śledzenie zapytań SQL")
+    print("=" * 60)
+    
+    from sql_trace import normalize_sql
+    
+    assert normalize_sql("SELECT * FROM Products  WHERE code = 'A1' AND price > 10.5") == \
+        "SELECT * FROM Products WHERE code = ? AND price > ?"
+    assert normalize_sql("SELECT * FROM t WHERE id IN (?, ?, ?)") == "SELECT * FROM t WHERE id IN (?, ...)"
+    assert normalize_sql("SELECT col1 FROM t2") == "SELECT col1 FROM t2"
+    print("  ✓ Normalizacja tekstu zapytań")
+    
+    test_db = "test_sql_trace.db"
+    if os.path.exists(test_db):
+        os.remove(test_db)
+    
+    # Bez śledzenia połączenia są zwykłe
+    db = Database(test_db)
+    assert db.sql_tracer is None
+    assert type(db.get_connection()) is sqlite3.Connection
+    
+    tracer = db.enable_sql_trace(slow_query_ms=0.0)
+    db.import_products_batch([
+        {'code': f'S{i}', 'name': f'Produkt {i}', 'unit': 'szt.',
+         'purchase_price_net': 1.0, 'vat_rate': 23.0} for i in range(25)
+    ])
+    for code in ['S1', 'S2', 'S3']:
+        db.search_products(code)
+    
+    stats = {s['sql']: s for s in tracer.summary()}
+    insert = next(s for sql, s in stats.items() if sql.startswith('INSERT INTO Products'))
+    assert insert['calls'] == 25 and insert['rows'] == 25
+    search = next(s for sql, s in stats.items() if 'LIKE' in sql)
+    assert search['calls'] == 3
+    assert search['rows'] == 11 + 6 + 1  # S1 pasuje też do S10..S19, S2 do S20..S24
+    assert 'COMMIT' in stats
+    print(f"  ✓ Zebrano {len(stats)} kształtów zapytań")
+    
+    # Próg 0 ms - każde zapytanie jest wolne i ma plan wykonania
+    slow = [q for q in tracer.slow_queries if 'LIKE' in q['sql']]
+    assert slow and slow[-1]['plan'] and slow[-1]['rows'] == 1
+    print(f"  ✓ Wolne zapytania z planem: {slow[-1]['plan'][0]}")
+    
+    tracer.reset()
+    assert tracer.summary() == []
+    db.disable_sql_trace()
+    assert db.get_products() and db.sql_tracer is None
+    
+    del db
+    os.remove(test_db)
+    
+    print("\n✅ TEST 12 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_offer_server():
+    """Test lokalnego serwera HTTP - katalog, renderowanie, backpressure i metryki"""
+    print("=" * 60)
+    print("TEST 13: Serwer HTTP ofert")
+    print("=" * 60)
+    
+    import asyncio
+    import json
+    import urllib.error
+    import urllib.request
+    from offer_server import OfferServer
+    
+    test_db = "test_server.db"
+    if os.path.exists(test_db):
+        os.remove(test_db)
+    db = Database(test_db)
+    db.add_category("Serwerowa", 25.0)
+    category_id = next(c['id'] for c in db.get_categories() if c['name'] == "Serwerowa")
+    db.add_product("SRV1", "Produkt serwerowy", "szt.", 100.0, 23.0, category_id)
+    
+    offer_data = {'title': 'Oferta HTTP', 'items': [{
+        'name': 'Produkt serwerowy', 'unit': 'szt.', 'quantity': 2, 'purchase_price_net': 100.0,
+        'vat_rate': 23.0, 'margin': 25.0, 'category_name': 'Serwerowa'}]}
+    
+    def request(base, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(base + path, data=data, method='POST' if data else 'GET')
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+    
+    async def scenario():
+        server = OfferServer(test_db, port=0, workers=1, max_pending=1)
+        await server.start()
+        host, port = server.address
+        assert host == '127.0.0.1'
+        base = f"http://{host}:{port}"
+        loop = asyncio.get_running_loop()
+        call = lambda path, payload=None: loop.run_in_executor(None, request, base, path, payload)
+        try:
+            status, _, body = await call('/categories')
+            assert status == 200 and 'Serwerowa' in [c['name'] for c in json.loads(body)]
+            status, _, body = await call(f'/products?category_id={category_id}')
+            assert status == 200 and json.loads(body)[0]['code'] == 'SRV1'
+            status, _, body = await call('/products?q=serwer')
+            assert status == 200 and len(json.loads(body)) == 1
+            assert (await call('/products/999'))[0] == 404
+            assert (await call('/products?category_id=abc'))[0] == 400
+            print("  ✓ Zapytania katalogowe")
+            
+            status, headers, body = await call('/offers/pdf', offer_data)
+            assert status == 200 and headers['Content-Type'] == 'application/pdf'
+            assert body.startswith(b'%PDF')
+            status, _, body = await call('/offers/docx', offer_data)
+            assert status == 200 and body.startswith(b'PK')
+            assert (await call('/offers/pdf', {'items': [{'name': 'x'}]}))[0] == 400
+            print("  ✓ Renderowanie PDF i DOCX w puli procesów")
+            
+            # Jedno miejsce w kolejce - równoczesne żądania ponad limit dostają 503
+            results = await asyncio.gather(*[call('/offers/pdf', offer_data) for _ in range(3)])
+            statuses = sorted(r[0] for r in results)
+            assert statuses[0] == 200 and 503 in statuses
+            rejected = next(r for r in results if r[0] == 503)
+            assert rejected[1]['Retry-After'] == '1'
+            print(f"  ✓ Backpressure: {statuses}")
+            
+            status, _, body = await call('/metrics')
+            metrics = json.loads(body)
+            assert metrics['routes']['POST /offers/pdf']['requests'] == 5
+            assert metrics['render']['rejected'] == statuses.count(503)
+            assert metrics['render']['pending'] == 0
+            print(f"  ✓ Metryki: p95 renderowania PDF {metrics['routes']['POST /offers/pdf']['p95_ms']:.0f} ms")
+            
+            # Przekroczony czas - proces dalej renderuje i zajmuje miejsce w kolejce
+            from benchmarks import datagen
+            server.render_timeout = 0.05
+            assert (await call('/offers/pdf', datagen.make_offer_data(3000)))[0] == 504
+            assert server.metrics_snapshot()['render']['pending'] == 1
+            assert (await call('/offers/pdf', offer_data))[0] == 503
+            server.render_timeout = 120.0
+            for _ in range(600):
+                if server.metrics_snapshot()['render']['pending'] == 0:
+                    break
+                await asyncio.sleep(0.05)
+            assert (await call('/offers/pdf', offer_data))[0] == 200
+            print("  ✓ Porzucone renderowanie zwalnia miejsce dopiero po zakończeniu")
+            
+            # Awaria procesu roboczego - nowa pula dla kolejnych żądań
+            broken_pool = server._pool
+            for process in list(broken_pool._processes.values()):
+                process.kill()
+            status, _, body = await call('/offers/pdf', offer_data)
+            assert status == 500 and server._pool is not broken_pool
+            status, _, body = await call('/offers/pdf', offer_data)
+            assert status == 200 and body.startswith(b'%PDF')
+            assert server.metrics_snapshot()['render']['pending'] == 0
+            print("  ✓ Pula procesów odtworzona po awarii")
+        finally:
+            await server.stop()
+    
+    asyncio.run(scenario())
+    
+    del db
+    os.remove(test_db)
+    
+    print("\n✅ TEST 13 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_render_cache():
+    """Test pamięci podręcznej ofert - klucz treści, trafienia i usuwanie LRU"""
+    print("=" * 60)
+    print("TEST 14: Pamięć podręczna wygenerowanych ofert")
+    print("=" * 60)
+    
+    import shutil
+    from offer_rendering import render_offer_bytes
+    from render_cache import RenderCache
+    
+    cache_dir = "test_render_cache"
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    
+    item = {'name': 'Produkt', 'unit': 'szt.', 'quantity': 1, 'purchase_price_net': 10.0,
+            'vat_rate': 23.0, 'margin': 30.0, 'category_name': 'Test'}
+    offer_data = {'title': 'Oferta', 'date': '01.01.2025', 'items': [item]}
+    
+    # Kolejność kluczy i zapis liczb nie zmieniają klucza; marża, data i format - tak
+    same = {'items': [dict(reversed(list(item.items())), margin=30)], 'date': '01.01.2025', 'title': 'Oferta'}
+    key = RenderCache.offer_key(offer_data, 'pdf')
+    assert RenderCache.offer_key(same, 'pdf') == key
+    assert RenderCache.offer_key(offer_data, 'docx') != key
+    assert RenderCache.offer_key({**offer_data, 'date': '02.01.2025'}, 'pdf') != key
+    assert RenderCache.offer_key({**offer_data, 'items': [dict(item, margin=31.0)]}, 'pdf') != key
+    print("  ✓ Klucz zależy tylko od treści oferty")
+    
+    renders = []
+    
+    def render():
+        renders.append(1)
+        return render_offer_bytes(offer_data, 'pdf')
+    
+    cache = RenderCache(cache_dir)
+    first = cache.get_or_render(offer_data, 'pdf', render)
+    second = cache.get_or_render(same, 'pdf', render)
+    assert first == second and first.startswith(b'%PDF') and len(renders) == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['hit_rate'] == 0.5
+    
+    # Wpisy przetrwają ponowne utworzenie (np. restart aplikacji)
+    assert RenderCache(cache_dir).get(key) == first
+    print("  ✓ Ponowne generowanie bez renderowania")
+    
+    # Limit rozmiaru - usuwany jest najdawniej używany wpis
+    cache = RenderCache(cache_dir, max_bytes=250)
+    cache.clear()
+    cache.put('a.pdf', b'a' * 100)
+    cache.put('b.pdf', b'b' * 100)
+    assert cache.get('a.pdf') == b'a' * 100
+    cache.put('c.pdf', b'c' * 100)
+    assert cache.get('b.pdf') is None and cache.get('a.pdf') is not None
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['entries'] == 2 and stats['bytes'] == 200
+    assert sorted(os.listdir(cache_dir)) == ['a.pdf', 'c.pdf']
+    print(f"  ✓ Usuwanie LRU: {stats}")
+    
+    shutil.rmtree(cache_dir)
+    
+    print("\n✅ TEST 14 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_section_memoization():
+    """Test pamięci sekcji kategorii - po zmianie jednej ceny przebudowywana jest jedna sekcja"""
+    print("=" * 60)
+    print("TEST 15: Przyrostowe generowanie sekcji kategorii")
+    print("=" * 60)
+    
+    import zipfile
+    from reportlab import rl_config
+    from docx_generator import DOCXGenerator
+    from benchmarks import datagen
+    
+    offer_data = datagen.make_offer_data(200, n_categories=10)
+    invariant = rl_config.invariant
+    rl_config.invariant = 1  # Powtarzalne bajty PDF (bez dat i losowego ID)
+    try:
+        for name, gen_class, method in [("PDF", PDFGenerator, 'generate_offer_pdf'),
+                                        ("DOCX", DOCXGenerator, 'generate_offer_docx')]:
+            ext = name.lower()
+            gen = gen_class()
+            assert getattr(gen, method)(offer_data, f"test_sections_a.{ext}")
+            assert gen.section_cache.stats() == {'hits': 0, 'misses': 10, 'entries': 10}
+            
+            # Zmiana marży jednej pozycji - tylko jej kategoria jest budowana od nowa
+            offer_data['items'][3]['margin'] += 5
+            assert getattr(gen, method)(offer_data, f"test_sections_b.{ext}")
+            stats = gen.section_cache.stats()
+            assert stats['hits'] == 9 and stats['misses'] == 11
+            
+            # Wynik identyczny z dokumentem zbudowanym od zera
+            assert getattr(gen_class(), method)(offer_data, f"test_sections_c.{ext}")
+            if ext == 'pdf':
+                read = lambda path: open(path, 'rb').read()
+            else:
+                read = lambda path: zipfile.ZipFile(path).read('word/document.xml')
+            assert read(f"test_sections_b.{ext}") == read(f"test_sections_c.{ext}")
+            offer_data['items'][3]['margin'] -= 5
+            print(f"  ✓ {name}: 9 z 10 sekcji z pamięci, wynik zgodny z pełnym generowaniem")
+            
+            for suffix in "abc":
+                os.remove(f"test_sections_{suffix}.{ext}")
+    finally:
+        rl_config.invariant = invariant
+    
+    print("\n✅ TEST 15 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_stream_output():
+    """Test wyjścia generatorów do strumieni - BytesIO, strumień bez seek, metadane"""
+    print("=" * 60)
+    print("TEST 16: Generowanie ofert do strumieni")
+    print("=" * 60)
+    
+    import io
+    import zipfile
+    from docx_generator import DOCXGenerator
+    from offer_rendering import render_offer_bytes
+    
+    class WriteOnlyStream:
+        """Strumień bez seek/tell - jak gniazdo lub potok"""
+        def __init__(self):
+            self.chunks = []
+        def write(self, data):
+            self.chunks.append(bytes(data))
+            return len(data)
+    
+    offer_data = {'title': 'Strumień', 'date': '01.01.2025', 'items': [{
+        'name': 'Produkt', 'unit': 'szt.', 'quantity': 1, 'purchase_price_net': 10.0,
+        'vat_rate': 23.0, 'margin': 30.0, 'category_name': 'Test'}]}
+    
+    for gen, method, magic in [(PDFGenerator(), 'render_offer_pdf', b'%PDF'),
+                               (DOCXGenerator(), 'render_offer_docx', b'PK')]:
+        render = getattr(gen, method)
+        
+        buffer = io.BytesIO(b'naglowek')
+        buffer.seek(0, io.SEEK_END)
+        meta = render(offer_data, buffer)
+        assert meta['bytes'] == len(buffer.getvalue()) - len(b'naglowek')
+        assert buffer.getvalue()[len(b'naglowek'):].startswith(magic)
+        assert meta['items'] == 1 and meta['seconds'] > 0 and 'path' not in meta
+        
+        stream = WriteOnlyStream()
+        meta = render(offer_data, stream)
+        content = b''.join(stream.chunks)
+        assert content.startswith(magic) and meta['bytes'] == len(content)
+        if magic == b'PK':
+            assert 'word/document.xml' in zipfile.ZipFile(io.BytesIO(content)).namelist()
+        
+        path = os.path.join("test_stream_out", f"oferta.{meta['format']}")
+        meta = render(offer_data, path)
+        assert meta['path'] == path and meta['bytes'] == os.path.getsize(path)
+        os.remove(path)
+        print(f"  ✓ {meta['format'].upper()}: BytesIO, strumień bez seek i plik ({meta['bytes']} B)")
+    os.rmdir("test_stream_out")
+    
+    try:
+        PDFGenerator().render_offer_pdf(offer_data, 123)
+        assert False, "Oczekiwano TypeError"
+    except TypeError:
+        pass
+    
+    # Błąd generatora: wyjątek z render_*, False z generate_*
+    broken = {'items': [{'name': 'Bez ceny', 'category_name': 'Test'}]}
+    assert PDFGenerator().generate_offer_pdf(broken, "test_broken.pdf") is False
+    try:
+        render_offer_bytes(broken, 'docx')
+        assert False, "Oczekiwano RuntimeError"
+    except RuntimeError:
+        pass
+    print("  ✓ Błędy zgłaszane wyjątkiem, generate_* zwracają False")
+    
+    # Błąd budowy PDF nie zostawia niepełnego pliku ani nie nadpisuje poprzedniego
+    failing = PDFGenerator()
+    def broken_watermark(canvas_obj, doc):
+        raise RuntimeError("test")
+    failing.add_watermark = broken_watermark
+    assert failing.generate_offer_pdf(offer_data, "test_failed.pdf") is False
+    assert not os.path.exists("test_failed.pdf")
+    with open("test_failed.pdf", "wb") as f:
+        f.write(b'poprzednia oferta')
+    stream = WriteOnlyStream()
+    assert failing.generate_offer_pdf(offer_data, "test_failed.pdf") is False
+    try:
+        failing.render_offer_pdf(offer_data, stream)
+        assert False, "Oczekiwano RuntimeError"
+    except RuntimeError:
+        pass
+    with open("test_failed.pdf", "rb") as f:
+        assert f.read() == b'poprzednia oferta'
+    assert stream.chunks == []
+    os.remove("test_failed.pdf")
+    print("  ✓ Nieudana budowa PDF nie zapisuje niepełnego dokumentu")
+    
+    print("\n✅ TEST 16 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_multi_format_rendering():
+    """Test wspólnego modelu układu i renderowania wielu formatów naraz"""
+    print("=" * 60)
+    print("TEST 17: Model układu i renderowanie PDF/DOCX/XLSX/CSV")
+    print("=" * 60)
+    
+    import csv
+    import io
+    from openpyxl import load_workbook
+    from offer_layout import build_layout
+    from offer_rendering import FORMATS, render_offer_formats
+    
+    offer_data = {'title': 'Wiele formatów', 'date': '01.01.2025', 'items': [
+        {'name': 'Piwo', 'unit': 'szt.', 'quantity': 2, 'purchase_price_net': 10.0,
+         'vat_rate': 23.0, 'margin': 50.0, 'category_name': 'Piwa'},
+        {'name': 'Wino', 'unit': 'but.', 'quantity': 1, 'purchase_price_net': 20.0,
+         'vat_rate': 8.0, 'margin': 25.0, 'category_name': 'Alkohole'},
+        {'name': 'Cydr', 'unit': 'szt.', 'quantity': 3, 'purchase_price_net': 5.0,
+         'vat_rate': 23.0, 'margin': 20.0, 'category_name': 'Piwa'},
+    ]}
+    
+    layout = build_layout(offer_data)
+    assert [s['category'] for s in layout['sections']] == ['Alkohole', 'Piwa']
+    assert layout['sections'][1]['rows'][0] == ('Piwo', '15.00', 'zł/szt.', '23%', '18.45 zł')
+    assert layout['totals'] == {'items': 3, 'net': 73.0, 'vat': 13.04, 'gross': 86.04, 'by_vat': [
+        {'vat_rate': 8.0, 'items': 1, 'net': 25.0, 'vat': 2.0, 'gross': 27.0},
+        {'vat_rate': 23.0, 'items': 2, 'net': 48.0, 'vat': 11.04, 'gross': 59.04},
+    ]}
+    print(f"  ✓ Model: {len(layout['sections'])} sekcje, suma brutto {layout['totals']['gross']} zł")
+    
+    outputs = {fmt: io.BytesIO() for fmt in FORMATS}
+    results = render_offer_formats(offer_data, outputs)
+    assert set(results) == set(FORMATS)
+    for fmt, meta in results.items():
+        assert 'error' not in meta, meta
+        assert meta['bytes'] == len(outputs[fmt].getvalue()) > 0 and meta['items'] == 3
+    assert outputs['pdf'].getvalue().startswith(b'%PDF')
+    
+    ws = load_workbook(io.BytesIO(outputs['xlsx'].getvalue())).active
+    values = [row for row in ws.iter_rows(values_only=True)]
+    assert ('Piwo', 15.0, 'zł/szt.', 0.23, 18.45) in values
+    
+    text = outputs['csv'].getvalue().decode('utf-8-sig')
+    rows = list(csv.reader(io.StringIO(text), delimiter=';'))
+    assert rows[0][0] == 'Kategoria' and len(rows) == 4
+    assert rows[1] == ['Alkohole', 'Wino', '25,00', 'zł/but.', '8%', '27,00']
+    print(f"  ✓ Formaty {', '.join(FORMATS)} z jednego modelu")
+    
+    # Błąd jednego formatu nie przerywa pozostałych
+    results = render_offer_formats(offer_data, {'pdf': io.BytesIO(), 'csv': 123})
+    assert 'error' in results['csv'] and results['pdf']['bytes'] > 0
+    try:
+        render_offer_formats(offer_data, {'odt': io.BytesIO()})
+        assert False, "Oczekiwano ValueError"
+    except ValueError:
+        pass
+    print("  ✓ Błędy zgłaszane per format")
+    
+    # Aplikacja: PDF i DOCX z jednego modelu układu, ponowny zapis z pamięci podręcznej
+    import shutil
+    import types
+    import offer_layout
+    from main import OfertomatApp
+    from pdf_generator import PDFGenerator
+    from docx_generator import DOCXGenerator
+    from render_cache import RenderCache
+    app = types.SimpleNamespace(render_cache=RenderCache("test_formats_cache"),
+                                pdf_gen=PDFGenerator(), docx_gen=DOCXGenerator())
+    app.render_cache.clear()
+    builds = []
+    original_build = offer_layout.build_layout
+    offer_layout.build_layout = lambda data: builds.append(1) or original_build(data)
+    try:
+        paths = {'pdf': "test_formats.pdf", 'docx': "test_formats.docx"}
+        assert OfertomatApp.write_offer_files(app, offer_data, paths) == {'pdf': True, 'docx': True}
+        assert len(builds) == 1
+        assert OfertomatApp.write_offer_files(app, offer_data, paths) == {'pdf': True, 'docx': True}
+        assert len(builds) == 1 and app.render_cache.hits == 2
+        with open("test_formats.pdf", "rb") as f:
+            assert f.read().startswith(b'%PDF')
+    finally:
+        offer_layout.build_layout = original_build
+    for path in paths.values():
+        os.remove(path)
+    shutil.rmtree("test_formats_cache")
+    print("  ✓ Oferta z aplikacji: jeden model układu dla PDF i DOCX")
+    
+    print("\n✅ TEST 17 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_spreadsheet_streaming():
+    """Test strumieniowego eksportu XLSX/CSV - arkusze kategorii i stała pamięć"""
+    print("=" * 60)
+    print("TEST 18: Strumieniowy eksport XLSX i CSV")
+    print("=" * 60)
+    
+    import io
+    import tracemalloc
+    from openpyxl import load_workbook
+    from benchmarks import datagen
+    from offer_layout import build_layout
+    from spreadsheet_generator import SpreadsheetGenerator
+    
+    # Nazwy arkuszy: znaki niedozwolone, długość, powtórzenia
+    used = {'Oferta'}
+    assert SpreadsheetGenerator.sheet_title('Piwa/Wina [promocja]', used) == 'Piwa_Wina _promocja_'
+    assert SpreadsheetGenerator.sheet_title('oferta', used) == 'oferta (2)'
+    long_title = SpreadsheetGenerator.sheet_title('K' * 40, used)
+    assert long_title == 'K' * 31
+    assert SpreadsheetGenerator.sheet_title('K' * 35, used) == 'K' * 27 + ' (2)'
+    print("  ✓ Nazwy arkuszy zgodne z ograniczeniami Excela")
+    
+    offer_data = datagen.make_offer_data(300, n_categories=4)
+    layout = build_layout(offer_data)
+    buffer = io.BytesIO()
+    meta = SpreadsheetGenerator(sheet_per_category=True).render_offer_xlsx(offer_data, buffer)
+    wb = load_workbook(buffer)
+    assert wb.sheetnames == ['Oferta'] + [s['category'] for s in layout['sections']]
+    for section in layout['sections']:
+        rows = list(wb[section['category']].iter_rows(values_only=True))
+        assert len(rows) == len(section['items']) + 1
+        assert rows[1][4] == section['items'][0]['gross_unit']
+    summary = list(wb['Oferta'].iter_rows(values_only=True))
+    assert ('Razem', 300, layout['totals']['net'], layout['totals']['gross']) == summary[-3][:4]
+    assert wb[layout['sections'][0]['category']]['E2'].number_format == '0.00 "zł"'
+    assert meta['items'] == 300 and meta['bytes'] == len(buffer.getvalue())
+    print(f"  ✓ Arkusz na kategorię: {len(wb.sheetnames)} arkuszy")
+    
+    # Pamięć nie rośnie z liczbą pozycji (model układu zbudowany wcześniej)
+    gen = SpreadsheetGenerator()
+    gen.render_offer_xlsx(offer_data, io.BytesIO(), layout=layout)  # rozgrzewka importów
+    big_data = datagen.make_offer_data(4000)
+    big_layout = build_layout(big_data)
+    for fmt in ('xlsx', 'csv'):
+        tracemalloc.start()
+        try:
+            getattr(gen, f'render_offer_{fmt}')(big_data, io.BytesIO(), layout=big_layout)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < 3 * 1024 * 1024, f"{fmt}: {peak} B"
+        print(f"  ✓ {fmt.upper()} 4000 pozycji: szczyt pamięci {peak / 1024:.0f} KB")
+    
+    print("\n✅ TEST 18 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_bulk_repricing():
+    """Test zbiorczej zmiany cen - filtry, zaokrąglanie, podgląd i historia cen"""
+    print("=" * 60)
+    print("TEST 19: Zbiorcza zmiana cen zakupu")
+    print("=" * 60)
+    
+    db_path = "test_reprice.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = Database(db_path)
+    db.add_category("Dostawca A", 20.0)
+    db.add_category("Dostawca B", 30.0)
+    categories = {c['name']: c['id'] for c in db.get_categories()}
+    products = [
+        {'code': 'A-001', 'name': 'Śruba', 'unit': 'szt.', 'purchase_price_net': 10.0,
+         'vat_rate': 23.0, 'category_id': categories['Dostawca A']},
+        {'code': 'A-002', 'name': 'Nakrętka', 'unit': 'szt.', 'purchase_price_net': 4.5,
+         'vat_rate': 23.0, 'category_id': categories['Dostawca A']},
+        {'code': 'A_003', 'name': 'Podkładka', 'unit': 'szt.', 'purchase_price_net': 2.0,
+         'vat_rate': 23.0, 'category_id': categories['Dostawca A']},
+        {'code': 'B-001', 'name': 'Kabel', 'unit': 'm', 'purchase_price_net': 100.0,
+         'vat_rate': 8.0, 'category_id': categories['Dostawca B']},
+    ]
+    db.import_products_batch(products)
+    prices = lambda: {p['code']: p['purchase_price_net'] for p in db.get_products()}
+    
+    # Podgląd - agregaty bez zmian w bazie
+    preview = db.reprice_products(10, dry_run=True)
+    assert preview['applied'] is False and preview['products'] == 4
+    assert preview['old_total'] == 116.5 and preview['new_total'] == 128.15
+    assert [c['products'] for c in preview['categories']] == [3, 1]
+    assert prices()['B-001'] == 100.0
+    print(f"  ✓ Podgląd: {preview['products']} produktów, {preview['old_total']} -> {preview['new_total']} zł")
+    
+    # Prefiks kodu: '_' dosłownie, nie jako znak wieloznaczny
+    result = db.reprice_products(10, code_prefix='A-', category_ids=[categories['Dostawca A']])
+    assert result['applied'] and result['products'] == 2
+    assert prices() == {'A-001': 11.0, 'A-002': 4.95, 'A_003': 2.0, 'B-001': 100.0}
+    assert db.reprice_products(10, code_prefix='A_', dry_run=True)['products'] == 1
+    print("  ✓ Filtry: kategoria i prefiks kodu")
+    
+    # Reguły zaokrąglania i pominięcie cen bez zmiany
+    db.reprice_products(-1, code_prefix='B', rounding='ending_99')
+    assert prices()['B-001'] == 99.99
+    assert db.reprice_products(0.001, code_prefix='B')['products'] == 0
+    db.reprice_products(3, name_query='Podkład', rounding='whole')
+    assert prices()['A_003'] == 2.0
+    print("  ✓ Zaokrąglanie (grosze, całe złote, końcówka ,99)")
+    
+    # Historia cen i wyzerowany skrót (import liczy go ponownie)
+    cable = db.search_products('B-001')[0]
+    assert cable['content_hash'] is None
+    history = db.get_price_history(cable['id'])
+    assert [(h['old_price'], h['new_price']) for h in history] == [(100.0, 99.99)]
+    assert history[0]['reason'] == 'Zmiana cen o -1%'
+    cable_row = {**products[3], 'purchase_price_net': 99.99}
+    assert db.import_products_batch([cable_row]) == (0, 0, 1)
+    print("  ✓ Historia cen zapisana, import rozpoznaje niezmienione produkty")
+    
+    for bad in ({'percent': -100}, {'percent': 5, 'rounding': 'nieznana'}):
+        try:
+            db.reprice_products(**bad)
+            assert False, "Oczekiwano ValueError"
+        except ValueError:
+            pass
+    
+    os.remove(db_path)
+    print("\n✅ TEST 19 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_write_queue():
+    """Test kolejki zapisów - paczki transakcji, SAVEPOINT, obsługa blokad, wiele procesów"""
+    print("=" * 60)
+    print("TEST 20: Kolejka zapisów i równoległy dostęp do bazy")
+    print("=" * 60)
+    
+    import sqlite3
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from db_writer import BusyPolicy
+    from benchmarks.contention import run_contention
+    
+    db_path = "test_writer.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = Database(db_path, busy_policy=BusyPolicy(attempts=8, busy_timeout=0.05, base_delay=0.02))
+    
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+    
+    # Zapisy z wielu wątków łączone w paczki; duplikat cofa tylko własny SAVEPOINT
+    names = [f"Kategoria {i}" for i in range(60)] + ["Kategoria 5"]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda name: db.add_category(name, 10.0), names))
+    assert results.count(False) == 1 and results.count(True) == 60
+    assert len(db.get_categories()) == 61
+    stats = db.writer.snapshot()
+    assert stats['requests'] == 61 and stats['batches'] < stats['requests']
+    print(f"  ✓ {stats['requests']} zapisów w {stats['batches']} transakcjach, duplikat odrzucony")
+    
+    # Zagnieżdżona operacja wykonuje się w tej samej transakcji
+    def nested(cursor):
+        db.add_category("Zagnieżdżona", 5.0)
+        return db.write(lambda c: c.execute("SELECT COUNT(*) FROM Categories").fetchone()[0])
+    assert db.write(nested) == 62
+    
+    # Baza zablokowana przez inny proces: czytelnicy działają, zapis czeka i się udaje
+    locker = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    locker.execute('BEGIN IMMEDIATE')
+    released = threading.Timer(0.3, lambda: locker.execute('COMMIT'))
+    released.start()
+    assert len(db.get_categories()) == 62
+    assert db.update_category(db.get_categories()[0]['id'], "Po blokadzie", 12.0)
+    released.join()
+    locker.close()
+    assert db.writer.snapshot()['busy_retries'] > 0
+    print(f"  ✓ Blokada innego procesu: {db.writer.snapshot()['busy_retries']} ponowień, odczyty bez czekania")
+    
+    # Trwała blokada - po wyczerpaniu ponowień błąd trafia do wywołującego
+    locker = sqlite3.connect(db_path, isolation_level=None)
+    locker.execute('BEGIN IMMEDIATE')
+    try:
+        db.add_category("Nie przejdzie", 1.0)
+        assert False, "Oczekiwano OperationalError"
+    except sqlite3.OperationalError as e:
+        assert 'locked' in str(e)
+    finally:
+        locker.execute('ROLLBACK')
+        locker.close()
+    db.close()
+    os.remove(db_path)
+    print("  ✓ Trwała blokada zgłaszana po wyczerpaniu ponowień")
+    
+    # Wiele procesów i import w tle - bez błędów i utraconych zapisów
+    summary = run_contention("test_contention.db", processes=2, threads=2, ops=25,
+                             products=300, import_rounds=1, import_size=300)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists("test_contention.db" + suffix):
+            os.remove("test_contention.db" + suffix)
+    assert summary['errors'] == 0 and summary['lost_writes'] == 0
+    writes = summary['kinds']['write']
+    print(f"  ✓ 2 procesy + import: {summary['throughput_ops_s']} op/s, "
+          f"zapis p99 {writes['p99_ms']} ms")
+    
+    print("\n✅ TEST 20 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_async_database():
+    """Test asynchronicznej fasady bazy - korutyny, responsywność pętli, anulowanie"""
+    print("=" * 60)
+    print("TEST 21: AsyncDatabase dla obsługi zdarzeń async")
+    print("=" * 60)
+    
+    import asyncio
+    import sqlite3
+    import time
+    from async_database import AsyncDatabase
+    
+    db_path = "test_async.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = Database(db_path)
+    adb = AsyncDatabase(db)
+    interrupted = []
+    
+    def slow_query():
+        """Zapytanie liczone kilka sekund (rekurencyjne CTE)"""
+        conn = db.get_connection()
+        try:
+            return conn.execute('''
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000)
+                SELECT COUNT(*) FROM n
+            ''').fetchone()[0]
+        except sqlite3.OperationalError as e:
+            interrupted.append(str(e))
+            raise
+        finally:
+            conn.close()
+    
+    async def scenario():
+        # Każda metoda Database jako korutyna - zapis i odczyt
+        assert await adb.add_category("Async", 15.0) is True
+        assert await adb.add_category("Async", 15.0) is False
+        await adb.import_products_batch([
+            {'code': f'A{i}', 'name': f'Śruba {i}', 'unit': 'szt.', 'purchase_price_net': 1.0 + i,
+             'vat_rate': 23.0} for i in range(50)])
+        assert await adb.get_products() == db.get_products()
+        assert len(await adb.search_products('Śruba 1')) == 11
+        assert adb.product_content_hash is db.product_content_hash
+        print("  ✓ Metody Database dostępne jako korutyny")
+        
+        # Pętla zdarzeń działa w trakcie długiego zapytania; anulowanie je przerywa
+        ticks = 0
+        task = asyncio.ensure_future(adb.run(slow_query))
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert not task.done() and ticks == 10
+        start = time.perf_counter()
+        task.cancel()
+        try:
+            await task
+            assert False, "Oczekiwano CancelledError"
+        except asyncio.CancelledError:
+            pass
+        categories = await adb.get_categories()
+        assert len(categories) == 2
+        for _ in range(100):
+            if interrupted:
+                break
+            await asyncio.sleep(0.01)
+        assert interrupted and 'interrupt' in interrupted[0]
+        print(f"  ✓ Anulowanie przerwało zapytanie ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        
+        # Wyszukiwanie przy pisaniu - starsze zapytanie anulowane przez nowsze
+        first = asyncio.ensure_future(adb.latest('search', 'run', slow_query))
+        await asyncio.sleep(0.05)
+        second = await adb.latest('search', 'search_products', 'Śruba 2')
+        assert len(second) == 11
+        try:
+            await first
+            assert False, "Oczekiwano CancelledError"
+        except asyncio.CancelledError:
+            pass
+        print("  ✓ latest(): nowe wyszukiwanie anuluje poprzednie")
+    
+    asyncio.run(scenario())
+    adb.close()
+    db.close()
+    os.remove(db_path)
+    
+    print("\n✅ TEST 21 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_update_scheduler():
+    """Test łączenia odświeżeń interfejsu w jedno na klatkę"""
+    print("=" * 60)
+    print("TEST 22: UpdateScheduler - odświeżenia raz na klatkę")
+    print("=" * 60)
+    
+    import asyncio
+    import threading
+    import instrumentation
+    from ui_updates import UpdateScheduler
+    
+    class FakeConnection:
+        def __init__(self):
+            self.sent = []
+        
+        def send_commands(self, session_id, commands):
+            self.sent.append(commands)
+    
+    class FakeControl:
+        def __init__(self, name, page=None):
+            self.name = name
+            self.page = page
+    
+    class FakePage:
+        def __init__(self, loop):
+            self.loop = loop
+            self.connection = FakeConnection()
+            self.updates = []
+        
+        def update(self, *controls):
+            self.updates.append([c.name for c in controls])
+            targets = [c.name for c in controls] or ['page']
+            self.connection.send_commands('s1', [{'name': 'set', 'target': t} for t in targets])
+    
+    def table_refresh(ui, control):
+        ui.request(control)
+    
+    def view_switch(ui):
+        ui.request()
+    
+    async def scenario():
+        page = FakePage(asyncio.get_running_loop())
+        ui = UpdateScheduler(page, frame_seconds=0.01)
+        table = FakeControl('table', page)
+        status = FakeControl('status', page)
+        
+        # Wiele zgłoszeń w jednej klatce - jedno page.update()
+        for _ in range(20):
+            table_refresh(ui, table)
+        view_switch(ui)
+        assert page.updates == []
+        await asyncio.sleep(0.05)
+        assert page.updates == [[]]
+        print("  ✓ 21 zgłoszeń -> 1 pełne odświeżenie strony")
+        
+        # Same kontrolki - odświeżenie tylko ich
+        table_refresh(ui, table)
+        table_refresh(ui, status)
+        table_refresh(ui, table)
+        await asyncio.sleep(0.05)
+        assert page.updates[-1] == ['table', 'status']
+        print("  ✓ Zmienione kontrolki odświeżone bez pełnego porównania strony")
+        
+        # Kontrolka spoza strony wymaga pełnego odświeżenia
+        table_refresh(ui, FakeControl('new'))
+        await asyncio.sleep(0.05)
+        assert page.updates[-1] == []
+        
+        # Zgłoszenia z wątków obsługi zdarzeń trafiają do pętli strony
+        threads = [threading.Thread(target=table_refresh, args=(ui, status)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        await asyncio.sleep(0.05)
+        assert page.updates[-1] == ['status'] and len(page.updates) == 4
+        print("  ✓ Zgłoszenia z 8 wątków -> 1 odświeżenie")
+        
+        # Instrumentacja: funkcje zgłaszające, liczba poleceń i bajty
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            table_refresh(ui, table)
+            table_refresh(ui, status)
+            await asyncio.sleep(0.05)
+        finally:
+            instrumentation.disable()
+        stats = {s['name']: s for s in instrumentation.summary()}
+        record = stats['UI.update:table_refresh']
+        assert record['calls'] == 1 and record['rows'] == 2
+        assert record['bytes'] == len('[{"name":"set","target":"table"},{"name":"set","target":"status"}]')
+        instrumentation.reset()
+        
+        snapshot = ui.snapshot()
+        assert snapshot['requests'] == 35 and snapshot['flushes'] == 5
+        assert snapshot['page_updates'] == 2 and snapshot['coalesced'] == 30
+        print(f"  ✓ Statystyki: {snapshot}")
+    
+    asyncio.run(scenario())
+    
+    # Strona bez pętli zdarzeń - odświeżenie od razu
+    class NoLoopPage:
+        loop = None
+        
+        def __init__(self):
+            self.calls = 0
+        
+        def update(self, *controls):
+            self.calls += 1
+    
+    page = NoLoopPage()
+    UpdateScheduler(page).request()
+    assert page.calls == 1
+    print("  ✓ Bez pętli zdarzeń odświeżenie natychmiastowe")
+    
+    print("\n✅ TEST 22 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_offer_editor():
+    """Test wirtualizowanego edytora pozycji oferty"""
+    print("=" * 60)
+    print("TEST 23: Wirtualizowany edytor oferty")
+    print("=" * 60)
+    
+    import time
+    import flet as ft
+    from types import SimpleNamespace
+    from benchmarks import datagen
+    from offer_editor import OfferEditor, ROW_HEIGHT, OVERSCAN, visible_range, window_range
+    
+    # Zakresy wierszy
+    assert visible_range(0, 600, 5000) == (0, 13)
+    assert visible_range(ROW_HEIGHT * 100 + 5, 600, 5000) == (100, 113)
+    assert visible_range(0, 600, 5) == (0, 5)
+    assert window_range(ROW_HEIGHT * 100, 600, 5000) == (100 - OVERSCAN, 113 + OVERSCAN)
+    assert window_range(ROW_HEIGHT * 4995, 600, 5000) == (4995 - OVERSCAN, 5000)
+    print("  ✓ Zakres widocznych wierszy")
+    
+    items = datagen.make_offer_items(5000)
+    changes = []
+    updates = []
+    
+    def handler(key):
+        def handle(index, value):
+            changes.append((key, index, value))
+            if key == 'margin':
+                items[index]['margin'] = float(value)
+                editor.refresh_row(index)
+        return handle
+    
+    start = time.perf_counter()
+    editor = OfferEditor(items, {key: handler(key) for key in ('name', 'unit', 'margin', 'net', 'gross')},
+                         on_remove=lambda index: editor.remove(index),
+                         request_update=lambda *controls: updates.append(controls))
+    added = []
+    editor.control._build_add_commands(index={}, added_controls=added)
+    elapsed = (time.perf_counter() - start) * 1000
+    rows = editor.list_view.controls[1:-1]
+    assert len(rows) == 13 + OVERSCAN and (editor.start, editor.end) == (0, 23)
+    assert editor.bottom_spacer.height == (5000 - 23) * ROW_HEIGHT
+    assert not any(isinstance(c, ft.TextField) for c in added)
+    assert len(added) < 1000
+    print(f"  ✓ Otwarcie 5000 pozycji: {len(rows)} wierszy, {len(added)} kontrolek, {elapsed:.0f} ms")
+    
+    # Przewinięcie w obrębie utworzonych wierszy nie przebudowuje okna
+    updates.clear()
+    editor.on_scroll(SimpleNamespace(pixels=ROW_HEIGHT * 5, viewport_dimension=600))
+    assert updates == []
+    editor.on_scroll(SimpleNamespace(pixels=ROW_HEIGHT * 2000, viewport_dimension=600))
+    assert (editor.start, editor.end) == (2000 - OVERSCAN, 2013 + OVERSCAN)
+    assert editor.top_spacer.height == (2000 - OVERSCAN) * ROW_HEIGHT
+    assert updates == [(editor.list_view,)]
+    print("  ✓ Przewinięcie tworzy tylko nowe okno wierszy")
+    
+    # Edycja: pola tylko w edytowanym wierszu
+    editor.start_edit(2005)
+    fields = [c for c in editor.list_view.controls[1 + 2005 - editor.start].content.controls
+              if isinstance(getattr(c, 'content', None), ft.TextField)]
+    assert len(fields) == 5
+    assert sum(1 for row in editor.list_view.controls[1:-1]
+               for c in row.content.controls if isinstance(getattr(c, 'content', None), ft.TextField)) == 5
+    margin_field = editor._edit_fields['margin']
+    gross_field = editor._edit_fields['gross']
+    margin_field.value = '50'
+    editor._field_changed(SimpleNamespace(control=margin_field))
+    assert items[2005]['margin'] == 50.0
+    assert editor._edit_fields['margin'] is margin_field
+    expected = items[2005]['purchase_price_net'] * 1.5 * (1 + items[2005]['vat_rate'] / 100)
+    assert abs(float(gross_field.value) - expected) <= 0.01
+    print("  ✓ Pola edycji tylko dla jednego wiersza, ceny przeliczone w miejscu")
+    
+    # Usunięcie wiersza powyżej - zmiana pola trafia do właściwej pozycji
+    edited = items[2005]
+    editor.remove(2001)
+    assert len(items) == 4999 and editor.editing == 2004 and items[2004] is edited
+    editor._edit_fields['name'].value = 'Nowa nazwa'
+    editor._field_changed(SimpleNamespace(control=editor._edit_fields['name']))
+    assert changes[-1] == ('name', 2004, 'Nowa nazwa')
+    editor.stop_edit(2004)
+    assert editor.editing is None and editor._edit_fields == {}
+    print("  ✓ Usuwanie i kończenie edycji")
+    
+    editor.set_items(items[:3])
+    assert len(editor.list_view.controls) == 5 and editor.bottom_spacer.height == 0
+    
+    print("\n✅ TEST 23 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_offer_totals():
+    """Test sum oferty aktualizowanych przyrostowo"""
+    print("=" * 60)
+    print("TEST 24: Sumy oferty per kategoria i stawka VAT")
+    print("=" * 60)
+    
+    import io
+    import random
+    from docx import Document
+    from benchmarks import datagen
+    from offer_layout import build_layout
+    from offer_totals import OfferTotals
+    from pdf_generator import PDFGenerator
+    from docx_generator import DOCXGenerator
+    
+    items = datagen.make_offer_items(2000, n_categories=12)
+    totals = OfferTotals(items)
+    rng = random.Random(7)
+    
+    # Losowe zmiany marż i usunięcia - wynik jak po przeliczeniu od nowa
+    for step in range(500):
+        index = rng.randrange(len(items))
+        if step % 10 == 0:
+            totals.remove(items.pop(index))
+        else:
+            items[index]['margin'] = round(rng.uniform(-20, 80), 2)
+            totals.update(items[index])
+    fresh = OfferTotals(items).snapshot()
+    assert totals.snapshot() == fresh
+    assert fresh['items'] == 1950 and len(fresh['by_category']) == 12
+    assert abs(sum(group['gross'] for group in fresh['by_vat']) - fresh['gross']) < 0.005
+    print(f"  ✓ 500 zmian przyrostowo = przeliczenie od nowa (brutto {fresh['gross']:.2f} zł)")
+    
+    # Model układu bez sum w offer_data - te same wartości co z OfferTotals
+    offer_data = {'title': 'Sumy', 'date': '01.01.2025', 'items': items}
+    layout = build_layout(offer_data)
+    assert layout['totals'] == {key: fresh[key] for key in ('items', 'net', 'vat', 'gross', 'by_vat')}
+    for section in layout['sections']:
+        assert section['gross_total'] == fresh['by_category'][section['category']]['gross']
+    
+    # Sumy przekazane w offer_data są używane bez przeliczania
+    offer_data['totals'] = totals.snapshot()
+    offer_data['totals']['gross'] = 123.45
+    assert build_layout(offer_data)['totals']['gross'] == 123.45
+    print("  ✓ build_layout używa offer_data['totals']")
+    
+    # Podsumowanie VAT w dokumentach
+    offer_data = {'title': 'Sumy', 'date': '01.01.2025', 'items': items[:30]}
+    offer_data['totals'] = OfferTotals(offer_data['items']).snapshot()
+    stream = io.BytesIO()
+    DOCXGenerator().render_offer_docx(offer_data, stream)
+    document = Document(io.BytesIO(stream.getvalue()))
+    summary = document.tables[-1]
+    assert summary.rows[0].cells[0].text == 'Stawka VAT'
+    assert summary.rows[-1].cells[0].text == 'Razem'
+    assert summary.rows[-1].cells[4].text == f"{offer_data['totals']['gross']:.2f} zł"
+    assert len(summary.rows) == 2 + len(offer_data['totals']['by_vat'])
+    stream = io.BytesIO()
+    PDFGenerator().render_offer_pdf(offer_data, stream)
+    assert stream.getvalue().startswith(b'%PDF')
+    print("  ✓ Podsumowanie VAT w PDF i DOCX")
+    
+    print("\n✅ TEST 24 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_offer_history():
+    """Test cofania i ponawiania zmian oferty"""
+    print("=" * 60)
+    print("TEST 25: Cofnij/ponów w edytorze oferty")
+    print("=" * 60)
+    
+    import copy
+    import random
+    import tracemalloc
+    from benchmarks import datagen
+    from offer_history import OfferHistory
+    from offer_totals import OfferTotals
+    
+    items = datagen.make_offer_items(10000)
+    original = copy.deepcopy(items)
+    history = OfferHistory(limit=1000)
+    totals = OfferTotals(items)
+    rng = random.Random(3)
+    
+    # Zmiany pól, usunięcia i jedna operacja zbiorcza
+    tracemalloc.start()
+    for step in range(300):
+        index = rng.randrange(len(items))
+        if step % 25 == 0:
+            history.record_removal(index, items[index])
+            totals.remove(items.pop(index))
+        else:
+            field, value = rng.choice([('margin', round(rng.uniform(0, 90), 1)), ('name', f"Zmiana {step}")])
+            history.record(index, field, items[index][field], value)
+            items[index][field] = value
+            totals.update(items[index])
+    with history.group():
+        for item_no in range(0, 1000, 10):
+            history.record(item_no, 'margin', items[item_no]['margin'], 99.0)
+            items[item_no]['margin'] = 99.0
+    history.record(0, 'name', items[0]['name'], items[0]['name'])  # bez zmiany - pomijana
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = history.stats()
+    assert stats['undo'] == 301 and stats['deltas'] == 400
+    assert current < 200 * 1024, f"Historia zajmuje {current} B"
+    print(f"  ✓ 400 zmian w {stats['undo']} krokach, {current / 1024:.0f} KB (oferta 10000 pozycji)")
+    edited = copy.deepcopy(items)
+    
+    # Cofnięcie operacji zbiorczej to jeden krok
+    changes = history.undo(items)
+    assert len(changes) == 100 and all(kind == 'update' for kind, _, _ in changes)
+    assert items[0]['margin'] != 99.0
+    
+    # Cofnięcie wszystkiego przywraca ofertę, sumy aktualizowane ze zmian
+    while history.can_undo:
+        for kind, index, item in history.undo(items):
+            if kind == 'update':
+                totals.update(item)
+            elif kind == 'insert':
+                totals.add(item)
+    assert items == original
+    assert totals.snapshot() == OfferTotals(original).snapshot()
+    print("  ✓ Cofnięcie wszystkich kroków przywraca ofertę i sumy")
+    
+    while history.can_redo:
+        history.redo(items)
+    assert items == edited
+    history.undo(items)
+    history.record(5, 'unit', items[5]['unit'], 'kg')
+    assert not history.can_redo
+    print("  ✓ Ponowienie wszystkich kroków; nowa zmiana czyści ponowienia")
+    
+    # Limit kroków
+    small = OfferHistory(limit=3)
+    rows = [{'margin': 0.0}]
+    for value in range(1, 6):
+        small.record(0, 'margin', rows[0]['margin'], float(value))
+        rows[0]['margin'] = float(value)
+    while small.can_undo:
+        small.undo(rows)
+    assert rows[0]['margin'] == 2.0
+    
+    print("\n✅ TEST 25 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_bulk_margins():
+    """Test zbiorczych zmian marż w ofercie"""
+    print("=" * 60)
+    print("TEST 26: Zbiorcze zmiany marż")
+    print("=" * 60)
+    
+    import subprocess
+    import sys
+    from benchmarks import datagen
+    from offer_layout import calculate_price
+    import offer_bulk
+    
+    items = datagen.make_offer_items(300, n_categories=5)
+    items[7]['purchase_price_net'] = 0.0
+    
+    # Marża dla kategorii
+    indices = offer_bulk.category_indices(items, 'Kategoria 002')
+    assert len(indices) == 60
+    changes = offer_bulk.set_margin(items, indices, 35)
+    assert [index for index, _ in changes] == [i for i in indices if items[i]['margin'] != 35.0]
+    assert all(margin == 35.0 for _, margin in changes)
+    print(f"  ✓ Marża kategorii: {len(changes)} zmian")
+    
+    # Zmiana cen o procent - cena netto rośnie o 10%
+    selected = [0, 5, 10, 299]
+    changes = dict(offer_bulk.change_prices(items, selected, 10))
+    assert sorted(changes) == selected
+    for index in selected:
+        before = calculate_price(items[index]['purchase_price_net'], items[index]['margin'], 23)['net_unit']
+        after = calculate_price(items[index]['purchase_price_net'], changes[index], 23)['net_unit']
+        assert abs(after - before * 1.1) <= 0.01 + items[index]['purchase_price_net'] * 0.0001
+    try:
+        offer_bulk.change_prices(items, selected, -100)
+        assert False, "Oczekiwano ValueError"
+    except ValueError:
+        pass
+    print("  ✓ Zmiana cen zaznaczonych o %")
+    
+    # Końcówki ,99 - po przeliczeniu calculate_price cena brutto kończy się na ,99
+    changes = offer_bulk.round_gross_to_99(items, range(len(items)))
+    changed = dict(changes)
+    assert 7 not in changed
+    for index, margin in changes:
+        item = items[index]
+        old_gross = calculate_price(item['purchase_price_net'], item['margin'], item['vat_rate'])['gross_unit']
+        item['margin'] = margin
+        gross = calculate_price(item['purchase_price_net'], margin, item['vat_rate'])['gross_unit']
+        assert f"{gross:.2f}".endswith('.99'), gross
+        assert 0 <= gross - old_gross < 1.0
+    assert offer_bulk.round_gross_to_99(items, range(len(items))) == []
+    print(f"  ✓ Końcówki ,99: {len(changes)} pozycji, ponowne wywołanie bez zmian")
+    
+    # numpy ładowane dopiero przy pierwszej operacji
+    code = "import sys, offer_bulk; assert 'numpy' not in sys.modules"
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    print("  ✓ Import modułu nie ładuje numpy")
+    
+    print("\n✅ TEST 26 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_product_index():
+    """Test indeksu prefiksowego produktów (podpowiedzi w edytorze oferty)"""
+    print("=" * 60)
+    print("TEST 27: Indeks podpowiedzi produktów")
+    print("=" * 60)
+    
+    import random
+    import time
+    from benchmarks import datagen
+    from offer_history import OfferHistory
+    from product_index import ProductIndex, name_tokens
+    
+    db_path = "test_index.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = Database(db_path)
+    db.add_category("Elektryka", 25.0)
+    category_id = db.get_categories()[0]['id']
+    
+    # Indeks podłączony do pustej bazy, import (scalenie) i pojedyncze zapisy (wstawianie)
+    # Długie opóźnienie - zapisy nie aktualizują indeksu w obserwatorze, dopiero flush
+    index = ProductIndex(flush_delay=60).attach(db)
+    assert len(index) == 0
+    products = datagen.make_products(2000, [category_id])
+    db.import_products_batch(products)
+    assert len(index) == 0
+    index.flush()
+    assert len(index) == 2000
+    db.add_product("KAB-1", "Uchwyt sufitowy", "szt.", 10.0, 23.0, category_id)
+    db.add_product("ABC-1", "Śruba sześciokątna M8x40", "szt.", 0.5, 23.0, category_id)
+    index.flush()
+    assert index.search("abc-")[0]['code'] == "ABC-1"
+    assert index.search("śrub m8")[0]['code'] == "ABC-1"
+    assert index.search("M8X4 ŚRUBA")[0]['code'] == "ABC-1"
+    # Najpierw dopasowania kodu, potem słów nazwy
+    results = index.search("kab")
+    assert results[0]['code'] == "KAB-1" and len(results) == 10
+    assert all(any(t.startswith("kab") for t in name_tokens(r['name'])) for r in results[1:])
+    print(f"  ✓ Import {len(products)} produktów i dodanie pojedynczych - indeks aktualny")
+    
+    # Zmiana nazwy, usunięcie i import zmieniający kilka produktów
+    product_id = index.search("abc-1")[0]['id']
+    db.update_product(product_id, "ABC-1", "Wkręt do drewna", "szt.", 0.5, 23.0, category_id)
+    index.flush()
+    assert index.search("śrub m8") == []
+    assert index.search("wkręt do drew")[0]['id'] == product_id
+    db.delete_product(product_id)
+    index.flush()
+    assert index.search("abc-1") == []
+    changed = [dict(products[i], name=f"Zmieniony towar {i}") for i in range(5)]
+    db.import_products_batch(changed)
+    index.flush()
+    assert [r['code'] for r in index.search("zmienion")] == [p['code'] for p in changed]
+    assert len(index) == 2001
+    print("  ✓ Zmiana nazwy, usunięcie i import zmian widoczne w podpowiedziach")
+    
+    # Wyniki zgodne z pełnym przeszukaniem
+    catalogue = {r['id']: (r['code'], r['name']) for r in db.get_products()}
+    rng = random.Random(5)
+    for _ in range(50):
+        words = name_tokens(rng.choice(list(catalogue.values()))[1])
+        query = " ".join(word[:rng.randint(1, len(word))] for word in rng.sample(words, rng.randint(1, 2)))
+        expected = {pid for pid, (code, name) in catalogue.items()
+                    if code.lower().startswith(query)
+                    or all(any(t.startswith(w) for t in name_tokens(name)) for w in name_tokens(query))}
+        results = index.search(query, limit=10)
+        assert len(results) == min(10, len(expected)), query
+        assert {r['id'] for r in results} <= expected, query
+    print("  ✓ Wyniki zgodne z pełnym przeszukaniem katalogu")
+    
+    # Błąd obserwatora nie przerywa zapisu
+    def failing(event, data):
+        raise RuntimeError("test")
+    db.add_listener(failing)
+    assert db.add_product("NEW-1", "Nowy produkt", "szt.", 1.0, 23.0, category_id)
+    db.remove_listener(failing)
+    index.flush()
+    assert index.search("new-1")[0]['name'] == "Nowy produkt"
+    index.detach()
+    db.add_product("NEW-2", "Po odłączeniu", "szt.", 1.0, 23.0, category_id)
+    index.flush()
+    assert index.search("new-2") == []
+    print("  ✓ Błąd obserwatora i odłączenie indeksu")
+    
+    # Aktualizacja w tle po opóźnieniu - import wielu partii scalany naraz
+    index = ProductIndex(flush_delay=0.05).attach(db)
+    renamed = [dict(p, name=f"Przemianowany towar {i}") for i, p in enumerate(products[:1500])]
+    for start in range(0, len(renamed), 500):
+        db.import_products_batch(renamed[start:start + 500])
+    deadline = time.time() + 5
+    while len(index.search("przemianow", limit=2000)) < 1500 and time.time() < deadline:
+        time.sleep(0.02)
+    assert len(index.search("przemianow", limit=2000)) == 1500
+    assert index.search(products[0]['code'])[0]['name'] == "Przemianowany towar 0"
+    assert len(index) == 2003
+    index.detach()
+    print("  ✓ Zmiany aktualizowane w tle po ostatniej partii importu")
+    
+    # Produkt bez kategorii dodany z podpowiedzi (marża i kategoria NULL w bazie)
+    from main import OfertomatApp
+    from offer_layout import build_layout
+    from offer_totals import OfferTotals
+    index = ProductIndex(flush_delay=60).attach(db)
+    db.add_product("BEZ-1", "Produkt bez kategorii", "szt.", 10.0, 23.0)
+    index.flush()
+    prod = db.get_product_by_id(index.search("bez-1")[0]['id'])
+    assert prod['default_margin'] is None and prod['category_name'] is None
+    item = OfertomatApp.offer_item(prod)
+    assert item['margin'] == 30.0 and item['category_name'] == 'Brak'
+    offer_items = [OfertomatApp.offer_item(db.get_product_by_id(index.search("kab-1")[0]['id'])), item]
+    totals = OfferTotals(offer_items[:1])
+    totals.add(item)
+    layout = build_layout({'items': offer_items, 'totals': totals.snapshot()})
+    assert [section['category'] for section in layout['sections']] == sorted([offer_items[0]['category_name'], 'Brak'])
+    index.detach()
+    db.close()
+    os.remove(db_path)
+    print("  ✓ Produkt bez kategorii dodany do oferty z podpowiedzi")
+    
+    # Czas podpowiedzi na dużym katalogu
+    big = ProductIndex()
+    big.load((i, p['code'], p['name']) for i, p in enumerate(datagen.make_products(100000)))
+    queries = ["śruba", "P0000123", "kabel biał", "p", "xyz"]
+    start = time.perf_counter()
+    for _ in range(100):
+        for query in queries:
+            big.search(query)
+    per_query = (time.perf_counter() - start) / (100 * len(queries)) * 1000
+    assert per_query < 1.0, per_query
+    print(f"  ✓ 100 000 produktów: {per_query:.3f} ms na zapytanie")
+    
+    # Dodanie pozycji do oferty jako krok historii
+    items = datagen.make_offer_items(3)
+    history = OfferHistory()
+    items.append({'name': 'Dodany', 'margin': 30.0})
+    history.record_insertion(3, items[3])
+    assert history.undo(items) == [('remove', 3, {'name': 'Dodany', 'margin': 30.0})] and len(items) == 3
+    assert history.redo(items)[0][0] == 'insert' and items[3]['name'] == 'Dodany'
+    print("  ✓ Dodanie pozycji cofane i ponawiane")
+    
+    print("\n✅ TEST 27 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_category_tree():
+    """Test drzewa kategorii - tabela domknięcia, dziedziczenie marż, poddrzewa"""
+    print("=" * 60)
+    print("TEST 28: Hierarchia kategorii")
+    print("=" * 60)
+    
+    import sqlite3
+    from category_selector import CategoryTreeSelector
+    
+    db_path = "test_category_tree.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    
+    # Baza sprzed drzewa kategorii - migracja dopisuje parent_id i CategoryTree
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE Categories (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, "
+                 "default_margin REAL DEFAULT 0.0)")
+    conn.executemany("INSERT INTO Categories (name, default_margin) VALUES (?, ?)", [("Stara", 12.0), ("Inna", 18.0)])
+    conn.commit()
+    conn.close()
+    db = Database(db_path)
+    old = {c['name']: c for c in db.get_categories()}
+    assert old['Stara']['parent_id'] is None and old['Stara']['effective_margin'] == 12.0
+    print("  ✓ Migracja płaskich kategorii")
+    
+    # Drzewo: Budowlane (40) > Mocowania (dziedziczy) > Kotwy (dziedziczy); Budowlane > Chemia (20)
+    db.add_category("Budowlane", 40.0)
+    ids = {c['name']: c['id'] for c in db.get_categories()}
+    db.add_category("Mocowania", None, ids['Budowlane'])
+    db.add_category("Chemia", 20.0, ids['Budowlane'])
+    ids = {c['name']: c['id'] for c in db.get_categories()}
+    db.add_category("Kotwy", None, ids['Mocowania'])
+    ids = {c['name']: c['id'] for c in db.get_categories()}
+    try:
+        db.add_category("Bez marży", None)
+        assert False, "Oczekiwano ValueError"
+    except ValueError:
+        pass
+    
+    tree = db.get_category_tree()
+    assert [(c['name'], c['depth']) for c in tree][:5] == [
+        ("Budowlane", 0), ("Chemia", 1), ("Mocowania", 1), ("Kotwy", 2), ("Inna", 0)]
+    assert next(c for c in tree if c['name'] == "Budowlane")['children'] == 2
+    margins = {c['name']: c['effective_margin'] for c in tree}
+    assert margins['Mocowania'] == 40.0 and margins['Kotwy'] == 40.0 and margins['Chemia'] == 20.0
+    print("  ✓ Drzewo kategorii i dziedziczone marże")
+    
+    for i, name in enumerate(["Budowlane", "Mocowania", "Kotwy", "Chemia", "Inna"]):
+        db.add_product(f"T{i}", f"Produkt {name}", "szt.", 10.0, 23.0, ids[name])
+    
+    def subtree(*names):
+        return {p['name']: p['default_margin'] for p in db.get_products_in_subtrees([ids[n] for n in names])}
+    assert subtree("Budowlane") == {"Produkt Budowlane": 40.0, "Produkt Mocowania": 40.0,
+                                    "Produkt Kotwy": 40.0, "Produkt Chemia": 20.0}
+    assert subtree("Mocowania") == {"Produkt Mocowania": 40.0, "Produkt Kotwy": 40.0}
+    assert len(db.get_products_in_subtrees([ids['Budowlane'], ids['Kotwy']])) == 4
+    assert db.get_products(ids['Kotwy'])[0]['default_margin'] == 40.0
+    
+    # Zmiana marży przodka zmienia marże dziedziczone
+    db.update_category(ids['Budowlane'], "Budowlane", 45.0)
+    assert subtree("Kotwy") == {"Produkt Kotwy": 45.0}
+    db.update_category(ids['Mocowania'], "Mocowania", 33.0)
+    assert subtree("Budowlane")["Produkt Kotwy"] == 33.0
+    db.update_category(ids['Mocowania'], "Mocowania", None)
+    print("  ✓ Produkty poddrzewa z marżą po dziedziczeniu")
+    
+    # Przenoszenie gałęzi
+    assert db.move_category(ids['Budowlane'], ids['Kotwy']) == False
+    assert db.move_category(ids['Kotwy'], ids['Chemia']) == True
+    assert subtree("Mocowania") == {"Produkt Mocowania": 45.0}
+    assert subtree("Chemia") == {"Produkt Chemia": 20.0, "Produkt Kotwy": 20.0}
+    assert db.move_category(ids['Mocowania'], None) == True
+    moved = next(c for c in db.get_categories() if c['name'] == "Mocowania")
+    assert moved['parent_id'] is None and moved['default_margin'] == 45.0
+    
+    # Przeniesienie ze zmianą nazwy zapisywane razem albo wcale
+    def category(category_id):
+        return next(c for c in db.get_categories() if c['id'] == category_id)
+    assert db.update_category(ids['Kotwy'], "Budowlane", None, ids['Mocowania']) == False
+    assert category(ids['Kotwy'])['name'] == "Kotwy" and category(ids['Kotwy'])['parent_id'] == ids['Chemia']
+    assert db.update_category(ids['Chemia'], "Chemia 2", None, ids['Kotwy']) == False
+    assert category(ids['Chemia'])['name'] == "Chemia"
+    assert db.update_category(ids['Kotwy'], "Kotwy chemiczne", None, ids['Mocowania']) == True
+    assert category(ids['Kotwy'])['name'] == "Kotwy chemiczne"
+    assert subtree("Mocowania") == {"Produkt Mocowania": 45.0, "Produkt Kotwy": 45.0}
+    assert db.update_category(ids['Kotwy'], "Kotwy", None, ids['Chemia']) == True
+    assert subtree("Chemia") == {"Produkt Chemia": 20.0, "Produkt Kotwy": 20.0}
+    
+    # Tabela domknięcia zgodna z odbudową z parent_id
+    conn = db.get_connection()
+    closure = set(conn.execute('SELECT * FROM CategoryTree').fetchall())
+    db._rebuild_category_tree(conn.cursor())
+    assert set(conn.execute('SELECT * FROM CategoryTree').fetchall()) == closure
+    conn.rollback()
+    conn.close()
+    print("  ✓ Przeniesienie gałęzi, odrzucenie cyklu, spójna tabela domknięcia")
+    
+    # Zmiana cen kategorii obejmuje podkategorie; usuwanie tylko liści bez produktów
+    assert db.reprice_products(10, category_ids=[ids['Budowlane']], dry_run=True)['products'] == 3
+    db.add_category("Pusta", None, ids['Chemia'])
+    empty_id = next(c['id'] for c in db.get_categories() if c['name'] == "Pusta")
+    assert db.delete_category(ids['Chemia']) == False
+    assert db.delete_category(empty_id) == True
+    assert subtree("Budowlane").keys() == {"Produkt Budowlane", "Produkt Chemia", "Produkt Kotwy"}
+    print("  ✓ Zmiana cen gałęzi i usuwanie kategorii")
+    
+    # Wybór gałęzi w widoku oferty
+    updates = []
+    selector = CategoryTreeSelector(db.get_category_tree(), lambda *c: updates.append(c))
+    names = [c['name'] for c in selector.categories]
+    assert [names[i] for i in selector.visible()] == ["Budowlane", "Inna", "Mocowania", "Stara"]
+    budowlane = names.index("Budowlane")
+    selector.toggle_expanded(budowlane)
+    assert [names[i] for i in selector.visible()][:2] == ["Budowlane", "Chemia"]
+    assert len(selector.control.controls) == 5
+    selector.set_checked(budowlane, True)
+    assert selector.selected_ids() == [ids['Budowlane']]
+    selector.set_checked(names.index("Kotwy"), False)
+    assert selector.selected_ids() == []
+    selector.set_checked(budowlane, True)
+    selector.set_checked(names.index("Chemia"), False)
+    selector.set_checked(names.index("Kotwy"), True)
+    assert selector.selected_ids() == [ids['Kotwy']] and updates
+    print("  ✓ Wybór gałęzi drzewa kategorii")
+    
+    db.close()
+    os.remove(db_path)
+    
+    print("\n✅ TEST 28 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
+def test_customer_margins():
+    """Test marż klientów - nadpisania kategorii i produktów, jedno zapytanie"""
+    print("=" * 60)
+    print("TEST 29: Cenniki klientów")
+    print("=" * 60)
+    
+    from benchmarks import datagen
+    
+    db_path = "test_customers.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = Database(db_path)
+    
+    # Budowlane (40) > Mocowania (dziedziczy) > Kotwy (dziedziczy); Chemia (20)
+    db.add_category("Budowlane", 40.0)
+    db.add_category("Chemia", 20.0)
+    ids = {c['name']: c['id'] for c in db.get_categories()}
+    db.add_category("Mocowania", None, ids['Budowlane'])
+    ids = {c['name']: c['id'] for c in db.get_categories()}
+    db.add_category("Kotwy", None, ids['Mocowania'])
+    ids = {c['name']: c['id'] for c in db.get_categories()}
+    for code, category in [("K1", "Kotwy"), ("K2", "Kotwy"), ("M1", "Mocowania"), ("C1", "Chemia")]:
+        db.add_product(code, f"Produkt {code}", "szt.", 10.0, 23.0, ids[category])
+    products = {p['code']: p['id'] for p in db.get_products()}
+    
+    assert db.add_customer("Hurtownia") == True
+    assert db.add_customer("Hurtownia") == False
+    db.add_customer("Detal")
+    customers = {c['name']: c['id'] for c in db.get_customers()}
+    hurt = customers['Hurtownia']
+    
+    def margins(customer_id, *category_names):
+        rows = db.get_products_in_subtrees([ids[n] for n in category_names], customer_id)
+        return {p['code']: (p['default_margin'], p['margin_source']) for p in rows}
+    
+    # Bez nadpisań - marże kategorii
+    base = {"K1": (40.0, 'category'), "K2": (40.0, 'category'), "M1": (40.0, 'category'),
+            "C1": (20.0, 'category')}
+    assert margins(None, "Budowlane", "Chemia") == base
+    assert margins(customers['Detal'], "Budowlane", "Chemia") == base
+    
+    # Marża klienta dla gałęzi, bliższej kategorii i produktu
+    db.set_customer_category_margin(hurt, ids['Mocowania'], 15.0)
+    db.set_customer_product_margins(hurt, {products['K2']: 7.0})
+    assert margins(hurt, "Budowlane", "Chemia") == {
+        "K1": (15.0, 'customer_category'), "K2": (7.0, 'product'), "M1": (15.0, 'customer_category'),
+        "C1": (20.0, 'category')}
+    db.set_customer_category_margin(hurt, ids['Kotwy'], 12.0)
+    assert db.resolve_customer_margins(hurt) == {
+        products['K1']: 12.0, products['K2']: 7.0, products['M1']: 15.0, products['C1']: 20.0}
+    assert db.resolve_customer_margins(hurt, [products['M1']]) == {products['M1']: 15.0}
+    assert db.get_product_by_id(products['K2'], hurt)['default_margin'] == 7.0
+    assert db.get_product_by_id(products['K2'])['default_margin'] == 40.0
+    print("  ✓ Kolejność marż: produkt klienta, najbliższa kategoria klienta, kategoria")
+    
+    hurt_row = next(c for c in db.get_customers() if c['id'] == hurt)
+    assert hurt_row['category_margins'] == 2 and hurt_row['product_margins'] == 1
+    overrides = db.get_customer_margins(hurt)
+    assert [o['category_name'] for o in overrides['categories']] == ["Kotwy", "Mocowania"]
+    assert overrides['products'] == [{'product_id': products['K2'], 'code': "K2", 'name': "Produkt K2",
+                                      'margin': 7.0}]
+    
+    # Usuwanie nadpisań, produktu i klienta
+    db.set_customer_category_margin(hurt, ids['Kotwy'], None)
+    assert db.resolve_customer_margins(hurt, [products['K1']]) == {products['K1']: 15.0}
+    db.delete_product(products['K2'])
+    assert db.get_customer_margins(hurt)['products'] == []
+    assert db.delete_customer(hurt) == True
+    conn = db.get_connection()
+    assert conn.execute('SELECT COUNT(*) FROM CustomerCategoryMargins').fetchone()[0] == 0
+    conn.close()
+    db.close()
+    os.remove(db_path)
+    print("  ✓ Usuwanie marż, produktów i klientów")
+    
+    # Zgodność z wyliczeniem w Pythonie na losowym drzewie i klientach
+    db_path = "test_customers_random.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = Database(db_path)
+    datagen.populate_category_tree(db, 2000, roots=3, fanout=3)
+    customer_ids = datagen.populate_customers(db, 5, category_overrides=6, product_overrides=100)
+    categories = {c['id']: c for c in db.get_categories()}
+    catalogue = {p['id']: p['category_id'] for p in db.get_products()}
+    
+    def chain(category_id):
+        while category_id is not None:
+            yield category_id
+            category_id = categories[category_id]['parent_id']
+    
+    for customer_id in customer_ids:
+        overrides = db.get_customer_margins(customer_id)
+        by_category = {o['category_id']: o['margin'] for o in overrides['categories']}
+        by_product = {o['product_id']: o['margin'] for o in overrides['products']}
+        expected = {}
+        for product_id, category_id in catalogue.items():
+            customer = [by_category[c] for c in chain(category_id) if c in by_category]
+            default = [categories[c]['default_margin'] for c in chain(category_id)
+                       if categories[c]['default_margin'] is not None]
+            expected[product_id] = by_product.get(product_id, customer[0] if customer else default[0])
+        assert db.resolve_customer_margins(customer_id) == expected
+    db.close()
+    os.remove(db_path)
+    print(f"  ✓ {len(customer_ids)} klientów × {len(catalogue)} produktów zgodnych z wyliczeniem w Pythonie")
+    
+    print("\n✅ TEST 29 ZAKOŃCZONY POMYŚLNIE\n")
+    return True
+
 if __name__ == "__main__":
     print("\n" + "=" * 60)
     print(" OFERTOMAT - TESTY END-TO-END")
@@ -317,6 +2250,31 @@ if __name__ == "__main__":
         test_import_functionality()
         test_pdf_generation()
         test_integration()
+        test_lazy_startup()
+        test_import_preview()
+        test_streaming_import()
+        test_multi_file_import()
+        test_import_change_detection()
+        test_benchmark_harness()
+        test_instrumentation()
+        test_sql_trace()
+        test_offer_server()
+        test_render_cache()
+        test_section_memoization()
+        test_stream_output()
+        test_multi_format_rendering()
+        test_spreadsheet_streaming()
+        test_bulk_repricing()
+        test_write_queue()
+        test_async_database()
+        test_update_scheduler()
+        test_offer_editor()
+        test_offer_totals()
+        test_offer_history()
+        test_bulk_margins()
+        test_product_index()
+        test_category_tree()
+        test_customer_margins()
         
         print("=" * 60)
         print("✅ WSZYSTKIE TESTY PRZESZŁY POMYŚLNIE! ✅")
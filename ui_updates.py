@@ -0,0 +1,128 @@
+"""
+Łączenie odświeżeń interfejsu Flet w jedno na klatkę
+
+Zamiast page.update() po każdej zmianie widok zgłasza request():
+- request() bez argumentów - zmieniła się struktura strony (widok, okno, snackbar),
+- request(kontrolka, ...) - zmieniły się tylko te kontrolki.
+
+UpdateScheduler zbiera zgłoszenia i wysyła je raz na klatkę (FRAME_SECONDS)
+w pętli zdarzeń strony: page.update() jeśli strona jest "brudna", inaczej
+page.update(*kontrolki) - jedna paczka poleceń zamiast kilku pełnych porównań.
+
+Przy włączonej instrumentacji każde wysłanie jest rejestrowane jako
+"UI.update:<funkcje zgłaszające>" z liczbą poleceń (rows) i rozmiarem
+wysłanych danych (bytes).
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+from typing import Dict, Set
+
+import instrumentation
+
+FRAME_SECONDS = 1 / 60
+
+
+class UpdateScheduler:
+    """Zbiera zgłoszenia odświeżenia strony i wysyła je raz na klatkę"""
+
+    def __init__(self, page, frame_seconds: float = FRAME_SECONDS):
+        self.page = page
+        self.frame_seconds = frame_seconds
+        self.stats = {'requests': 0, 'flushes': 0, 'page_updates': 0, 'control_updates': 0}
+        self._lock = threading.Lock()
+        self._page_dirty = False
+        self._controls: Dict[int, object] = {}
+        self._actions: Set[str] = set()
+        self._scheduled = False
+        self._meter = threading.local()
+        self._install_payload_meter()
+
+    def request(self, *controls):
+        """Zgłasza zmianę strony (bez argumentów) lub wskazanych kontrolek"""
+        with self._lock:
+            self.stats['requests'] += 1
+            if controls:
+                for control in controls:
+                    self._controls[id(control)] = control
+            else:
+                self._page_dirty = True
+            if instrumentation.is_enabled():
+                self._actions.add(sys._getframe(1).f_code.co_name)
+            if self._scheduled:
+                return
+            self._scheduled = True
+
+        loop = getattr(self.page, 'loop', None)
+        if loop is None or loop.is_closed():
+            # Strona bez pętli zdarzeń - od razu
+            self.flush()
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            loop.call_later(self.frame_seconds, self.flush)
+        else:
+            # Obsługa zdarzeń synchronicznych działa w wątkach Flet
+            loop.call_soon_threadsafe(loop.call_later, self.frame_seconds, self.flush)
+
+    def flush(self):
+        """Wysyła zebrane zmiany (wywoływane przez pętlę zdarzeń lub ręcznie)"""
+        with self._lock:
+            page_dirty = self._page_dirty
+            controls = list(self._controls.values())
+            actions = self._actions
+            self._page_dirty = False
+            self._controls = {}
+            self._actions = set()
+            self._scheduled = False
+        if not page_dirty and not controls:
+            return
+
+        # Kontrolka jeszcze nie dodana do strony - potrzebne pełne odświeżenie
+        if not page_dirty and any(getattr(control, 'page', None) is None for control in controls):
+            page_dirty = True
+
+        self._meter.counter = [0, 0]
+        start = time.perf_counter()
+        try:
+            if page_dirty:
+                self.page.update()
+                self.stats['page_updates'] += 1
+            else:
+                self.page.update(*controls)
+                self.stats['control_updates'] += len(controls)
+        finally:
+            commands, payload = self._meter.counter
+            self._meter.counter = None
+            self.stats['flushes'] += 1
+            if instrumentation.is_enabled():
+                name = 'UI.update:' + ('+'.join(sorted(actions)) or 'inne')
+                instrumentation.record(name, time.perf_counter() - start, commands, payload)
+
+    def _install_payload_meter(self):
+        """Opakowuje wysyłanie poleceń połączenia strony - liczy polecenia i bajty wysyłane przez flush"""
+        conn = getattr(self.page, 'connection', None)
+        if conn is None or not hasattr(conn, 'send_commands'):
+            return
+        send_commands = conn.send_commands
+        meter = self._meter
+
+        def metered_send_commands(session_id, commands):
+            counter = getattr(meter, 'counter', None)
+            if counter is not None and instrumentation.is_enabled():
+                from flet.core.protocol import CommandEncoder
+                counter[0] += len(commands)
+                counter[1] += len(json.dumps(commands, cls=CommandEncoder, separators=(',', ':')))
+            return send_commands(session_id, commands)
+
+        conn.send_commands = metered_send_commands
+
+    def snapshot(self) -> Dict:
+        stats = dict(self.stats)
+        stats['coalesced'] = stats['requests'] - stats['flushes']
+        return stats